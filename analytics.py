@@ -0,0 +1,239 @@
+import threading
+from operator import attrgetter, itemgetter
+
+import numpy as np
+import pandas as pd
+
+# Engagement analytics over Database snapshots, kept in per-day buckets and updated
+# incrementally. Posts, messages and interactions (likes and comments, see
+# Database.interactions) are append-only, so an update turns only the rows appended
+# since the previous one into a DataFrame, groups it by day and folds each group into
+# that day's bucket; days nothing landed in are never touched again. The first update,
+# and the first after a bulk load replaced the logs, also folds in the likes and
+# comments already hanging off posts: comments by their timestamp, likes by the time
+# logged for them or, for likes from bulk loads, which carry none, into an undated
+# total. Tasks have no timestamps either, so the completion funnel is a status count,
+# recomputed only when tasks change.
+RESPONSE_WINDOW = pd.Timedelta(hours=24)  # a reply later than this starts a new conversation instead
+FUNNEL_STAGES = ("Created", "Started", "Done")
+
+# Builds a frame column by column; timestamps are converted in one pandas call, which is
+# several times faster than letting the constructor infer them row by row.
+def _frame(records, getters):
+    return pd.DataFrame({name: (pd.to_datetime(list(map(get, records))) if name == "timestamp"
+                                else list(map(get, records)))
+                         for name, get in getters.items()})
+
+class DayBucket:
+    def __init__(self):
+        self.active_users = set()
+        self.posts = pd.Series(dtype="int64")  # (community_id, tag) -> posts
+        self.counts = {"comments": 0, "likes": 0, "messages": 0}
+        self.response_seconds = []  # arrays of reply delays, one per update
+        self._median = None
+
+    def add_posts(self, counts):
+        self.posts = counts if self.posts.empty else self.posts.add(counts, fill_value=0).astype("int64")
+
+    def add_replies(self, seconds):
+        self.response_seconds.append(seconds)
+        self._median = None
+
+    @property
+    def replies(self):
+        return sum(len(s) for s in self.response_seconds)
+
+    @property
+    def median_response_seconds(self):
+        if self._median is None and self.response_seconds:
+            self._median = float(np.median(np.concatenate(self.response_seconds)))
+        return self._median
+
+# One instance is shared by every session of a process (see app.get_analytics). update()
+# and the queries take a lock, so a rerun never reads a half-folded update.
+class EngagementAnalytics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._started = False
+        self.days = {}  # day (midnight Timestamp) -> DayBucket
+        self.undated_likes = 0
+        self._seen = {"posts": 0, "messages": 0, "interactions": 0}
+        self._last = {}  # log name -> key of the last record folded in, to notice a reload
+        self._conversations = {}  # (user_id, user_id) sorted -> (sender_id, timestamp) of the last message
+        self._tasks_version = None
+        self.funnel = pd.Series(0, index=FUNNEL_STAGES, dtype="int64")
+
+    @staticmethod
+    def _key(name, record):
+        if name == "posts":
+            return record.post_id, record.timestamp
+        if name == "messages":
+            return record.message_id
+        return record
+
+    def _appended(self, snap, name):
+        log = getattr(snap, name, ())
+        seen = self._seen[name]
+        if len(log) < seen or (seen and self._key(name, log[seen - 1]) != self._last[name]):
+            return None
+        return log[seen:]
+
+    # Folds in what `snap` holds beyond the previous update. Returns True when anything changed.
+    def update(self, snap):
+        with self._lock:
+            batches = {name: self._appended(snap, name) for name in self._seen}
+            changed = False
+            if not self._started or any(batch is None for batch in batches.values()):
+                self._reset()
+                self._started = True
+                batches = {name: list(getattr(snap, name, ())) for name in ("posts", "messages")}
+                # Comments so far are counted from the posts they hang off; of the likes, the
+                # ones logged as interactions keep their time and only the rest go undated
+                interactions = list(getattr(snap, "interactions", ()))
+                likes = [i for i in interactions if i[1] == "like"]
+                self._fold_attached(batches["posts"], len(likes))
+                if likes:
+                    self._fold_interactions(likes)
+                batches["interactions"] = []
+                self._seen["interactions"] = len(interactions)
+                if interactions:
+                    self._last["interactions"] = interactions[-1]
+                changed = True
+            for name, fold in (("posts", self._fold_posts), ("messages", self._fold_messages),
+                               ("interactions", self._fold_interactions)):
+                batch = batches[name]
+                if batch:
+                    fold(batch)
+                    self._seen[name] += len(batch)
+                    self._last[name] = self._key(name, batch[-1])
+                    changed = True
+            tasks_version = snap.data_version("tasks")
+            if tasks_version != self._tasks_version:
+                self._fold_tasks(snap.tasks)
+                self._tasks_version = tasks_version
+                changed = True
+            return changed
+
+    def _bucket(self, day):
+        bucket = self.days.get(day)
+        if bucket is None:
+            bucket = self.days[day] = DayBucket()
+        return bucket
+
+    def _add_active(self, df, user_column):
+        for day, users in df.groupby("day")[user_column].unique().items():
+            self._bucket(day).active_users.update(users)
+
+    def _fold_posts(self, posts):
+        df = _frame(posts, {name: attrgetter(name) for name in ("user_id", "community_id", "tag", "timestamp")})
+        df["day"] = df["timestamp"].dt.floor("D")
+        counts = df.groupby(["day", "community_id", "tag"], dropna=False).size()
+        for day, day_counts in counts.groupby(level="day"):
+            self._bucket(day).add_posts(day_counts.droplevel("day"))
+        self._add_active(df, "user_id")
+
+    def _fold_attached(self, posts, dated_likes):
+        comments = [c for p in posts for c in p.comments]
+        self.undated_likes = max(0, sum(map(len, map(attrgetter("likes"), posts))) - dated_likes)
+        if comments:
+            self._fold_counts(_frame(comments, {"user_id": itemgetter("user_id"),
+                                                "timestamp": itemgetter("timestamp")}), "comments")
+
+    def _fold_counts(self, df, kind):
+        df["day"] = df["timestamp"].dt.floor("D")
+        for day, n in df.groupby("day").size().items():
+            self._bucket(day).counts[kind] += int(n)
+        self._add_active(df, "user_id")
+
+    def _fold_interactions(self, interactions):
+        df = _frame(interactions, {"timestamp": itemgetter(0), "kind": itemgetter(1), "user_id": itemgetter(2)})
+        for kind, rows in df.groupby("kind"):
+            self._fold_counts(rows.copy(), kind + "s")
+
+    # A reply is a message whose conversation's previous message came from the other
+    # side less than RESPONSE_WINDOW earlier; its delay is the response time. The last
+    # message of every conversation is carried over, so replies that straddle two
+    # updates are still seen.
+    def _fold_messages(self, messages):
+        df = _frame(messages, {name: attrgetter(name) for name in ("sender_id", "receiver_id", "timestamp")})
+        df["lo"] = np.minimum(df["sender_id"].to_numpy(), df["receiver_id"].to_numpy())
+        df["hi"] = np.maximum(df["sender_id"].to_numpy(), df["receiver_id"].to_numpy())
+        df["carried"] = False
+        conversations = self._conversations
+        carried = [(lo, hi, *conversations[lo, hi]) for lo, hi in set(zip(df["lo"], df["hi"]))
+                   if (lo, hi) in conversations]
+        if carried:
+            df = pd.concat([pd.DataFrame(carried, columns=["lo", "hi", "sender_id", "timestamp"]).assign(carried=True),
+                            df], ignore_index=True)
+        df = df.sort_values(["lo", "hi", "timestamp"], kind="stable")
+        grouped = df.groupby(["lo", "hi"], sort=False)
+        previous_sender = grouped["sender_id"].shift()
+        delay = df["timestamp"] - grouped["timestamp"].shift()
+        is_reply = (~df["carried"] & previous_sender.notna() & (df["sender_id"] != previous_sender)
+                    & (delay <= RESPONSE_WINDOW))
+        replies = pd.DataFrame({"day": df.loc[is_reply, "timestamp"].dt.floor("D"),
+                                "seconds": delay[is_reply].dt.total_seconds()})
+        for day, seconds in replies.groupby("day")["seconds"]:
+            self._bucket(day).add_replies(seconds.to_numpy())
+        last = df.drop_duplicates(["lo", "hi"], keep="last")
+        conversations.update(zip(zip(last["lo"], last["hi"]), zip(last["sender_id"], last["timestamp"])))
+        self._fold_counts(df.loc[~df["carried"], ["sender_id", "timestamp"]].rename(columns={"sender_id": "user_id"}),
+                          "messages")
+
+    def _fold_tasks(self, tasks):
+        status = pd.Series([t.status for t in tasks], dtype="object").value_counts()
+        done = int(status.get("Done", 0))
+        self.funnel = pd.Series([len(tasks), done + int(status.get("In Progress", 0)), done],
+                                index=FUNNEL_STAGES, dtype="int64")
+
+    # Queries. `start` (a date or Timestamp) limits them to days on or after it.
+    def _window(self, start):
+        start = pd.Timestamp(start).floor("D") if start is not None else None
+        return sorted((day, bucket) for day, bucket in self.days.items() if start is None or day >= start)
+
+    # Per-day post counts in the window, skipping days with only other activity
+    def _post_counts(self, start):
+        return [(day, b.posts) for day, b in self._window(start) if not b.posts.empty]
+
+    def last_day(self):
+        with self._lock:
+            return max(self.days) if self.days else None
+
+    # One row per day with data: active users, posts, comments, likes, messages, replies
+    # and the median reply delay in minutes.
+    def daily(self, start=None):
+        with self._lock:
+            rows = [{"day": day, "active_users": len(b.active_users), "posts": int(b.posts.sum()),
+                     **b.counts, "replies": b.replies,
+                     "median_response_min": (b.median_response_seconds / 60
+                                             if b.median_response_seconds is not None else None)}
+                    for day, b in self._window(start)]
+        columns = ["day", "active_users", "posts", "comments", "likes", "messages", "replies", "median_response_min"]
+        return pd.DataFrame(rows, columns=columns).set_index("day")
+
+    # Long frame of day, community_id, posts for the `top` busiest communities in the window
+    def posts_per_community(self, start=None, top=10):
+        with self._lock:
+            window = self._post_counts(start)
+            if not window:
+                return pd.DataFrame(columns=["day", "community_id", "posts"])
+            counts = pd.concat(dict(window), names=["day", "community_id", "tag"])
+        per_day = counts.groupby(level=["day", "community_id"], dropna=False).sum()
+        busiest = per_day.groupby(level="community_id", dropna=False).sum().nlargest(top).index
+        per_day = per_day[per_day.index.get_level_values("community_id").isin(busiest)]
+        return per_day.rename("posts").reset_index()
+
+    def tag_distribution(self, start=None):
+        with self._lock:
+            window = self._post_counts(start)
+            if not window:
+                return pd.Series(dtype="int64", name="posts", index=pd.Index([], name="tag"))
+            counts = pd.concat([posts for _, posts in window])
+        return counts.groupby(level="tag", dropna=False).sum().sort_values(ascending=False).rename("posts")
+
+    def task_funnel(self):
+        with self._lock:
+            return self.funnel.copy()
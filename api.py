@@ -1,46 +1,640 @@
-from fastapi import FastAPI, WebSocket, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Body, APIRouter, Request, Response, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import bisect
 import json
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
+from database import (Database, User, Community, Post, Message, StudyRoom, Task, RoomSweeper,
+                      notification_to_dict, snapshot_to_dict)
+from backends import make_backend
+from blobs import BlobStore, content_type
 
-app = FastAPI()
+# Notification storage and chat routing. With STUDYHIVE_STATE_BACKEND=sqlite every
+# `uvicorn --workers N` process sees the same notifications and can reach chat peers
+# connected to the other workers.
+backend = make_backend()
 
-# In-memory storage for notifications
-notifications = []
+# Expires old notifications and reclaims bookkeeping so the store stays bounded.
+async def compact_forever():
+    while True:
+        await asyncio.sleep(backend.retention.compact_interval)
+        try:
+            await backend.compact()
+        except Exception as e:
+            print(f"Notification compaction failed: {str(e)}")
 
-@app.post("/notify")
-async def notify(data: dict):
-    if not data.get("user_id") or not data.get("message"):
-        raise HTTPException(status_code=422, detail="user_id and message are required")
-    notification = {
+@asynccontextmanager
+async def lifespan(app):
+    await backend.start()
+    compactor = asyncio.create_task(compact_forever())
+    sweeper = (RoomSweeper(store, float(os.environ.get("STUDYHIVE_ROOM_SWEEP_INTERVAL", 60))).start()
+               if SERVE_DB else None)
+    try:
+        yield
+    finally:
+        compactor.cancel()
+        if sweeper:
+            sweeper.stop()
+        await backend.stop()
+
+# Rate limiting and load shedding. Each key (user id or client IP) owns a token bucket
+# that is refilled lazily from the elapsed time when it is next touched, so there are no
+# timers; idle buckets fall off the LRU end once max_keys is reached.
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.throttled = 0
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def take(self, key, cost=1, now=None):
+        # Returns 0 when the request may proceed, otherwise seconds until it would.
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.pop(key, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+            self.throttled += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+class Limits:
+    def __init__(self, user_rate=5.0, user_burst=30, ip_rate=100.0, ip_burst=500, max_inflight=256, max_sockets=2000):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.max_inflight = max_inflight
+        self.max_sockets = max_sockets
+
+    @classmethod
+    def from_env(cls):
+        defaults = cls()
+        def read(name, default):
+            value = os.environ.get(f"STUDYHIVE_{name.upper()}")
+            return type(default)(value) if value else default
+        return cls(**{name: read(name, value) for name, value in vars(defaults).items()})
+
+limits = Limits.from_env()
+notify_user_limiter = TokenBucketLimiter(limits.user_rate, limits.user_burst)
+notify_ip_limiter = TokenBucketLimiter(limits.ip_rate, limits.ip_burst)
+chat_user_limiter = TokenBucketLimiter(limits.user_rate, limits.user_burst)
+chat_ip_limiter = TokenBucketLimiter(limits.ip_rate, limits.ip_burst)
+active_sockets = 0
+inflight_requests = 0
+shed_requests = 0
+
+def client_ip(conn):
+    return conn.client.host if conn.client else "unknown"
+
+def check_rate(limiter, key, cost=1):
+    wait = limiter.take(key, cost)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many requests",
+                            headers={"Retry-After": str(math.ceil(wait))})
+
+# Plain ASGI middleware: rejecting with 503 before routing keeps a burst from queueing
+# unbounded work on the event loop, so requests already admitted keep their latency.
+# /db is exempt: it is the app's own storage, which a page cannot render without.
+class LoadShedMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global inflight_requests, shed_requests
+        if scope["type"] != "http" or scope["path"].startswith("/db/"):
+            return await self.app(scope, receive, send)
+        if inflight_requests >= limits.max_inflight:
+            shed_requests += 1
+            response = JSONResponse({"detail": "Server busy"}, status_code=503, headers={"Retry-After": "1"})
+            return await response(scope, receive, send)
+        inflight_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            inflight_requests -= 1
+
+# In-process metrics rendered in the Prometheus text format by GET /metrics. Recording
+# is a dict lookup and a few integer adds on the event loop thread, so no locking.
+class Histogram:
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels tuple -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, label_names):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            base = ",".join(f'{k}="{v}"' for k, v in zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.request_latency = Histogram("studyhive_http_request_duration_seconds",
+                                         "HTTP request latency by method, route and status.")
+        self.counters = {}  # (name, labels tuple) -> value
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def counter_lines(self, name, help_text, label_names=()):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        series = sorted((labels, v) for (n, labels), v in self.counters.items() if n == name)
+        if not series and not label_names:
+            series = [((), 0)]
+        for labels, value in series:
+            base = ",".join(f'{k}="{v}"' for k, v in zip(label_names, labels))
+            lines.append(f"{name}{{{base}}} {value}" if base else f"{name} {value}")
+        return lines
+
+metrics = Metrics()
+
+def sample_lines(name, help_text, value, kind="gauge"):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            metrics.request_latency.observe(
+                (scope["method"], route.path if route else "unmatched", str(status[0])),
+                time.perf_counter() - start)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(LoadShedMiddleware)
+app.add_middleware(MetricsMiddleware)  # outermost, so shed requests are timed too
+
+def make_notification(data):
+    if not isinstance(data, dict) or not data.get("user_id") or not data.get("message"):
+        return None
+    return {
         "user_id": data["user_id"],
         "message": data["message"],
-        "timestamp": datetime.now().isoformat()
+        "timestamp": time.time()
     }
-    notifications.append(notification)
+
+@app.post("/notify")
+async def notify(request: Request, data: dict):
+    check_rate(notify_ip_limiter, client_ip(request))
+    notification = make_notification(data)
+    if notification is None:
+        raise HTTPException(status_code=422, detail="user_id and message are required")
+    check_rate(notify_user_limiter, notification["user_id"])
+    await backend.add_notifications([notification])
+    metrics.inc("studyhive_notifications_accepted_total", ("notify",))
     return {"status": "Notification sent"}
 
+@app.post("/notify/batch")
+async def notify_batch(request: Request, data: list = Body(...)):
+    # One request costs one IP token. Invalid entries and entries for users over their
+    # own limit are skipped, so one bad item does not sink the whole batch.
+    check_rate(notify_ip_limiter, client_ip(request))
+    accepted = [n for n in map(make_notification, data)
+                if n is not None and not notify_user_limiter.take(n["user_id"])]
+    if accepted:
+        await backend.add_notifications(accepted)
+    metrics.inc("studyhive_notifications_accepted_total", ("batch",), len(accepted))
+    metrics.inc("studyhive_notifications_rejected_total", ("batch",), len(data) - len(accepted))
+    return {"status": "Notifications sent", "accepted": len(accepted), "rejected": len(data) - len(accepted)}
+
 @app.get("/notifications")
-async def get_notifications():
-    return notifications
+async def get_notifications(user_id: str = None):
+    return await backend.list_notifications(user_id)
+
+@app.get("/notifications/stats")
+async def get_notification_stats():
+    return await backend.stats()
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    stored = await backend.stats()
+    queues = backend.subscription_stats()
+    lines = metrics.request_latency.render(("method", "route", "status"))
+    lines += metrics.counter_lines("studyhive_notifications_accepted_total",
+                                   "Notifications stored, by endpoint; rate() gives /notify throughput.",
+                                   ("endpoint",))
+    lines += metrics.counter_lines("studyhive_notifications_rejected_total",
+                                   "Batch items rejected as invalid or over the user's rate limit.", ("endpoint",))
+    lines += metrics.counter_lines("studyhive_chat_messages_routed_total",
+                                   "Chat messages published to participants; rate() gives messages per second.")
+    lines += metrics.counter_lines("studyhive_chat_frames_dropped_total",
+                                   "Chat messages dropped for rate limits or size.", ("reason",))
+    lines += sample_lines("studyhive_notifications_stored", "Notifications currently held.", stored["entries"])
+    lines += sample_lines("studyhive_notifications_stored_bytes", "Approximate bytes held by notifications.",
+                          stored["approx_bytes"])
+    lines += sample_lines("studyhive_websocket_connections", "Open chat WebSocket connections.", active_sockets)
+    lines += sample_lines("studyhive_send_queue_depth_total", "Messages waiting in chat send queues.", queues["queued"])
+    lines += sample_lines("studyhive_send_queue_depth_max", "Deepest chat send queue.", queues["max_queue_depth"])
+    lines += sample_lines("studyhive_send_queue_dropped", "Messages dropped by full send queues of open sockets.",
+                          queues["dropped"])
+    lines += sample_lines("studyhive_http_inflight_requests", "HTTP requests in progress.", inflight_requests)
+    lines += sample_lines("studyhive_http_shed_requests_total", "HTTP requests rejected with 503.",
+                          shed_requests, "counter")
+    lines += sample_lines("studyhive_rate_limited_total", "Requests and chat frames refused by token buckets.",
+                          sum(l.throttled for l in (notify_user_limiter, notify_ip_limiter,
+                                                    chat_user_limiter, chat_ip_limiter)), "counter")
+    lines += sample_lines("studyhive_uptime_seconds", "Seconds since the process started.",
+                          round(time.time() - metrics.started, 3))
+    return "\n".join(lines) + "\n"
+
+# Each socket listens on its user's inbox channel and forwards only the messages of its
+# own conversation. A sent message goes to both participants' inboxes, which also
+# echoes it back to the sender (and to the sender's other tabs).
 @app.websocket("/chat/{sender_id}/{receiver_id}")
 async def websocket_endpoint(websocket: WebSocket, sender_id: str, receiver_id: str):
-    await websocket.accept()
+    global active_sockets
+    if active_sockets >= limits.max_sockets:
+        await websocket.close(code=1013)  # try again later
+        return
+    counted = False
+    inbox = forwarder = None
+    conversation = {sender_id, receiver_id}
+
+    async def forward():
+        while True:
+            message = await inbox.get()
+            if {message["sender_id"], message["receiver_id"]} == conversation:
+                await websocket.send_text(json.dumps(message))
+
     try:
+        await websocket.accept()
+        # Counted only once accepted, and released in the finally below however it ends
+        active_sockets += 1
+        counted = True
+        inbox = backend.subscribe(f"chat:{sender_id}")
+        forwarder = asyncio.create_task(forward())
         while True:
             data = await websocket.receive_text()
+            wait = chat_ip_limiter.take(client_ip(websocket)) or chat_user_limiter.take(sender_id)
+            if wait:
+                metrics.inc("studyhive_chat_frames_dropped_total", ("rate_limited",))
+                await websocket.send_text(json.dumps({"error": "rate_limited", "retry_after": round(wait, 3)}))
+                continue
             message = {
                 "sender_id": sender_id,
                 "receiver_id": receiver_id,
                 "content": data,
                 "timestamp": datetime.now().isoformat()
             }
-            await websocket.send_text(json.dumps(message))
+            try:
+                for user_id in conversation:
+                    await backend.publish(f"chat:{user_id}", message)
+                metrics.inc("studyhive_chat_messages_routed_total")
+            except ValueError as e:
+                metrics.inc("studyhive_chat_frames_dropped_total", ("too_large",))
+                await websocket.send_text(json.dumps({"error": str(e)}))
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         print(f"WebSocket error: {str(e)}")
     finally:
-        await websocket.close()
+        if counted:
+            active_sockets -= 1
+        if forwarder:
+            forwarder.cancel()
+        if inbox:
+            inbox.close()
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass  # already closed by the client
+
+# Profile pictures and other uploads. Blobs are content-addressed and never change, so
+# responses carry the blob id as ETag and may be cached by browsers for a year.
+blob_store = BlobStore.from_env()
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# An oversized upload is refused from its Content-Length before anything is read, and a
+# body without one (or lying about it) is read in chunks and dropped once it passes the
+# limit, so at most max_bytes of it is ever buffered.
+@app.post("/blobs")
+async def upload_blob(request: Request):
+    check_rate(notify_ip_limiter, client_ip(request))
+    try:
+        length = request.headers.get("content-length")
+        if length and length.isdigit():
+            blob_store.check_size(int(length))
+        chunks, size = [], 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            blob_store.check_size(size)
+            chunks.append(chunk)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        blob_id = await run_in_threadpool(blob_store.put, b"".join(chunks))  # thumbnailing is CPU work
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"blob_id": blob_id}
+
+@app.get("/blobs/{blob_id}")
+def get_blob(request: Request, blob_id: str, size: int = None):
+    path = blob_store.path(blob_id, size)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    etag = f'"{blob_id}-{size or "orig"}"'
+    headers = {"ETag": etag, "Cache-Control": BLOB_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    with open(path, "rb") as f:
+        media_type = content_type(f.read(4))
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+# Shared data store: every Streamlit process talks to this one authoritative Database
+# through app.DatabaseClient. Handlers are plain functions so FastAPI runs them in its
+# threadpool and the Database lock never blocks the event loop.
+# The Database lives in this process's memory, so only a single-worker API can serve it;
+# several workers would each hold, sweep and hand out their own diverging copy. uvicorn
+# takes its worker count from WEB_CONCURRENCY, and when that is above 1 /db is not mounted.
+def serves_db(environ=os.environ):
+    return int(environ.get("WEB_CONCURRENCY") or 1) <= 1
+
+SERVE_DB = serves_db()
+store = Database()
+db_router = APIRouter(prefix="/db")
+
+def _require(value, what):
+    if value is None:
+        raise HTTPException(status_code=404, detail=f"{what} not found")
+    return value
+
+# The whole store, for bulk tools (exports, analytics). Every write changes the version,
+# so renders use the targeted reads below instead of re-downloading it.
+@db_router.get("/snapshot")
+def get_snapshot(request: Request):
+    # The version is the ETag, so clients polling an unchanged store get a bodiless 304.
+    snap = store.snapshot()
+    etag = f'"{snap.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(snapshot_to_dict(snap), headers={"ETag": etag})
+
+@db_router.get("/version")
+def get_version():
+    return {"version": store.version}
+
+@db_router.get("/data_version")
+def get_data_version(collections: list[str] = Query([])):
+    return {"data_version": store.data_version(*collections)}
+
+@db_router.get("/leaderboard")
+def get_leaderboard(limit: int = None):
+    return store.leaderboard(limit)
+
+@db_router.get("/community_activity")
+def get_community_activity():
+    return store.community_activity()
+
+@db_router.post("/users")
+def create_user(data: dict):
+    try:
+        store.add_user(User.from_dict(data))
+    except ValueError as e:
+        raise HTTPException(status_code=409 if "taken" in str(e) else 422, detail=str(e))
+    return {"status": "created"}
+
+@db_router.get("/users")
+def list_users(username: str = None, ids: list[str] = Query(None)):
+    if username is not None:
+        user = store.find_user_by_username(username)
+        return [user.to_dict()] if user else []
+    if ids is not None:
+        return [u.to_dict() for u in store.get_users(ids).values()]
+    return [u.to_dict() for u in store.list_users()]
+
+@db_router.get("/users/{user_id}")
+def get_user(user_id: str):
+    return _require(store.get_user(user_id), "User").to_dict()
+
+@db_router.put("/users/{user_id}")
+def update_user(user_id: str, data: dict):
+    store.update_user(User.from_dict(dict(data, user_id=user_id)))
+    return {"status": "updated"}
+
+@db_router.get("/users/{user_id}/badges")
+def get_badges(user_id: str):
+    return [b.to_dict() for b in store.get_badges(user_id)]
+
+@db_router.post("/users/{user_id}/badges")
+def award_badge(user_id: str, data: dict):
+    _require(store.get_user(user_id), "User")
+    return {"awarded": store.award_badge(user_id, data["name"])}
+
+@db_router.get("/users/{user_id}/notifications")
+def get_user_notifications(user_id: str):
+    return [notification_to_dict(n) for n in store.get_notifications(user_id)]
+
+@db_router.post("/users/{user_id}/notifications")
+def notify_user(user_id: str, data: dict):
+    store.notify_user(user_id, data["message"])
+    return {"status": "notified"}
+
+@db_router.get("/users/{user_id}/timer")
+def get_timer(user_id: str):
+    return store.get_timer(user_id).to_dict()
+
+@db_router.post("/users/{user_id}/timer/toggle")
+def toggle_timer(user_id: str):
+    return store.toggle_timer(user_id).to_dict()
+
+@db_router.post("/communities")
+def create_community(data: dict):
+    store.add_community(Community.from_dict(data))
+    return {"status": "created"}
+
+@db_router.get("/communities")
+def list_communities(name: str = None, ids: list[str] = Query(None)):
+    if name is not None:
+        community = store.find_community_by_name(name)
+        return [community.to_dict()] if community else []
+    if ids is not None:
+        return [c.to_dict() for c in store.get_communities(ids).values()]
+    return [c.to_dict() for c in store.list_communities()]
+
+@db_router.get("/communities/{community_id}")
+def get_community(community_id: str):
+    return _require(store.get_community(community_id), "Community").to_dict()
+
+@db_router.post("/communities/{community_id}/members")
+def join_community(community_id: str, data: dict):
+    store.join_community(data["user_id"], community_id)
+    return {"status": "joined"}
+
+@db_router.get("/communities/{community_id}/members/{user_id}")
+def is_member(community_id: str, user_id: str):
+    return {"member": store.is_member(user_id, community_id)}
+
+@db_router.get("/communities/{community_id}/member_count")
+def member_count(community_id: str):
+    return {"member_count": store.member_count(community_id)}
+
+@db_router.get("/users/{user_id}/communities")
+def list_user_communities(user_id: str, joined: bool = True, limit: int = None):
+    found = store.get_user_communities(user_id) if joined else store.communities_not_joined(user_id, limit)
+    return [c.to_dict() for c in found]
+
+def _rating(summary, user_rating=None):
+    return {"rating": summary.to_dict() if summary else None, "user_rating": user_rating}
+
+@db_router.get("/communities/{community_id}/rating")
+def get_community_rating(community_id: str, user_id: str = None):
+    return _rating(store.get_community_rating(community_id),
+                   store.get_user_community_rating(community_id, user_id) if user_id else None)
+
+@db_router.put("/communities/{community_id}/rating")
+def rate_community(community_id: str, data: dict):
+    _require(store.get_community(community_id), "Community")
+    try:
+        store.add_community_rating(community_id, data["user_id"], data["rating"])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"status": "rated"}
+
+@db_router.post("/posts")
+def create_post(data: dict):
+    store.add_post(Post.from_dict(data))
+    return {"status": "created"}
+
+@db_router.get("/posts")
+def list_posts(user_id: str = None):
+    return [p.to_dict() for p in store.list_posts(user_id=user_id)]
+
+@db_router.get("/feed")
+def posts_page(offset: int = 0, limit: int = None, user_id: str = None):
+    total, posts = store.posts_page(offset, limit, user_id)
+    return {"total": total, "posts": [p.to_dict() for p in posts]}
+
+@db_router.get("/post_ratings")
+def post_ratings(ids: list[str] = Query([])):
+    return {pid: summary.to_dict() for pid, summary in store.get_ratings(ids).items()}
+
+@db_router.get("/trending")
+def trending_posts(community_id: str = None, limit: int = None):
+    return [p.to_dict() for p in store.trending_posts(community_id, limit)]
+
+@db_router.get("/posts/{post_id}")
+def get_post(post_id: str):
+    return _require(store.get_post(post_id), "Post").to_dict()
+
+@db_router.post("/posts/{post_id}/likes")
+def like_post(post_id: str, data: dict):
+    store.add_like(post_id, data["user_id"])
+    return {"status": "liked"}
+
+@db_router.post("/posts/{post_id}/comments")
+def comment_post(post_id: str, data: dict):
+    store.add_comment(post_id, data["user_id"], data["content"])
+    return {"status": "commented"}
+
+@db_router.get("/posts/{post_id}/rating")
+def get_post_rating(post_id: str, user_id: str = None):
+    return _rating(store.get_rating(post_id), store.get_user_rating(post_id, user_id) if user_id else None)
+
+@db_router.put("/posts/{post_id}/rating")
+def rate_post(post_id: str, data: dict):
+    _require(store.get_post(post_id), "Post")
+    try:
+        store.add_rating(post_id, data["user_id"], data["rating"])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"status": "rated"}
+
+@db_router.post("/messages")
+def create_message(data: dict):
+    message = Message.from_dict(data)
+    _require(store.get_user(message.sender_id), "Sender")
+    store.add_message(message)
+    return {"status": "created"}
+
+@db_router.get("/messages")
+def get_conversation(user_id: str, other_id: str):
+    return [m.to_dict() for m in store.get_conversation(user_id, other_id)]
+
+@db_router.post("/rooms")
+def create_room(data: dict):
+    store.add_study_room(StudyRoom.from_dict(data))
+    return {"status": "created"}
+
+@db_router.get("/rooms")
+def list_rooms(meeting_key: str = None, start: datetime = None, end: datetime = None, user_id: str = None):
+    if meeting_key is not None:
+        room = store.find_room_by_key(meeting_key)
+        return [room.to_dict()] if room else []
+    if start or end or user_id:
+        return [r.to_dict() for r in store.upcoming_rooms(start, end, user_id)]
+    return [r.to_dict() for r in store.list_study_rooms()]
+
+@db_router.get("/users/{user_id}/rooms")
+def list_user_rooms(user_id: str):
+    return [r.to_dict() for r in store.get_user_rooms(user_id)]
+
+@db_router.post("/rooms/{room_id}/participants")
+def join_room(room_id: str, data: dict):
+    return {"joined": store.join_study_room(room_id, data["user_id"])}
+
+@db_router.put("/tasks/{task_id}")
+def upsert_task(task_id: str, data: dict):
+    store.add_task(Task.from_dict(dict(data, task_id=task_id)))
+    return {"status": "saved"}
+
+@db_router.delete("/tasks/{task_id}")
+def delete_task(task_id: str):
+    store.delete_task(task_id)
+    return {"status": "deleted"}
+
+@db_router.get("/tasks")
+def get_tasks(user_id: str = None, room_id: str = None):
+    return [t.to_dict() for t in store.get_tasks(user_id=user_id, room_id=room_id)]
+
+if SERVE_DB:
+    app.include_router(db_router)
+else:
+    print("WEB_CONCURRENCY > 1: not serving /db, run a single-worker api.py for STUDYHIVE_DB_URL clients")
 
 if __name__ == "__main__":
     import uvicorn
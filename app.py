@@ -1,6 +1,6 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import uuid
-from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 import pandas as pd
 import plotly.express as px
@@ -8,14 +8,31 @@ from whoosh.index import create_in, open_dir, exists_in
 from whoosh.fields import Schema, TEXT, ID
 from whoosh.qparser import QueryParser
 import os
-import requests
 from transformers import pipeline
-import pypdf
-from streamlit_javascript import st_javascript
 import asyncio
 import aiohttp
-import base64
-import json
+import threading
+import random
+import time
+import math
+import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
+from html import escape
+from database import (Database, User, FreeUser, PremiumUser, Community, Post, Message,
+                      StudyRoom, Badge, Task, notification_from_dict, snapshot_from_dict,
+                      PomodoroTimer, RoomSweeper)
+from perf import timings, InstrumentedDatabase, RerunProfiler, VersionedCache
+from materials import MaterialLibrary, MaterialIndex
+from analytics import EngagementAnalytics
+from ratings import RatingSummary
+
+API_URL = os.environ.get("STUDYHIVE_API_URL", "http://localhost:8000")
+# Live regions (st.fragment with run_every) refresh on their own at these intervals
+CHAT_REFRESH_SECONDS = float(os.environ.get("STUDYHIVE_CHAT_REFRESH", 2))
+NOTIFICATION_REFRESH_SECONDS = float(os.environ.get("STUDYHIVE_NOTIFICATION_REFRESH", 10))
+TIMER_REFRESH_SECONDS = 1
 
 # Set page config
 st.set_page_config(page_title="StudyHive Ultimate", page_icon="🐝", layout="wide")
@@ -123,237 +140,292 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# In-Memory Database
-class Database:
-    def __init__(self):
-        self.users = {}  # user_id -> User
-        self.communities = {}  # community_id -> Community
-        self.posts = []  # List of Post
-        self.messages = []  # List of Message
-        self.study_rooms = {}  # room_id -> StudyRoom
-        self.badges = {}  # user_id -> List of Badge
-        self.posts_ratings = {}  # post_id -> rating
-        self.communities_ratings = {}  # community_id -> rating
-        self.tasks = []  # List of Task
-        self.notifications = []  # List of Notification
+_REQUIRED = object()
+_NO_RATING = {"rating": None, "user_rating": None}  # what the rating endpoints return for an unrated target
+
+# Thin client for the Database served by api.py under /db. It mirrors the Database
+# methods so the UI cannot tell the two apart. Connections are pooled and kept alive,
+# reads are cached for `ttl` seconds (the least recently used beyond `maxsize` are
+# dropped), and this client's own writes drop the cache so a session always sees what
+# it just wrote. Snapshots are revalidated by version ETag.
+class DatabaseClient:
+    def __init__(self, base_url, ttl=1.0, timeout=5, pool_size=16, maxsize=1024):
+        self.base_url = base_url.rstrip("/") + "/db"
+        self.ttl = ttl
+        self.timeout = timeout
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+        self.maxsize = maxsize
+        self._cache = OrderedDict()  # (path, params) -> (expires_at, value), least recently used first
+        self._snapshot = None
+        self._snapshot_expires = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._http.close()
+
+    # A 404 returns `missing` when one is given, and raises like any other error otherwise
+    def _get(self, path, missing=_REQUIRED, **params):
+        params = {k: v for k, v in params.items() if v is not None}
+        key = (path, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items())))
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] > now:
+                self._cache.move_to_end(key)
+                return hit[1]
+        resp = self._http.get(self.base_url + path, params=params, timeout=self.timeout)
+        if resp.status_code == 404 and missing is not _REQUIRED:
+            value = missing
+        else:
+            resp.raise_for_status()
+            value = resp.json()
+        with self._lock:
+            self._cache[key] = (now + self.ttl, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return value
+
+    def _send(self, method, path, payload=None):
+        resp = self._http.request(method, self.base_url + path, json=payload, timeout=self.timeout)
+        with self._lock:
+            self._cache.clear()
+            self._snapshot_expires = 0
+        if resp.status_code in (409, 422):
+            raise ValueError(resp.json().get("detail"))
+        resp.raise_for_status()
+        return resp.json()
+
+    # The whole store, revalidated by version. Any write anywhere invalidates it, so it is
+    # for bulk reads (analytics, the search index); pages use the targeted reads below.
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            snap, expires = self._snapshot, self._snapshot_expires
+        if snap is not None and expires > now:
+            return snap
+        headers = {"If-None-Match": f'"{snap.version}"'} if snap is not None else {}
+        resp = self._http.get(self.base_url + "/snapshot", headers=headers, timeout=self.timeout)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+            snap = snapshot_from_dict(resp.json())
+        with self._lock:
+            self._snapshot, self._snapshot_expires = snap, now + self.ttl
+        return snap
+
+    @property
+    def version(self):
+        return self._get("/version")["version"]
+
+    def data_version(self, *collections):
+        return tuple(self._get("/data_version", collections=list(collections))["data_version"])
+
+    def leaderboard(self, limit=None):
+        return self._get("/leaderboard", limit=limit)
+
+    def community_activity(self):
+        return self._get("/community_activity")
 
     def add_user(self, user):
         if not user.username.strip():
             raise ValueError("Username cannot be empty")
-        if any(u.username.lower() == user.username.lower() for u in self.users.values()):
-            raise ValueError("Username already taken")
-        self.users[user.user_id] = user
-        self.badges[user.user_id] = [Badge(str(uuid.uuid4()), "Welcome", user.user_id)]
+        self._send("POST", "/users", user.to_dict())
 
     def get_user(self, user_id):
-        return self.users.get(user_id)
+        data = self._get(f"/users/{user_id}", missing=None)
+        return User.from_dict(data) if data else None
+
+    def find_user_by_username(self, username):
+        found = self._get("/users", username=username)
+        return User.from_dict(found[0]) if found else None
+
+    def list_users(self):
+        return self.snapshot().users.values()
+
+    def get_users(self, user_ids):
+        if not user_ids:
+            return {}
+        return {u["user_id"]: User.from_dict(u) for u in self._get("/users", ids=sorted(user_ids))}
 
     def update_user(self, user):
-        self.users[user.user_id] = user
+        self._send("PUT", f"/users/{user.user_id}", user.to_dict())
 
     def add_community(self, community):
-        self.communities[community.community_id] = community
-        creator = self.get_user(community.creator_id)
-        if creator:
-            creator.join_community(community.community_id)
-            self.award_badge(creator.user_id, "Community Leader")
+        self._send("POST", "/communities", community.to_dict())
+
+    def get_community(self, community_id):
+        data = self._get(f"/communities/{community_id}", missing=None)
+        return Community.from_dict(data) if data else None
+
+    def list_communities(self):
+        return self.snapshot().communities.values()
+
+    def get_communities(self, community_ids):
+        if not community_ids:
+            return {}
+        return {c["community_id"]: Community.from_dict(c) for c in self._get("/communities", ids=sorted(community_ids))}
+
+    def find_community_by_name(self, name):
+        found = self._get("/communities", name=name)
+        return Community.from_dict(found[0]) if found else None
+
+    def join_community(self, user_id, community_id):
+        self._send("POST", f"/communities/{community_id}/members", {"user_id": user_id})
+
+    def is_member(self, user_id, community_id):
+        return self._get(f"/communities/{community_id}/members/{user_id}", missing={"member": False})["member"]
+
+    def member_count(self, community_id):
+        return self._get(f"/communities/{community_id}/member_count", missing={"member_count": 0})["member_count"]
+
+    def get_user_communities(self, user_id):
+        return [Community.from_dict(c) for c in self._get(f"/users/{user_id}/communities")]
+
+    def communities_not_joined(self, user_id, limit=None):
+        return [Community.from_dict(c) for c in self._get(f"/users/{user_id}/communities", joined="false", limit=limit)]
 
     def add_post(self, post):
-        self.posts.append(post)
-        is_first = not any(p.user_id == post.user_id for p in self.posts[:-1])
-        if is_first and post.user_id in self.users:
-            self.award_badge(post.user_id, "First Post")
+        self._send("POST", "/posts", post.to_dict())
+
+    def get_post(self, post_id):
+        data = self._get(f"/posts/{post_id}", missing=None)
+        return Post.from_dict(data) if data else None
+
+    def list_posts(self, user_id=None):
+        posts = self.snapshot().posts
+        if user_id:
+            return [p for p in posts if p.user_id == user_id]
+        return posts
+
+    def posts_page(self, offset=0, limit=None, user_id=None):
+        page = self._get("/feed", offset=offset, limit=limit, user_id=user_id)
+        return page["total"], [Post.from_dict(p) for p in page["posts"]]
+
+    def trending_posts(self, community_id=None, limit=None):
+        return [Post.from_dict(p) for p in self._get("/trending", community_id=community_id, limit=limit)]
 
     def add_like(self, post_id, user_id):
-        post = next((p for p in self.posts if p.post_id == post_id), None)
-        if post and user_id not in post.likes:
-            post.likes.append(user_id)
+        self._send("POST", f"/posts/{post_id}/likes", {"user_id": user_id})
 
     def add_comment(self, post_id, user_id, content):
-        post = next((p for p in self.posts if p.post_id == post_id), None)
-        if post:
-            post.comments.append({"user_id": user_id, "content": content, "timestamp": datetime.now()})
+        self._send("POST", f"/posts/{post_id}/comments", {"user_id": user_id, "content": content})
 
     def add_message(self, message):
-        self.messages.append(message)
-        self.notify_user(message.receiver_id, f"New message from {self.get_user(message.sender_id).username}")
+        self._send("POST", "/messages", message.to_dict())
+
+    def get_conversation(self, user_id, other_id):
+        return [Message.from_dict(m) for m in self._get("/messages", user_id=user_id, other_id=other_id)]
 
     def add_study_room(self, room):
-        self.study_rooms[room.room_id] = room
-        if room.creator_id in self.users:
-            self.award_badge(room.creator_id, "Study Planner")
+        self._send("POST", "/rooms", room.to_dict())
+
+    def list_study_rooms(self):
+        return self.snapshot().study_rooms.values()
+
+    def upcoming_rooms(self, start=None, end=None, user_id=None):
+        return [StudyRoom.from_dict(r) for r in self._get("/rooms", start=start and start.isoformat(),
+                                                          end=end and end.isoformat(), user_id=user_id)]
+
+    def get_user_rooms(self, user_id):
+        return [StudyRoom.from_dict(r) for r in self._get(f"/users/{user_id}/rooms")]
+
+    def find_room_by_key(self, meeting_key):
+        found = self._get("/rooms", meeting_key=meeting_key)
+        return StudyRoom.from_dict(found[0]) if found else None
+
+    def join_study_room(self, room_id, user_id):
+        return self._send("POST", f"/rooms/{room_id}/participants", {"user_id": user_id})["joined"]
 
     def award_badge(self, user_id, badge_name):
-        badge = Badge(str(uuid.uuid4()), badge_name, user_id)
-        self.badges[user_id].append(badge)
+        return self._send("POST", f"/users/{user_id}/badges", {"name": badge_name})["awarded"]
+
+    def get_badges(self, user_id):
+        return [Badge.from_dict(b) for b in self._get(f"/users/{user_id}/badges")]
+
+    def add_rating(self, post_id, user_id, rating):
+        self._send("PUT", f"/posts/{post_id}/rating", {"user_id": user_id, "rating": rating})
+
+    def get_ratings(self, post_ids):
+        found = self._get("/post_ratings", ids=sorted(post_ids)) if post_ids else {}
+        return {pid: RatingSummary.from_dict(data) for pid, data in found.items()}
+
+    def get_rating(self, post_id):
+        data = self._get(f"/posts/{post_id}/rating", missing=_NO_RATING)["rating"]
+        return RatingSummary.from_dict(data) if data else None
+
+    def get_user_rating(self, post_id, user_id):
+        return self._get(f"/posts/{post_id}/rating", missing=_NO_RATING, user_id=user_id)["user_rating"]
+
+    def add_community_rating(self, community_id, user_id, rating):
+        self._send("PUT", f"/communities/{community_id}/rating", {"user_id": user_id, "rating": rating})
 
-    def add_rating(self, post_id, rating):
-        self.posts_ratings[post_id] = rating
+    def get_community_rating(self, community_id):
+        data = self._get(f"/communities/{community_id}/rating", missing=_NO_RATING)["rating"]
+        return RatingSummary.from_dict(data) if data else None
 
-    def add_community_rating(self, community_id, rating):
-        self.communities_ratings[community_id] = rating
+    def get_user_community_rating(self, community_id, user_id):
+        return self._get(f"/communities/{community_id}/rating", missing=_NO_RATING, user_id=user_id)["user_rating"]
 
     def add_task(self, task):
-        for i, t in enumerate(self.tasks):
-            if t.task_id == task.task_id:
-                self.tasks[i] = task
-                return
-        self.tasks.append(task)
+        self._send("PUT", f"/tasks/{task.task_id}", task.to_dict())
 
     def delete_task(self, task_id):
-        self.tasks = [t for t in self.tasks if t.task_id != task_id]
+        self._send("DELETE", f"/tasks/{task_id}")
 
     def get_tasks(self, user_id=None, room_id=None):
-        if room_id:
-            return [t for t in self.tasks if t.room_id == room_id]
-        elif user_id:
-            return [t for t in self.tasks if t.user_id == user_id]
-        return self.tasks
+        return [Task.from_dict(t) for t in self._get("/tasks", user_id=user_id, room_id=room_id)]
 
     def notify_user(self, user_id, message):
-        self.notifications.append({"user_id": user_id, "message": message, "timestamp": datetime.now()})
+        self._send("POST", f"/users/{user_id}/notifications", {"message": message})
 
     def get_notifications(self, user_id):
-        return [n for n in self.notifications if n["user_id"] == user_id]
-
-# User Classes
-class User(ABC):
-    def __init__(self, user_id, username, email, bio="", profile_picture=None):
-        self.user_id = user_id
-        self.username = username
-        self.email = email
-        self.bio = bio
-        self.profile_picture = profile_picture
-        self.communities = []
-        self.is_premium = False
-
-    def join_community(self, community_id):
-        if community_id not in self.communities:
-            self.communities.append(community_id)
-
-    @abstractmethod
-    def display_profile(self):
-        pass
-
-class FreeUser(User):
-    def display_profile(self):
-        return f"{self.username} (Free) | Communities: {len(self.communities)}"
-
-class PremiumUser(User):
-    def __init__(self, user_id, username, email, bio="", profile_picture=None):
-        super().__init__(user_id, username, email, bio, profile_picture)
-        self.is_premium = True
-
-    def display_profile(self):
-        return f"{self.username} (Premium ✨) | Communities: {len(self.communities)} | Ad-Free"
-
-# Community
-class Community:
-    def __init__(self, community_id, name, creator_id):
-        self.community_id = community_id
-        self.name = name
-        self.creator_id = creator_id
-        self.members = [creator_id]
-
-# Post
-class Post:
-    def __init__(self, post_id, content, user_id, community_id, tag, timestamp=None):
-        self.post_id = post_id
-        self.content = content
-        self.user_id = user_id
-        self.community_id = community_id
-        self.tag = tag
-        self.timestamp = timestamp or datetime.now()
-        self.likes = []
-        self.comments = []
-
-# Message
-class Message:
-    def __init__(self, message_id, sender_id, receiver_id, content, community_id=None, timestamp=None):
-        self.message_id = message_id
-        self.sender_id = sender_id
-        self.receiver_id = receiver_id
-        self.content = content
-        self.community_id = community_id
-        self.timestamp = timestamp or datetime.now()
-
-# Study Room
-class StudyRoom:
-    def __init__(self, room_id, name, creator_id, scheduled_time, meeting_key, participants=None):
-        self.room_id = room_id
-        self.name = name
-        self.creator_id = creator_id
-        self.scheduled_time = scheduled_time
-        self.meeting_key = meeting_key
-        self.participants = participants or [creator_id]
-
-# Badge
-class Badge:
-    def __init__(self, badge_id, name, user_id, timestamp=None):
-        self.badge_id = badge_id
-        self.name = name
-        self.user_id = user_id
-        self.timestamp = timestamp or datetime.now()
-
-# Task
-class Task:
-    def __init__(self, task_id, user_id, title, status, room_id=None):
-        self.task_id = task_id
-        self.user_id = user_id
-        self.title = title
-        self.status = status
-        self.room_id = room_id
-
-# Initialize Database
-if "db" not in st.session_state:
-    st.session_state.db = Database()
+        return [notification_from_dict(n) for n in self._get(f"/users/{user_id}/notifications")]
 
-# Feature 1: Study Timer (Pomodoro)
-def study_timer():
-    st.subheader("Pomodoro Study Timer ⏰")
-    if "timer_running" not in st.session_state:
-        st.session_state.timer_running = False
-        st.session_state.timer_seconds = 1500
-        st.session_state.timer_mode = "Work"
-        st.session_state.sessions_completed = 0
+    def get_timer(self, user_id):
+        return PomodoroTimer.from_dict(self._get(f"/users/{user_id}/timer"))
 
-    if st.button("Start/Stop Timer"):
-        st.session_state.timer_running = not st.session_state.timer_running
-
-    if st.session_state.timer_running:
-        js_code = """
-        let seconds = parseInt(document.getElementById('timer_seconds') ? document.getElementById('timer_seconds').value : 1500);
-        let interval = setInterval(() => {
-            if (seconds > 0) {
-                seconds--;
-                if (document.getElementById('timer_seconds')) {
-                    document.getElementById('timer_seconds').value = seconds;
-                }
-            } else {
-                clearInterval(interval);
-                window.location.reload();
-            }
-        }, 1000);
-        """
-        st_javascript(js_code)
-
-    if st.session_state.timer_seconds <= 0:
-        st.session_state.timer_running = False
-        if st.session_state.timer_mode == "Work":
-            st.session_state.timer_mode = "Break"
-            st.session_state.timer_seconds = 300
-            st.session_state.sessions_completed += 1
-            if st.session_state.sessions_completed % 4 == 0 and "user" in st.session_state:
-                st.session_state.db.award_badge(st.session_state.user.user_id, "Pomodoro Master")
-        else:
-            st.session_state.timer_mode = "Work"
-            st.session_state.timer_seconds = 1500
+    def toggle_timer(self, user_id):
+        return PomodoroTimer.from_dict(self._send("POST", f"/users/{user_id}/timer/toggle"))
+
+# Initialize Database: one store per server process, shared by every browser session.
+# With STUDYHIVE_DB_URL set (e.g. http://localhost:8000) the store lives in api.py instead,
+# so any number of Streamlit processes can share it, and api.py archives finished study
+# rooms; a local store gets its own sweeper. Every call is timed as "db.<method>".
+@st.cache_resource
+def get_database():
+    db_url = os.environ.get("STUDYHIVE_DB_URL")
+    if db_url:
+        return InstrumentedDatabase(DatabaseClient(db_url))
+    db = Database()
+    RoomSweeper(db, float(os.environ.get("STUDYHIVE_ROOM_SWEEP_INTERVAL", 60))).start()
+    return InstrumentedDatabase(db)
+
+# Reruns only the calling fragment. Streamlit allows that only while the fragment itself
+# is rerunning; when the interaction arrived in a full run, rerun the page instead.
+def rerun_fragment():
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
         st.rerun()
 
-    minutes, seconds = divmod(st.session_state.timer_seconds, 60)
-    st.markdown(f"<input type='hidden' id='timer_seconds' value='{st.session_state.timer_seconds}'>", unsafe_allow_html=True)
-    st.metric("Timer", f"{minutes:02d}:{seconds:02d} ({st.session_state.timer_mode})")
-    st.write(f"Sessions Completed: {st.session_state.sessions_completed}")
+# Feature 1: Study Timer (Pomodoro)
+# The timer lives in the data store as a deadline timestamp, so it keeps running across
+# tabs and reloads. This fragment only redraws the countdown every TIMER_REFRESH_SECONDS;
+# reading the timer after its deadline finishes the phase and awards badges.
+@st.fragment(run_every=TIMER_REFRESH_SECONDS)
+def study_timer(user_id):
+    st.subheader("Pomodoro Study Timer ⏰")
+    db = get_database()
+    if st.button("Start/Stop Timer"):
+        db.toggle_timer(user_id)
+    timer = db.get_timer(user_id)
+    minutes, seconds = divmod(math.ceil(timer.seconds_left()), 60)
+    state = "running" if timer.running else "paused"
+    st.metric("Timer", f"{minutes:02d}:{seconds:02d} ({timer.mode}, {state})")
+    st.write(f"Sessions Completed: {timer.sessions_completed}")
 
 # Feature 2: AI-Powered Summaries
 @st.cache_resource
@@ -370,21 +442,12 @@ def summarize_text(text, is_premium=False):
         st.error(f"Failed to generate summary: {str(e)}")
         return ""
 
-def process_pdf(file):
-    try:
-        reader = pypdf.PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
-    except Exception as e:
-        st.error(f"Failed to process PDF: {str(e)}")
-        return ""
-
 # Feature 3: Simplified Task Management
+@st.fragment
+@timings.wrap("section:task_manager")
 def task_manager(user_id, room_id=None):
     st.subheader("Your Tasks" if not room_id else f"Tasks for Study Room")
-    tasks = st.session_state.db.get_tasks(user_id=user_id, room_id=room_id)
+    tasks = get_database().get_tasks(user_id=user_id, room_id=room_id)
     if not tasks:
         st.info("No tasks yet. Add some below!")
     else:
@@ -413,13 +476,13 @@ def task_manager(user_id, room_id=None):
                     if not title:
                         st.error("Task title cannot be empty!")
                     else:
-                        st.session_state.db.add_task(Task(task_id, user_id, title, status, room_id))
+                        get_database().add_task(Task(task_id, user_id, title, status, room_id))
                         st.success("Task updated!")
-                        st.rerun()
+                        rerun_fragment()
                 if delete:
-                    st.session_state.db.delete_task(task_id)
+                    get_database().delete_task(task_id)
                     st.success("Task deleted!")
-                    st.rerun()
+                    rerun_fragment()
 
     st.subheader("Add New Task")
     with st.form("add_task_form"):
@@ -431,16 +494,160 @@ def task_manager(user_id, room_id=None):
                 st.error("Task title cannot be empty!")
             else:
                 task_id = str(uuid.uuid4())
-                st.session_state.db.add_task(Task(task_id, user_id, title, status, room_id))
+                get_database().add_task(Task(task_id, user_id, title, status, room_id))
                 st.success("Task added!")
-                st.rerun()
+                rerun_fragment()
 
 # Feature 4: Notifications
+# Process-wide outbox: UI code enqueues and returns, a background thread owning an
+# asyncio loop and a pooled aiohttp session delivers batches to the API with retries.
+class NotificationOutbox:
+    def __init__(self, base_url=API_URL, max_queue=1000, batch_size=50, flush_interval=0.2,
+                 max_retries=5, backoff_base=0.5, backoff_max=10.0, timeout=5):
+        self.base_url = base_url.rstrip("/")
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._wakeup = None
+        self._stopping = False
+        self._idle = threading.Event()
+        self._idle.set()
+        self.metrics = {"enqueued": 0, "sent": 0, "batches": 0, "retries": 0,
+                        "failed": 0, "rejected": 0, "overflow": 0, "max_depth": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name="notification-outbox", daemon=True)
+            self._thread.start()
+            ready.wait()
+        return self
+
+    def notify(self, user_id, message):
+        # Never blocks on the network; returns False when the bounded queue is full.
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.metrics["overflow"] += 1
+                return False
+            self._queue.append({"user_id": user_id, "message": message})
+            self.metrics["enqueued"] += 1
+            self.metrics["max_depth"] = max(self.metrics["max_depth"], len(self._queue))
+            self._idle.clear()
+            if self._loop is not None:  # under the lock, so close() cannot close the loop in between
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def depth(self):
+        with self._lock:
+            return len(self._queue)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, depth=len(self._queue))
+
+    def flush(self, timeout=None):
+        # Waits until everything queued so far has been delivered or given up on.
+        return self._idle.wait(timeout)
+
+    def close(self, timeout=5):
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        self._stopping = True
+        # Later notifications queue up as before start(), instead of reaching a closed loop
+        with self._lock:
+            loop, self._loop = self._loop, None
+            loop.call_soon_threadsafe(self._wakeup.set)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self, ready):
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        self._wakeup = asyncio.Event()
+        ready.set()
+        try:
+            loop.run_until_complete(self._deliver_forever())
+        finally:
+            loop.close()
+
+    def _next_batch(self):
+        with self._lock:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    async def _deliver_forever(self):
+        connector = aiohttp.TCPConnector(limit=4, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while True:
+                batch = self._next_batch()
+                if batch:
+                    await self._send_with_retry(session, batch)
+                    continue
+                with self._lock:
+                    if not self._queue:
+                        self._idle.set()
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                # Give concurrent producers a moment so their items share one request.
+                await asyncio.sleep(self.flush_interval / 10)
+
+    async def _send_with_retry(self, session, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.post(f"{self.base_url}/notify/batch", json=batch) as resp:
+                    if resp.status == 200:
+                        rejected = (await resp.json()).get("rejected", 0)
+                        with self._lock:
+                            self.metrics["sent"] += len(batch) - rejected
+                            self.metrics["rejected"] += rejected
+                            self.metrics["batches"] += 1
+                        return True
+                    if 400 <= resp.status < 500 and resp.status != 429:
+                        break  # the payload itself is bad, retrying will not help
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            if attempt == self.max_retries or self._stopping:
+                break
+            with self._lock:
+                self.metrics["retries"] += 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        with self._lock:
+            self.metrics["failed"] += len(batch)
+        return False
+
+@st.cache_resource
+def get_outbox():
+    return NotificationOutbox(API_URL).start()
+
+def send_notification(user_id, message):
+    if not get_outbox().notify(user_id, message):
+        st.warning("Notification queue is full; notification dropped.")
+
 async def fetch_notifications():
     for _ in range(2):
         try:
             async with aiohttp.ClientSession() as session:
-                async with session.get("http://localhost:8000/notifications", timeout=5) as resp:
+                async with session.get(f"{API_URL}/notifications", timeout=5) as resp:
                     if resp.status == 200:
                         return await resp.json()
         except Exception as e:
@@ -448,157 +655,273 @@ async def fetch_notifications():
             await asyncio.sleep(1)
     return []
 
+@st.fragment(run_every=NOTIFICATION_REFRESH_SECONDS)
+@timings.wrap("section:display_notifications")
 def display_notifications(user_id):
-    notifications = st.session_state.db.get_notifications(user_id)
+    notifications = get_database().get_notifications(user_id)
     if notifications:
         st.subheader("Notifications 🔔")
-        for notif in notifications:
-            st.markdown(f"<div class='card'>{notif['message']} ({notif['timestamp'].strftime('%Y-%m-%d %H:%M')})</div>", unsafe_allow_html=True)
+        st.markdown("".join(f"<div class='card'>{escape(notif['message'])} "
+                            f"({notif['timestamp'].strftime('%Y-%m-%d %H:%M')})</div>" for notif in notifications),
+                    unsafe_allow_html=True)
 
 # Feature 5: Leaderboard
+# Home-page aggregates and figures, shared by every session of the process and rebuilt
+# only when a collection they read has been written since.
+@st.cache_resource
+def get_chart_cache():
+    return VersionedCache(maxsize=32)
+
+LEADERBOARD_SIZE = 50  # users on the leaderboard chart
+
+def leaderboard_figure(rows):
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return None
+    return px.bar(df, x="Username", y="Score", color="Score", title="StudyHive Leaderboard", text_auto=True)
+
+@timings.wrap("section:leaderboard")
 def leaderboard():
-    data = []
-    for user in st.session_state.db.users.values():
-        badge_count = len(st.session_state.db.badges.get(user.user_id, []))
-        post_count = sum(1 for p in st.session_state.db.posts if p.user_id == user.user_id)
-        tasks_done = sum(1 for t in st.session_state.db.tasks if t.user_id == user.user_id and t.status == "Done")
-        score = badge_count * 10 + post_count * 5 + tasks_done * 3
-        data.append({"Username": user.username, "Badges": badge_count, "Posts": post_count, 
-                     "Tasks Done": tasks_done, "Score": score})
-    df = pd.DataFrame(data)
-    if not df.empty:
-        fig = px.bar(df, x="Username", y="Score", color="Score", 
-                     title="StudyHive Leaderboard", text_auto=True)
+    db = get_database()
+    fig = get_chart_cache().get("leaderboard", db.data_version("users", "badges", "posts", "tasks"),
+                                lambda: leaderboard_figure(db.leaderboard(LEADERBOARD_SIZE)))
+    if fig is not None:
         st.plotly_chart(fig)
     else:
         st.info("No leaderboard data yet.")
 
 # Feature 6: Real-Time Chat
-async def chat_client(user_id, receiver_id):
-    ws_url = f"ws://localhost:8000/chat/{user_id}/{receiver_id}"
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(ws_url) as ws:
-                st.session_state.ws = ws
-                async for msg in ws:
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        data = json.loads(msg.data)
-                        st.session_state.chat_messages.append({
-                            "sender_id": data["sender_id"],
-                            "content": data["content"],
-                            "timestamp": datetime.fromisoformat(data["timestamp"])
-                        })
-                        st.rerun()
-    except Exception as e:
-        st.error(f"Chat connection failed: {str(e)}")
-
+# Chat redraws itself every CHAT_REFRESH_SECONDS from the stored conversation; sending a
+# message reruns only this fragment, not the page around it.
+@st.fragment(run_every=CHAT_REFRESH_SECONDS)
+@timings.wrap("section:display_chat")
 def display_chat(user, receiver_id):
     st.subheader("Messages 💬")
-    receiver = st.session_state.db.get_user(receiver_id)
+    db = get_database()
+    receiver = db.get_user(receiver_id)
     if not receiver:
         st.error("Receiver not found!")
         return
 
-    if "chat_messages" not in st.session_state:
-        st.session_state.chat_messages = [
-            m for m in st.session_state.db.messages
-            if (m.sender_id == user.user_id and m.receiver_id == receiver_id) or
-               (m.sender_id == receiver_id and m.receiver_id == user.user_id)
-        ]
-
-    with st.container():
-        for msg in st.session_state.chat_messages:
-            sender = st.session_state.db.get_user(msg["sender_id"])
-            cls = "sent" if msg["sender_id"] == user.user_id else "received"
-            st.markdown(
-                f"<div class='chat-message {cls}'>{sender.username}: {msg['content']} "
-                f"(<small>{msg['timestamp'].strftime('%H:%M')})</small></div>",
-                unsafe_allow_html=True
-            )
+    names = {user.user_id: user.username, receiver_id: receiver.username}
+    rows = []
+    for msg in db.get_conversation(user.user_id, receiver_id):
+        cls = "sent" if msg.sender_id == user.user_id else "received"
+        rows.append(f"<div class='chat-message {cls}'>{escape(names[msg.sender_id])}: {escape(msg.content)} "
+                    f"(<small>{msg.timestamp.strftime('%H:%M')})</small></div>")
+    st.markdown("".join(rows), unsafe_allow_html=True)
 
-    with st.form("chat_form"):
+    with st.form("chat_form", clear_on_submit=True):
         message = st.text_input("Type a message")
         submit = st.form_submit_button("Send")
         if submit and message:
             msg_id = str(uuid.uuid4())
-            st.session_state.db.add_message(
-                Message(msg_id, user.user_id, receiver_id, message)
-            )
-            st.session_state.chat_messages.append({
-                "sender_id": user.user_id,
-                "content": message,
-                "timestamp": datetime.now()
-            })
-            try:
-                requests.post("http://localhost:8000/notify",
-                             json={"user_id": receiver_id, "message": f"New message from {user.username}"})
-            except Exception as e:
-                st.warning(f"Failed to send notification: {str(e)}")
-            st.rerun()
+            db.add_message(Message(msg_id, user.user_id, receiver_id, message))
+            send_notification(receiver_id, f"New message from {user.username}")
+            rerun_fragment()
 
 # Existing Features
+def community_activity_figure(rows):
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return None
+    return px.bar(df, x="Username", y="Communities Joined", title="User Community Activity")
+
+@timings.wrap("section:plot_user_community_activity")
 def plot_user_community_activity():
-    data = [{"Username": user.username, "Communities Joined": len(user.communities)} 
-            for user in st.session_state.db.users.values()]
-    df = pd.DataFrame(data)
-    if not df.empty:
-        fig = px.bar(df, x="Username", y="Communities Joined", title="User Community Activity")
+    db = get_database()
+    fig = get_chart_cache().get("community_activity", db.data_version("users"),
+                                lambda: community_activity_figure(db.community_activity()))
+    if fig is not None:
         st.plotly_chart(fig)
     else:
         st.info("No data to display.")
 
-def file_upload():
+# Engagement analytics (see analytics.py). One EngagementAnalytics per process folds in
+# only what was written since the previous rerun; figures are cached per data version and window.
+@st.cache_resource
+def get_analytics():
+    return EngagementAnalytics()
+
+ANALYTICS_WINDOWS = {"7 days": 7, "30 days": 30, "90 days": 90, "All time": None}
+
+def analytics_figures(analytics, snap, start):
+    daily = analytics.daily(start).reset_index()
+    names = {cid: c.name for cid, c in snap.communities.items()}
+    per_community = analytics.posts_per_community(start)
+    per_community["Community"] = per_community["community_id"].map(names).fillna("(none)")
+    tags = analytics.tag_distribution(start).reset_index()
+    tags["tag"] = tags["tag"].fillna("(none)")
+    funnel = analytics.task_funnel()
+    return {
+        "dau": px.line(daily, x="day", y="active_users", title="Daily Active Users",
+                       labels={"day": "Day", "active_users": "Active users"}),
+        "communities": px.area(per_community, x="day", y="posts", color="Community",
+                               title="Posts per Community (busiest 10)", labels={"day": "Day", "posts": "Posts"}),
+        "tags": px.pie(tags, names="tag", values="posts", title="Tag Distribution"),
+        "funnel": px.funnel(x=funnel.to_numpy(), y=list(funnel.index), title="Task Completion Funnel"),
+        "responses": px.line(daily, x="day", y="median_response_min", title="Median Chat Response Time",
+                             labels={"day": "Day", "median_response_min": "Minutes"}),
+    }
+
+@timings.wrap("section:analytics")
+def analytics_page(db):
+    snap = db.snapshot()
+    analytics = get_analytics()
+    with timings.timed("section:analytics_update"), st.spinner("Updating analytics..."):
+        analytics.update(snap)
+    last = analytics.last_day()
+    if last is None:
+        st.info("No activity yet.")
+        return
+    window = st.radio("Window", list(ANALYTICS_WINDOWS), index=1, horizontal=True)
+    days = ANALYTICS_WINDOWS[window]
+    start = last - pd.Timedelta(days=days - 1) if days else None
+
+    daily = analytics.daily(start)
+    likes = int(daily["likes"].sum()) + (analytics.undated_likes if start is None else 0)
+    cols = st.columns(5)
+    cols[0].metric("Active users (last day)", int(daily["active_users"].iloc[-1]))
+    cols[1].metric("Posts", int(daily["posts"].sum()))
+    cols[2].metric("Comments", int(daily["comments"].sum()))
+    cols[3].metric("Likes", likes)
+    cols[4].metric("Messages", int(daily["messages"].sum()))
+
+    version = snap.data_version("posts", "messages", "interactions", "tasks", "communities")
+    figures = get_chart_cache().get(f"analytics:{window}", version, lambda: analytics_figures(analytics, snap, start))
+    col1, col2 = st.columns(2)
+    with col1:
+        st.plotly_chart(figures["dau"])
+        st.plotly_chart(figures["tags"])
+        st.plotly_chart(figures["responses"])
+    with col2:
+        st.plotly_chart(figures["communities"])
+        st.plotly_chart(figures["funnel"])
+
+# Study materials live on disk in the MaterialLibrary (see materials.py), shared by all sessions
+@st.cache_resource
+def get_library():
+    return MaterialLibrary.from_env()
+
+@st.cache_resource
+def get_material_index():
+    return MaterialIndex(get_library())
+
+SUMMARY_INPUT_BYTES = 4000  # the summarizer only reads the start of a document
+PREVIEW_BYTES = 2000
+
+def materials_page(user, db):
+    library = get_library()
+    communities = db.get_user_communities(user.user_id)
+    if not communities:
+        st.info("Join a community to share and browse study materials.")
+        return
+    names = [c.name for c in communities]
+    community = communities[names.index(st.selectbox("Community", names, key="materials_community"))]
+
     uploaded = st.file_uploader("Upload Study Material", type=["pdf", "txt", "docx"])
-    if uploaded:
-        st.success(f"File uploaded: {uploaded.name}")
-        if uploaded.type == "text/plain":
-            try:
-                content = uploaded.getvalue().decode("utf-8")
-                st.text_area("File Content", content, height=200)
-                if st.button("Summarize Text"):
-                    is_premium = st.session_state.user.is_premium if "user" in st.session_state else False
-                    summary = summarize_text(content, is_premium)
-                    if summary:
-                        st.markdown(f"**Summary:** {summary}")
-            except UnicodeDecodeError:
-                st.warning("Unable to decode text file.")
-        elif uploaded.type == "application/pdf":
-            content = process_pdf(uploaded)
-            if content and st.button("Summarize PDF"):
-                is_premium = st.session_state.user.is_premium if "user" in st.session_state else False
-                summary = summarize_text(content, is_premium)
-                if summary:
-                    st.markdown(f"**Summary:** {summary}")
-
-def rate_post(post_id):
-    rating = st.slider("Rate this post", 1, 5, key=f"post_rating_{post_id}")
-    st.session_state.db.add_rating(post_id, rating)
-    st.success(f"Rated post with {rating} stars.")
-
-def rate_community(community_id):
-    rating = st.slider("Rate this community", 1, 5, key=f"community_rating_{community_id}")
-    st.session_state.db.add_community_rating(community_id, rating)
-    st.success(f"Rated community with {rating} stars.")
+    if uploaded and st.button("Add to library"):
+        uploaded.seek(0)
+        listing, is_new = library.add(uploaded, uploaded.name, uploaded.type, community.community_id, user.user_id)
+        if is_new:
+            get_material_index().sync()
+            st.success(f"Added {listing.name} to {community.name}.")
+        else:
+            st.success(f"{uploaded.name} is already in the library; listed it in {community.name} without storing it again.")
 
+    listings = library.list(community.community_id)
+    if not listings:
+        st.info("No materials shared in this community yet.")
+        return
+    query = st.text_input("Search materials", key="materials_query")
+    if query:
+        search_materials(query, community.community_id, listings)
+    rows = []
+    for listing in listings:
+        material = library.get(listing.material_id)
+        uploader = db.get_user(listing.uploader_id)
+        rows.append({"Name": listing.name, "Size (KB)": round(material.size / 1024, 1), "Pages": material.pages,
+                     "Uploaded by": uploader.username if uploader else "Unknown",
+                     "Uploaded": datetime.fromtimestamp(listing.uploaded_at).strftime("%Y-%m-%d %H:%M")})
+    st.dataframe(pd.DataFrame(rows), hide_index=True)
+
+    labels = [f"{i + 1}. {listing.name}" for i, listing in enumerate(listings)]
+    listing = listings[labels.index(st.selectbox("Open material", labels, key="materials_open"))]
+    preview = library.read_text(listing.material_id, 0, PREVIEW_BYTES)
+    if not preview:
+        st.info("No text could be extracted from this file.")
+        return
+    st.text_area("Preview", preview, height=200, disabled=True)
+    if st.button("Summarize"):
+        summary = summarize_text(library.read_text(listing.material_id, 0, SUMMARY_INPUT_BYTES), user.is_premium)
+        if summary:
+            st.markdown(f"**Summary:** {summary}")
+
+@timings.wrap("section:search_materials")
+def search_materials(query, community_id, listings):
+    names = {listing.material_id: listing.name for listing in listings}
+    hits = get_material_index().search(query, community_id)
+    if not hits:
+        st.info("No matching pages found.")
+        return
+    # Snippets come from the index already HTML-escaped, with matches in <b>
+    st.markdown("".join(f"<div class='card'><b>{escape(names.get(hit['material_id'], ''))}</b>, page {hit['page'] + 1}"
+                        f"<br>{hit['snippet']}</div>" for hit in hits), unsafe_allow_html=True)
+
+# Ratings are stored per user and written only when the form is submitted; the slider
+# starts at the user's own rating. Summaries come with their histogram, so showing the
+# distribution costs nothing extra.
+def rating_label(summary):
+    return f"{summary.average:.1f}/5 ({summary.count})" if summary else "Not rated"
+
+def rating_form(label, key, summary, own, submit):
+    if summary:
+        st.caption(f"Rated {rating_label(summary)} · " +
+                   " · ".join(f"{stars}★ {n}" for stars, n in reversed(list(enumerate(summary.histogram, 1)))))
+    with st.form(key):
+        stars = st.slider(label, 1, 5, value=own or 3)
+        if st.form_submit_button("Submit rating"):
+            submit(stars)
+            rerun_fragment()
+
+def rate_post(post_id, user_id):
+    db = get_database()
+    rating_form("Rate this post", f"post_rating_{post_id}", db.get_rating(post_id),
+                db.get_user_rating(post_id, user_id), lambda stars: db.add_rating(post_id, user_id, stars))
+
+def rate_community(community_id, user_id):
+    db = get_database()
+    rating_form("Rate this community", f"community_rating_{community_id}", db.get_community_rating(community_id),
+                db.get_user_community_rating(community_id, user_id),
+                lambda stars: db.add_community_rating(community_id, user_id, stars))
+
+INDEX_DIR = "index"
+POST_SCHEMA = Schema(post_id=ID(stored=True, unique=True), content=TEXT(stored=True))
+
+# Rebuilds the search index from every post
 def index_posts():
-    schema = Schema(post_id=ID(stored=True), content=TEXT(stored=True))
-    index_dir = "index"
-    if not os.path.exists(index_dir):
-        os.mkdir(index_dir)
-    if not exists_in(index_dir):
-        ix = create_in(index_dir, schema)
-    else:
-        ix = open_dir(index_dir)
-    writer = ix.writer()
-    for post in st.session_state.db.posts:
+    if not os.path.exists(INDEX_DIR):
+        os.mkdir(INDEX_DIR)
+    writer = create_in(INDEX_DIR, POST_SCHEMA).writer()
+    for post in get_database().list_posts():
         writer.add_document(post_id=post.post_id, content=post.content)
     writer.commit()
 
+# Adds one new post to the search index, or replaces it there
+def index_post(post):
+    if not exists_in(INDEX_DIR):
+        index_posts()
+        return
+    writer = open_dir(INDEX_DIR).writer()
+    writer.update_document(post_id=post.post_id, content=post.content)
+    writer.commit()
+
+@timings.wrap("section:search_posts")
 def search_posts(query_string):
     try:
-        if not os.path.exists("index") or not exists_in("index"):
+        if not os.path.exists(INDEX_DIR) or not exists_in(INDEX_DIR):
             index_posts()
-        ix = open_dir(index_dir)
+        ix = open_dir(INDEX_DIR)
         with ix.searcher() as searcher:
             query = QueryParser("content", ix.schema).parse(query_string)
             results = searcher.search(query)
@@ -624,54 +947,109 @@ def enhanced_header(title, icon=""):
         unsafe_allow_html=True
     )
 
-def display_post(post, db, user):
-    user_obj = db.get_user(post.user_id) or FreeUser("unknown", "Unknown", "unknown@example.com")
-    community = db.communities.get(post.community_id, Community("unknown", "Unknown", "unknown"))
-    rating = db.posts_ratings.get(post.post_id, "Not rated")
-    like_count = len(post.likes)
-    st.markdown(
-        f"""
-        <div class='card'>
-            <strong>{user_obj.username}</strong> in <em>{community.name}</em><br>
-            <small>{post.timestamp.strftime('%Y-%m-%d %H:%M')}</small><br>
-            <p>{post.content}</p>
-            <span class='badge'>{post.tag}</span><br>
-            <small>Rating: {rating}/5 | Likes: {like_count}</small>
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
+# Feed rendering: the visible page of posts goes out as a single HTML block assembled from
+# cached per-post fragments, and widgets (like, comment, rating, comments) are created only
+# for the post picked under "Act on a post". A page is a handful of elements instead of
+# several per post and comment.
+FEED_PAGE_SIZE = 20
+
+# The arguments are everything the card shows, so a changed like count or rating is a new key
+@lru_cache(maxsize=4096)
+def post_card_html(post_id, username, community_name, timestamp, content, tag, rating, like_count, comment_count):
+    return (f"<div class='card' id='post-{escape(post_id)}'>"
+            f"<strong>{escape(username)}</strong> in <em>{escape(community_name)}</em><br>"
+            f"<small>{timestamp.strftime('%Y-%m-%d %H:%M')}</small><br>"
+            f"<p>{escape(content)}</p>"
+            f"<span class='badge'>{escape(tag)}</span><br>"
+            f"<small>Rating: {rating} | Likes: {like_count} | Comments: {comment_count}</small>"
+            f"</div>")
+
+# `users`, `communities` and `ratings` map ids to the records the card names
+def post_card(post, users, communities, ratings):
+    author = users.get(post.user_id)
+    community = communities.get(post.community_id)
+    return post_card_html(post.post_id, author.username if author else "Unknown",
+                          community.name if community else "Unknown", post.timestamp, post.content, post.tag,
+                          rating_label(ratings.get(post.post_id)), len(post.likes), len(post.comments))
+
+# A feed over a list already in display order, such as the trending posts
+def list_feed(posts):
+    return lambda offset, limit: (len(posts), posts[offset:offset + limit])
+
+# `feed(offset, limit)` returns (total, posts) for one page, e.g. db.posts_page, so only the
+# visible page and the users, communities and ratings it shows are read. Returns the total.
+@timings.wrap("section:render_feed")
+def render_feed(feed, db, user, key, rate=False):
+    page_key = f"{key}_page"
+    page = st.session_state.get(page_key, 1)
+    total, visible = feed((page - 1) * FEED_PAGE_SIZE, FEED_PAGE_SIZE)
+    pages = max(1, math.ceil(total / FEED_PAGE_SIZE))
+    if page > pages:  # the feed shrank since the page was picked
+        page = st.session_state[page_key] = pages
+        total, visible = feed((page - 1) * FEED_PAGE_SIZE, FEED_PAGE_SIZE)
+    if pages > 1:
+        st.number_input("Page", 1, pages, key=page_key)
+    users = db.get_users({post.user_id for post in visible})
+    communities = db.get_communities({post.community_id for post in visible})
+    ratings = db.get_ratings([post.post_id for post in visible])
+    st.markdown("".join(post_card(post, users, communities, ratings) for post in visible), unsafe_allow_html=True)
+
+    choices = {}
+    for i, post in enumerate(visible, 1):
+        author = users.get(post.user_id)
+        choices[f"{i}. {author.username if author else 'Unknown'}: {post.content[:60]}"] = post
+    active = st.selectbox("Act on a post", ["Choose a post", *choices], key=f"{key}_active")
+    if active in choices:
+        display_post(choices[active].post_id, user, rate)
+    return total
+
+# Runs as a fragment, so a like, comment or rating reruns only these controls. The post is
+# re-read by id on each run because fragment reruns reuse the arguments of the first call.
+@st.fragment
+@timings.wrap("section:display_post")
+def display_post(post_id, user, rate=False):
+    db = get_database()
+    post = db.get_post(post_id)
+    if not post:
+        st.error("Post not found!")
+        return
     if user:
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("Like", key=f"like_{post.post_id}"):
+            if st.button(f"Like ({len(post.likes)})", key=f"like_{post.post_id}"):
                 db.add_like(post.post_id, user.user_id)
-                st.rerun()
+                rerun_fragment()
         with col2:
             with st.form(f"comment_form_{post.post_id}"):
                 comment = st.text_input("Add a comment", key=f"comment_{post.post_id}")
                 submit = st.form_submit_button("Comment")
                 if submit and comment:
                     db.add_comment(post.post_id, user.user_id, comment)
-                    st.rerun()
+                    rerun_fragment()
+        if rate:
+            rate_post(post.post_id, user.user_id)
+    with st.expander(f"Comments ({len(post.comments)})"):
+        users = db.get_users({comment["user_id"] for comment in post.comments})
+        rows = []
         for comment in post.comments:
-            commenter = db.get_user(comment["user_id"]) or FreeUser("unknown", "Unknown", "unknown@example.com")
-            st.markdown(
-                f"<div class='card' style='margin-left: 20px;'><small>{commenter.username}: {comment['content']} "
-                f"({comment['timestamp'].strftime('%Y-%m-%d %H:%M')})</small></div>",
-                unsafe_allow_html=True
-            )
+            commenter = users.get(comment["user_id"])
+            rows.append(f"<div class='card' style='margin-left: 20px;'><small>"
+                        f"{escape(commenter.username if commenter else 'Unknown')}: {escape(comment['content'])} "
+                        f"({comment['timestamp'].strftime('%Y-%m-%d %H:%M')})</small></div>")
+        st.markdown("".join(rows) or "No comments yet.", unsafe_allow_html=True)
+
+JOIN_OPTIONS_LIMIT = 200  # the Join selector offers this many communities the user is not in
 
 def display_community(community, members_count):
-    creator = st.session_state.db.get_user(community.creator_id) or FreeUser("unknown", "Unknown", "unknown@example.com")
-    rating = st.session_state.db.communities_ratings.get(community.community_id, "Not rated")
+    creator = get_database().get_user(community.creator_id) or FreeUser("unknown", "Unknown", "unknown@example.com")
+    rating = rating_label(get_database().get_community_rating(community.community_id))
     st.markdown(
-        f"<div class='card'>**{community.name}** by *{creator.username}* ({members_count} members) | Rating: {rating}/5</div>",
+        f"<div class='card'>**{community.name}** by *{creator.username}* ({members_count} members) | Rating: {rating}</div>",
         unsafe_allow_html=True
     )
 
 def display_study_room(room):
-    creator = st.session_state.db.get_user(room.creator_id) or FreeUser("unknown", "Unknown", "unknown@example.com")
+    creator = get_database().get_user(room.creator_id) or FreeUser("unknown", "Unknown", "unknown@example.com")
     st.markdown(
         f"""
         <div class='card'>
@@ -683,6 +1061,20 @@ def display_study_room(room):
         unsafe_allow_html=True
     )
 
+# Profile pictures go to api.py's content-addressed blob store once; users only keep the
+# blob id, and browsers load (and cache) the thumbnails straight from the API.
+def upload_picture(data):
+    resp = requests.post(f"{API_URL}/blobs", data=data, timeout=10,
+                         headers={"Content-Type": "application/octet-stream"})
+    if resp.status_code in (413, 422):
+        raise ValueError(resp.json().get("detail"))
+    resp.raise_for_status()
+    return resp.json()["blob_id"]
+
+def picture_url(blob_id, size=None):
+    return f"{API_URL}/blobs/{blob_id}" + (f"?size={size}" if size else "")
+
+@timings.wrap("section:display_profile")
 def display_profile(user, db):
     st.subheader("Edit Profile")
     with st.form("profile_form"):
@@ -697,7 +1089,11 @@ def display_profile(user, db):
             else:
                 profile_picture = user.profile_picture
                 if profile_pic:
-                    profile_picture = base64.b64encode(profile_pic.read()).decode()
+                    try:
+                        profile_picture = upload_picture(profile_pic.getvalue())
+                    except (ValueError, requests.RequestException) as e:
+                        st.error(f"Could not upload picture: {str(e)}")
+                        return
                 new_user = PremiumUser(user.user_id, username, email, bio, profile_picture) if user.is_premium else \
                            FreeUser(user.user_id, username, email, bio, profile_picture)
                 new_user.communities = user.communities
@@ -707,7 +1103,8 @@ def display_profile(user, db):
                 st.rerun()
 
     st.subheader("Profile Details")
-    profile_pic_html = f"<img src='data:image/png;base64,{user.profile_picture}' class='profile-pic'>" if user.profile_picture else \
+    profile_pic_html = f"<img src='{picture_url(user.profile_picture, 128)}' " \
+                       f"srcset='{picture_url(user.profile_picture, 256)} 2x' class='profile-pic'>" if user.profile_picture else \
                        "<div style='width:100px;height:100px;border-radius:50%;background:#ddd;'></div>"
     st.markdown(
         f"""
@@ -722,7 +1119,7 @@ def display_profile(user, db):
         """,
         unsafe_allow_html=True
     )
-    badges = db.badges.get(user.user_id, [])
+    badges = db.get_badges(user.user_id)
     if badges:
         st.subheader("Badges")
         for badge in badges:
@@ -730,16 +1127,21 @@ def display_profile(user, db):
                 f"<span class='badge'>{badge.name} ({badge.timestamp.strftime('%Y-%m-%d')})</span>",
                 unsafe_allow_html=True
             )
-    posts = [p for p in db.posts if p.user_id == user.user_id]
-    if posts:
-        st.subheader("Your Posts")
-        for post in sorted(posts, key=lambda x: x.timestamp, reverse=True):
-            display_post(post, db, user)
+    header = st.container()
+    if render_feed(partial(db.posts_page, user_id=user.user_id), db, user, "profile"):
+        header.subheader("Your Posts")
 
 # Main App
 def main():
-    db = st.session_state.db
+    db = get_database()
     user = st.session_state.get("user")
+    if user:
+        # Other sessions may have replaced the shared record; always render the current one.
+        user = db.get_user(user.user_id)
+        if user:
+            st.session_state.user = user
+        else:
+            del st.session_state.user
 
     # Theme Toggle
     if "theme" not in st.session_state:
@@ -762,6 +1164,8 @@ def main():
                 if not username or not email:
                     st.error("Username and email are required!")
                 else:
+                    # Without a password a matching email proves nothing, so an existing
+                    # username is never logged into; add_user rejects it as taken
                     try:
                         user_id = str(uuid.uuid4())
                         user = PremiumUser(user_id, username, email) if is_premium else FreeUser(user_id, username, email)
@@ -779,9 +1183,28 @@ def main():
 
     st.sidebar.image("https://img.icons8.com/fluency/96/bee.png", width=80)
     menu = ["🏠 Home", "📅 Communities", "🚀 Explore", "🤝 Profile", "🎓 Study Rooms", 
-            "🌟 Premium", "📄 Posts", "⏰ Timer", "📋 Tasks", "🏆 Leaderboard", "💬 Messages"]
+            "🌟 Premium", "📄 Posts", "⏰ Timer", "📋 Tasks", "🏆 Leaderboard", "💬 Messages", "📚 Materials", "📊 Analytics"]
     choice = st.sidebar.selectbox("Navigate", menu)
 
+    with timings.timed(f"page:{choice}"):
+        render_page(choice, db, user)
+
+    if os.environ.get("STUDYHIVE_PERF_PANEL"):
+        performance_panel()
+
+# Render timings for this server process, slowest total first. Enable with STUDYHIVE_PERF_PANEL=1.
+def performance_panel():
+    with st.sidebar.expander("⏱ Performance"):
+        rows = timings.summary()
+        if rows:
+            st.dataframe(pd.DataFrame(rows).round(2), hide_index=True)
+        else:
+            st.write("No timings recorded yet.")
+        if st.button("Reset timings"):
+            timings.reset()
+            st.rerun()
+
+def render_page(choice, db, user):
     if choice == "🏠 Home":
         enhanced_header("StudyHive: Ultimate Student Hub", "🐝")
         st.markdown("<p style='text-align:center'>Connect, Study, and Thrive with peers worldwide!</p>", 
@@ -803,61 +1226,52 @@ def main():
                 if st.button("Create"):
                     if not name:
                         st.error("Community name cannot be empty!")
-                    elif name in [c.name for c in db.communities.values()]:
+                    elif db.find_community_by_name(name):
                         st.error("Community name already taken!")
                     else:
                         cid = str(uuid.uuid4())
                         db.add_community(Community(cid, name, user.user_id))
-                        user.join_community(cid)
-                        db.communities[cid].members.append(user.user_id)
-                        db.award_badge(user.user_id, "Community Leader")
                         st.success("Community created!")
-                        try:
-                            requests.post("http://localhost:8000/notify", 
-                                        json={"user_id": "", "message": f"New community: {name}"})
-                        except Exception as e:
-                            st.warning(f"Failed to send notification: {str(e)}")
+                        send_notification("", f"New community: {name}")
 
             with st.container():
                 st.subheader("Join Community")
-                options = [(c.community_id, c.name) for c in db.communities.values() 
-                          if c.community_id not in user.communities]
-                if options:
-                    cid = st.selectbox("Choose", [o[0] for o in options], 
-                                      format_func=lambda x: next(o[1] for o in options if o[0] == x))
+                names = {c.community_id: c.name for c in db.communities_not_joined(user.user_id, JOIN_OPTIONS_LIMIT)}
+                if names:
+                    cid = st.selectbox("Choose", list(names), format_func=names.get)
                     if st.button("Join"):
-                        user.join_community(cid)
-                        db.communities[cid].members.append(user.user_id)
+                        db.join_community(user.user_id, cid)
                         st.success("Joined community!")
                 else:
                     st.info("No communities to join.")
 
             with st.container():
                 st.subheader("Rate Community")
-                options = [(c.community_id, c.name) for c in db.communities.values() 
-                          if c.community_id in user.communities]
-                if options:
-                    cid = st.selectbox("Select Community to Rate", [o[0] for o in options], 
-                                      format_func=lambda x: next(o[1] for o in options if o[0] == x), 
+                my_communities = db.get_user_communities(user.user_id)
+                names = {c.community_id: c.name for c in my_communities}
+                if names:
+                    cid = st.selectbox("Select Community to Rate", list(names), format_func=names.get,
                                       key="rate_community")
-                    rate_community(cid)
+                    rate_community(cid, user.user_id)
 
             st.subheader("My Communities")
-            for cid in user.communities:
-                community = db.communities.get(cid)
-                if community:
-                    display_community(community, len(community.members))
+            for community in my_communities:
+                display_community(community, db.member_count(community.community_id))
         else:
             st.warning("Please log in to manage communities.")
 
     elif choice == "🚀 Explore":
         enhanced_header("Explore Posts", "📰")
-        if db.posts:
-            for post in sorted(db.posts, key=lambda x: x.timestamp, reverse=True):
-                display_post(post, db, user)
-                if user:
-                    rate_post(post.post_id)
+        order = st.radio("Show", ["Newest", "Trending"], horizontal=True, key="explore_order")
+        if order == "Trending":
+            scopes = {None: "All communities"}
+            if user:
+                scopes.update((c.community_id, c.name) for c in db.get_user_communities(user.user_id))
+            scope = st.selectbox("Trending in", list(scopes), format_func=scopes.get, key="trending_scope")
+            feed = list_feed(db.trending_posts(scope))
         else:
+            feed = db.posts_page
+        if not render_feed(feed, db, user, "explore", rate=True):
             st.info("No posts yet.")
         search_posts(st.text_input("Search Posts:"))
 
@@ -887,29 +1301,31 @@ def main():
                             rid = str(uuid.uuid4())
                             meeting_key = str(uuid.uuid4())[:8]
                             db.add_study_room(StudyRoom(rid, name, user.user_id, dt, meeting_key))
-                            db.award_badge(user.user_id, "Study Planner")
                             st.success(f"Room scheduled! Meeting Key: {meeting_key}")
-                            try:
-                                requests.post("http://localhost:8000/notify", 
-                                            json={"user_id": "", "message": f"New study room: {name} (Key: {meeting_key})"})
-                            except Exception as e:
-                                st.warning(f"Failed to send notification: {str(e)}")
+                            send_notification("", f"New study room: {name} (Key: {meeting_key})")
 
             with st.container():
                 st.subheader("Join Room")
                 meeting_key = st.text_input("Enter Meeting Key")
                 if st.button("Join"):
-                    room = next((r for r in db.study_rooms.values() if r.meeting_key == meeting_key), None)
+                    room = db.find_room_by_key(meeting_key)
                     if room:
-                        if user.user_id not in room.participants:
-                            room.participants.append(user.user_id)
+                        if db.join_study_room(room.room_id, user.user_id):
                             st.success(f"Joined room: {room.name}")
                         st.warning("Video calls require HTTPS. Run the app with SSL certificates to enable video.")
                     else:
                         st.error("Invalid meeting key!")
 
             st.subheader("Upcoming Rooms")
-            for room in sorted(db.study_rooms.values(), key=lambda x: x.scheduled_time):
+            days = st.slider("Days ahead", 1, 60, 14)
+            mine = st.checkbox("Only rooms I joined")
+            # Started rooms stay listed until they finish; minute precision keeps the query cacheable
+            now = datetime.now().replace(second=0, microsecond=0)
+            rooms = db.upcoming_rooms(now - StudyRoom.DURATION, now + timedelta(days=days),
+                                      user.user_id if mine else None)
+            if not rooms:
+                st.info("No rooms scheduled in this window.")
+            for room in rooms:
                 display_study_room(room)
                 if user and user.user_id in room.participants:
                     st.subheader(f"Tasks for {room.name}")
@@ -935,7 +1351,7 @@ def main():
                         user_id = user.user_id
                         new_user = PremiumUser(user_id, user.username, user.email, user.bio, user.profile_picture)
                         new_user.communities = user.communities
-                        db.users[user_id] = new_user
+                        db.update_user(new_user)
                         st.session_state.user = new_user
                         st.success(f"Processed ${amount:.2f}. Upgraded to Premium!")
             else:
@@ -946,13 +1362,10 @@ def main():
     elif choice == "📄 Posts":
         enhanced_header("Create a Post", "📄")
         if user:
-            if user.communities:
+            names = {c.community_id: c.name for c in db.get_user_communities(user.user_id)}
+            if names:
                 with st.form("post_form"):
-                    options = [(c.community_id, c.name) for c in db.communities.values() 
-                              if c.community_id in user.communities]
-                    cid = st.selectbox("Community", [o[0] for o in options], 
-                                      format_func=lambda x: next(o[1] for o in options if o[0] == x),
-                                      key="post_community_select")
+                    cid = st.selectbox("Community", list(names), format_func=names.get, key="post_community_select")
                     tag = st.selectbox("Tag", ["StudyTip", "Motivation", "Question", "Experience"], key="post_tag")
                     content = st.text_area("Content", key="post_content")
                     submit = st.form_submit_button("Post")
@@ -960,17 +1373,11 @@ def main():
                         if not content:
                             st.error("Content cannot be empty!")
                         else:
-                            pid = str(uuid.uuid4())
-                            db.add_post(Post(pid, content, user.user_id, cid, tag))
-                            index_posts()
+                            post = Post(str(uuid.uuid4()), content, user.user_id, cid, tag)
+                            db.add_post(post)
+                            index_post(post)
                             st.success("Posted!")
-                            try:
-                                community_name = next(o[1] for o in options if o[0] == cid)
-                                requests.post("http://localhost:8000/notify", 
-                                            json={"user_id": "", 
-                                                  "message": f"New post in community {community_name}"})
-                            except Exception as e:
-                                st.warning(f"Failed to send notification: {str(e)}")
+                            send_notification("", f"New post in community {names[cid]}")
             else:
                 st.info("Join a community first!")
         else:
@@ -979,7 +1386,7 @@ def main():
     elif choice == "⏰ Timer":
         enhanced_header("Study Timer", "⏰")
         if user:
-            study_timer()
+            study_timer(user.user_id)
         else:
             st.warning("Please log in.")
 
@@ -998,15 +1405,34 @@ def main():
         enhanced_header("Messages", "💬")
         if user:
             receiver_username = st.text_input("Receiver Username")
-            receiver = next((u for u in db.users.values() 
-                            if u.username.lower() == receiver_username.lower()), None)
+            receiver = db.find_user_by_username(receiver_username)
             if receiver:
                 display_chat(user, receiver.user_id)
-                asyncio.run(chat_client(user.user_id, receiver.user_id))
             else:
                 st.info("Enter a username to start chatting.")
         else:
             st.warning("Please log in.")
 
+    elif choice == "📚 Materials":
+        enhanced_header("Study Materials", "📚")
+        if user:
+            materials_page(user, db)
+        else:
+            st.warning("Please log in.")
+
+    elif choice == "📊 Analytics":
+        enhanced_header("Engagement Analytics", "📊")
+        analytics_page(db)
+
+# STUDYHIVE_PROFILE=cprofile|sample profiles every rerun into STUDYHIVE_PROFILE_DIR
+PROFILER = RerunProfiler.from_env()
+
+def run():
+    with timings.timed("rerun"):
+        main()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if PROFILER:
+        PROFILER.run(run)
+    else:
+        run()
\ No newline at end of file
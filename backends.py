@@ -0,0 +1,397 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from datetime import datetime
+
+# Storage and pub/sub behind api.py's notifications and chat sockets. Every uvicorn
+# worker builds its own backend object: MemoryBackend keeps everything in the process,
+# SQLiteBackend shares notifications through one database file and fans chat messages
+# out to the other workers as UDP datagrams on localhost, so neither needs an external
+# service.
+
+# Bounds on the notification store. Per-user and global caps (entries and approximate
+# bytes) are enforced on every insert; entries older than max_age are removed by the
+# periodic compact() that api.py runs from its lifespan. Zero disables a limit.
+class RetentionPolicy:
+    def __init__(self, max_age=7 * 24 * 3600, max_per_user=200, max_total=100000,
+                 max_bytes=64 * 1024 * 1024, compact_interval=60):
+        self.max_age = max_age
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.max_bytes = max_bytes
+        self.compact_interval = compact_interval
+
+    @classmethod
+    def from_env(cls):
+        defaults = cls()
+        def read(name, default):
+            value = os.environ.get(f"STUDYHIVE_NOTIFY_{name.upper()}")
+            return type(default)(value) if value else default
+        return cls(**{name: read(name, value) for name, value in vars(defaults).items()})
+
+def iso_timestamp(epoch):
+    return datetime.fromtimestamp(epoch).isoformat()
+
+# A subscriber's inbox. Slow consumers lose their oldest messages instead of growing
+# the queue without bound.
+class Subscription:
+    def __init__(self, backend, channel, maxsize):
+        self.backend = backend
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def deliver(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.backend._unsubscribe(self)
+
+# Notifications are passed in as {"user_id", "message", "timestamp": epoch seconds} and
+# listed back with ISO timestamps, oldest first.
+class StateBackend(ABC):
+    def __init__(self, queue_size=100, retention=None):
+        self.queue_size = queue_size
+        self.retention = retention or RetentionPolicy()
+        self._subscriptions = defaultdict(set)  # channel -> set of Subscription
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, channel):
+        sub = Subscription(self, channel, self.queue_size)
+        self._subscriptions[channel].add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        subs = self._subscriptions.get(sub.channel)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscriptions[sub.channel]
+
+    def _deliver_local(self, channel, message):
+        for sub in list(self._subscriptions.get(channel, ())):
+            sub.deliver(message)
+
+    # This process's open subscriptions: how many, messages waiting in their queues (in
+    # all and in the deepest) and messages their full queues have dropped
+    def subscription_stats(self):
+        subs = [sub for subs in self._subscriptions.values() for sub in subs]
+        depths = [sub.queue.qsize() for sub in subs]
+        return {"subscriptions": len(subs), "queued": sum(depths), "max_queue_depth": max(depths, default=0),
+                "dropped": sum(sub.dropped for sub in subs)}
+
+    @abstractmethod
+    async def add_notifications(self, notifications):
+        pass
+
+    @abstractmethod
+    async def list_notifications(self, user_id=None):
+        pass
+
+    @abstractmethod
+    async def compact(self, now=None):
+        pass
+
+    @abstractmethod
+    async def stats(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, channel, message):
+        pass
+
+# Notifications live in one deque per user holding (seq, epoch, message) tuples, with user
+# ids interned so every entry shares a single id string. A global (seq, user_id) deque
+# records arrival order; per-user evictions leave stale entries there, which are skipped
+# on read (an entry is live while its seq is not older than its user's oldest entry) and
+# dropped by compact(). Sizes are tracked as an estimate of the bytes held.
+class MemoryBackend(StateBackend):
+    # (seq, epoch, message) tuple, its float and int, the (seq, user_id) order tuple, two deque slots
+    ENTRY_OVERHEAD = sys.getsizeof((0, 0.0, "")) + sys.getsizeof(0.0) + sys.getsizeof(2 ** 40) + \
+        sys.getsizeof((0, "")) + 2 * 8
+
+    def __init__(self, queue_size=100, retention=None):
+        super().__init__(queue_size, retention)
+        self._by_user = {}  # user_id -> deque of (seq, epoch, message)
+        self._order = deque()  # (seq, user_id), oldest first, may hold stale entries
+        self._seq = 0
+        self._count = 0
+        self._bytes = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def _entry_size(self, message):
+        return self.ENTRY_OVERHEAD + sys.getsizeof(message)
+
+    def _is_live(self, seq, user_id):
+        entries = self._by_user.get(user_id)
+        return bool(entries) and entries[0][0] <= seq
+
+    def _pop_user_oldest(self, user_id):
+        entries = self._by_user[user_id]
+        _, _, message = entries.popleft()
+        if not entries:
+            del self._by_user[user_id]
+        self._count -= 1
+        self._bytes -= self._entry_size(message)
+
+    def _evict_oldest(self):
+        while self._order:
+            seq, user_id = self._order.popleft()
+            if self._is_live(seq, user_id):
+                self._pop_user_oldest(user_id)
+                return True
+        return False
+
+    async def add_notifications(self, notifications):
+        policy = self.retention
+        for n in notifications:
+            user_id = sys.intern(n["user_id"])
+            self._seq += 1
+            entries = self._by_user.setdefault(user_id, deque())
+            entries.append((self._seq, n["timestamp"], n["message"]))
+            self._order.append((self._seq, user_id))
+            self._count += 1
+            self._bytes += self._entry_size(n["message"])
+            if policy.max_per_user and len(entries) > policy.max_per_user:
+                self._pop_user_oldest(user_id)
+                self.evicted += 1
+            while (policy.max_total and self._count > policy.max_total) or \
+                  (policy.max_bytes and self._bytes > policy.max_bytes):
+                if not self._evict_oldest():
+                    break
+                self.evicted += 1
+
+    async def list_notifications(self, user_id=None):
+        cutoff = time.time() - self.retention.max_age if self.retention.max_age else 0
+        if user_id is not None:
+            items = ((user_id, entry) for entry in self._by_user.get(user_id, ()))
+        else:
+            items = self._iter_live()
+        return [{"user_id": uid, "message": message, "timestamp": iso_timestamp(epoch)}
+                for uid, (seq, epoch, message) in items if epoch >= cutoff]
+
+    def _iter_live(self):
+        # Walks the arrival order, pairing each live entry with the next tuple of its user's deque.
+        cursors = {}
+        for seq, user_id in self._order:
+            if self._is_live(seq, user_id):
+                cursor = cursors.get(user_id)
+                if cursor is None:
+                    cursor = cursors[user_id] = iter(self._by_user[user_id])
+                yield user_id, next(cursor)
+
+    async def compact(self, now=None):
+        if self.retention.max_age:
+            cutoff = (now or time.time()) - self.retention.max_age
+            while self._order:
+                seq, user_id = self._order[0]
+                if self._is_live(seq, user_id):
+                    if self._by_user[user_id][0][1] >= cutoff:
+                        break
+                    self._pop_user_oldest(user_id)
+                    self.expired += 1
+                self._order.popleft()
+        if len(self._order) > self._count:
+            self._order = deque(e for e in self._order if self._is_live(*e))
+
+    async def stats(self):
+        return {"entries": self._count, "users": len(self._by_user), "approx_bytes": self._bytes,
+                "order_slots": len(self._order), "evicted": self.evicted, "expired": self.expired}
+
+    async def publish(self, channel, message):
+        self._deliver_local(channel, message)
+
+class _PeerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def datagram_received(self, data, addr):
+        try:
+            envelope = json.loads(data)
+        except ValueError:
+            return
+        self.backend._deliver_local(envelope["channel"], envelope["message"])
+
+# Workers register a localhost UDP port in the shared `peers` table and refresh it on
+# a heartbeat; publish() delivers to local subscribers directly and sends one datagram
+# to every other live peer. Peers that stop heartbeating are dropped after `peer_ttl`.
+# Retention runs as SQL in compact(); inserts only trim a user that went over the cap.
+class SQLiteBackend(StateBackend):
+    MAX_DATAGRAM = 60000
+
+    def __init__(self, path, queue_size=100, retention=None, heartbeat=1.0, peer_ttl=5.0):
+        super().__init__(queue_size, retention)
+        self.path = path
+        self.heartbeat = heartbeat
+        self.peer_ttl = peer_ttl
+        self.port = None
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._transport = None
+        self._peers = []
+        self._heartbeat_task = None
+
+    def _execute(self, sql, params=(), many=False):
+        with self._db_lock:
+            cur = self._db.executemany(sql, params) if many else self._db.execute(sql, params)
+            rows = cur.fetchall()
+            self._db.commit()
+            return rows
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS notifications ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, message TEXT NOT NULL,"
+            " timestamp REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS notifications_user ON notifications (user_id, id);"
+            "CREATE TABLE IF NOT EXISTS peers (port INTEGER PRIMARY KEY, pid INTEGER, last_seen REAL);"
+        )
+        self._db.commit()
+
+    async def start(self):
+        await asyncio.to_thread(self._open)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _PeerProtocol(self), local_addr=("127.0.0.1", 0))
+        self.port = self._transport.get_extra_info("sockname")[1]
+        await self._beat()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_forever())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._transport:
+            await asyncio.to_thread(self._execute, "DELETE FROM peers WHERE port = ?", (self.port,))
+            self._transport.close()
+            self._transport = None
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    async def _beat(self):
+        now = time.time()
+        rows = await asyncio.to_thread(self._refresh_peers, now)
+        self._peers = [port for (port,) in rows if port != self.port]
+
+    def _refresh_peers(self, now):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO peers (port, pid, last_seen) VALUES (?, ?, ?)",
+                             (self.port, os.getpid(), now))
+            self._db.execute("DELETE FROM peers WHERE last_seen < ?", (now - self.peer_ttl,))
+            rows = self._db.execute("SELECT port FROM peers").fetchall()
+            self._db.commit()
+            return rows
+
+    async def _heartbeat_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self._beat()
+            except sqlite3.Error as e:
+                print(f"Peer heartbeat failed: {str(e)}")
+
+    async def add_notifications(self, notifications):
+        rows = [(n["user_id"], n["message"], n["timestamp"]) for n in notifications]
+        await asyncio.to_thread(self._insert, rows)
+
+    def _insert(self, rows):
+        cap = self.retention.max_per_user
+        with self._db_lock:
+            self._db.executemany("INSERT INTO notifications (user_id, message, timestamp) VALUES (?, ?, ?)", rows)
+            if cap:
+                for user_id in {r[0] for r in rows}:
+                    self._db.execute(
+                        "DELETE FROM notifications WHERE user_id = ? AND id <= "
+                        "(SELECT id FROM notifications WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (user_id, user_id, cap))
+            self._db.commit()
+
+    async def list_notifications(self, user_id=None):
+        cutoff = time.time() - self.retention.max_age if self.retention.max_age else 0
+        if user_id is None:
+            rows = await asyncio.to_thread(
+                self._execute, "SELECT user_id, message, timestamp FROM notifications WHERE timestamp >= ? ORDER BY id",
+                (cutoff,))
+        else:
+            rows = await asyncio.to_thread(
+                self._execute, "SELECT user_id, message, timestamp FROM notifications "
+                               "WHERE user_id = ? AND timestamp >= ? ORDER BY id", (user_id, cutoff))
+        return [{"user_id": u, "message": m, "timestamp": iso_timestamp(t)} for u, m, t in rows]
+
+    async def compact(self, now=None):
+        await asyncio.to_thread(self._compact, now or time.time())
+
+    def _compact(self, now):
+        policy = self.retention
+        with self._db_lock:
+            if policy.max_age:
+                self._db.execute("DELETE FROM notifications WHERE timestamp < ?", (now - policy.max_age,))
+            if policy.max_per_user:
+                self._db.execute(
+                    "DELETE FROM notifications WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                    "(PARTITION BY user_id ORDER BY id DESC) AS rank FROM notifications) WHERE rank > ?)",
+                    (policy.max_per_user,))
+            if policy.max_total:
+                self._db.execute(
+                    "DELETE FROM notifications WHERE id <= "
+                    "(SELECT id FROM notifications ORDER BY id DESC LIMIT 1 OFFSET ?)", (policy.max_total,))
+            if policy.max_bytes:
+                self._db.execute(
+                    "DELETE FROM notifications WHERE id <= (SELECT id FROM (SELECT id, SUM(LENGTH(message) + "
+                    "LENGTH(user_id) + 16) OVER (ORDER BY id DESC) AS total FROM notifications) "
+                    "WHERE total > ? ORDER BY id DESC LIMIT 1)", (policy.max_bytes,))
+            self._db.commit()
+
+    async def stats(self):
+        def query():
+            with self._db_lock:
+                entries, users, size = self._db.execute(
+                    "SELECT COUNT(*), COUNT(DISTINCT user_id), "
+                    "COALESCE(SUM(LENGTH(message) + LENGTH(user_id) + 16), 0) FROM notifications").fetchone()
+                pages = self._db.execute("PRAGMA page_count").fetchone()[0] * \
+                    self._db.execute("PRAGMA page_size").fetchone()[0]
+            return {"entries": entries, "users": users, "approx_bytes": size, "file_bytes": pages}
+        return await asyncio.to_thread(query)
+
+    # Subscriptions are per process; also reports the peers messages are forwarded to
+    def subscription_stats(self):
+        return dict(super().subscription_stats(), peers=len(self._peers))
+
+    async def publish(self, channel, message):
+        data = json.dumps({"channel": channel, "message": message}).encode()
+        if len(data) > self.MAX_DATAGRAM:
+            raise ValueError("Message too large")
+        self._deliver_local(channel, message)
+        for port in self._peers:
+            self._transport.sendto(data, ("127.0.0.1", port))
+
+def make_backend():
+    kind = os.environ.get("STUDYHIVE_STATE_BACKEND", "memory")
+    retention = RetentionPolicy.from_env()
+    if kind == "sqlite":
+        return SQLiteBackend(os.environ.get("STUDYHIVE_STATE_PATH", "studyhive_state.db"), retention=retention)
+    if kind == "memory":
+        return MemoryBackend(retention=retention)
+    raise ValueError(f"Unknown STUDYHIVE_STATE_BACKEND: {kind}")
@@ -0,0 +1,53 @@
+from collections import Counter
+
+# Badge rules are data: each Database write emits an event, checked only against the rules for it
+
+# Domain events
+USER_JOINED = "user_joined"
+COMMUNITY_CREATED = "community_created"
+POST_CREATED = "post_created"
+ROOM_CREATED = "room_created"
+POMODORO_COMPLETED = "pomodoro_completed"
+
+# Earned the `threshold`-th time the user produces `event`
+class BadgeRule:
+    def __init__(self, badge, event, threshold=1):
+        self.badge = badge
+        self.event = event
+        self.threshold = threshold
+
+BADGE_RULES = (
+    BadgeRule("Welcome", USER_JOINED),
+    BadgeRule("Community Leader", COMMUNITY_CREATED),
+    BadgeRule("First Post", POST_CREATED),
+    BadgeRule("Study Planner", ROOM_CREATED),
+    BadgeRule("Pomodoro Master", POMODORO_COMPLETED, threshold=4),
+)
+
+# Counts each user's events and awards every (user, badge) at most once
+class BadgeEngine:
+    def __init__(self, rules=BADGE_RULES):
+        self.counters = Counter()  # (user_id, event) -> times emitted
+        self.awarded = set()  # (user_id, badge name)
+        self._rules = {}  # event -> tuple of BadgeRule
+        for rule in rules:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        self._rules[rule.event] = self._rules.get(rule.event, ()) + (rule,)
+
+    # Records the event and returns the names of the badges it newly earns
+    def emit(self, event, user_id):
+        key = (user_id, event)
+        self.counters[key] += 1
+        count = self.counters[key]
+        return [rule.badge for rule in self._rules.get(event, ())
+                if count >= rule.threshold and self.claim(user_id, rule.badge)]
+
+    # Marks a badge as awarded. False when the user already has it.
+    def claim(self, user_id, badge):
+        key = (user_id, badge)
+        if key in self.awarded:
+            return False
+        self.awarded.add(key)
+        return True
@@ -0,0 +1,249 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from operator import attrgetter
+
+from database import Database, FreeUser, PremiumUser, Community, Post, Message, StudyRoom, Badge, Task, leaderboard_rows
+from perf import percentile
+from analytics import EngagementAnalytics
+import columnar
+
+# Synthetic-data benchmarks for Database at production scale.
+#   python bench.py                                   # full size, results in bench_results.json
+#   python bench.py --scale 0.01                      # quick run at 1% of every size
+#   python bench.py --baseline bench_baseline.json    # exit 1 if an operation got slower
+#   python bench.py --save-baseline bench_baseline.json
+#   python bench.py --save-dataset data/ ; python bench.py --dataset data/   # generate once, reload fast
+# The dataset is generated from a seed and bulk-loaded, then each operation is timed
+# `repeat` times against the full store, so per-call latency shows how it scales.
+SIZES = {"users": 100_000, "communities": 1_000, "posts": 1_000_000, "messages": 200_000,
+         "tasks": 200_000, "notifications": 500_000, "study_rooms": 50_000}
+LIKES_PER_POST = 3  # averages; actual counts are drawn per post
+COMMENTS_PER_POST = 1
+TAGS = ["StudyTip", "Question", "Resource", "Motivation", "Exam", "Project"]
+STATUSES = ["To-Do", "In Progress", "Done"]
+
+def scaled_sizes(scale):
+    return {name: max(2, int(count * scale)) for name, count in SIZES.items()}
+
+def _id(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+# Builds a populated Database. Records are created the same way the app creates them but
+# loaded in one write, since going through add_* one at a time is what is being measured.
+def generate(sizes, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    span = 90 * 24 * 3600
+
+    def when():
+        return start + timedelta(seconds=rng.randrange(span))
+
+    users = {}
+    for i in range(sizes["users"]):
+        cls = PremiumUser if rng.random() < 0.1 else FreeUser
+        user = cls(_id(rng), f"user{i}", f"user{i}@example.com")
+        users[user.user_id] = user
+    user_ids = list(users)
+
+    communities = {}
+    for i in range(sizes["communities"]):
+        community = Community(_id(rng), f"Community {i}", rng.choice(user_ids))
+        members = {community.creator_id, *(rng.choice(user_ids) for _ in range(rng.randrange(1, 50)))}
+        community.members = list(members)
+        for uid in members:
+            users[uid].join_community(community.community_id)
+        communities[community.community_id] = community
+    community_ids = list(communities)
+
+    posts = []
+    for i in range(sizes["posts"]):
+        post = Post(_id(rng), f"Post {i} about {rng.choice(TAGS).lower()}", rng.choice(user_ids),
+                    rng.choice(community_ids), rng.choice(TAGS), when())
+        post.likes = list({rng.choice(user_ids) for _ in range(rng.randrange(2 * LIKES_PER_POST + 1))})
+        post.comments = [{"user_id": rng.choice(user_ids), "content": f"Comment on post {i}", "timestamp": when()}
+                         for _ in range(rng.randrange(2 * COMMENTS_PER_POST + 1))]
+        posts.append(post)
+    posts.sort(key=attrgetter("timestamp"))
+
+    # Chat is concentrated between a small pool of pairs, as in real conversations.
+    pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(max(1, sizes["messages"] // 50))]
+    messages = []
+    for i in range(sizes["messages"]):
+        sender, receiver = rng.choice(pairs)
+        if rng.random() < 0.5:
+            sender, receiver = receiver, sender
+        messages.append(Message(_id(rng), sender, receiver, f"Message {i}", timestamp=when()))
+    messages.sort(key=attrgetter("timestamp"))
+
+    tasks = {}
+    for i in range(sizes["tasks"]):
+        task = Task(_id(rng), rng.choice(user_ids), f"Task {i}", rng.choice(STATUSES))
+        tasks[task.task_id] = task
+
+    # Rooms span the same 90 days, so most are history by the time upcoming ones are queried
+    rooms = {}
+    for i in range(sizes["study_rooms"]):
+        room = StudyRoom(_id(rng), f"Room {i}", rng.choice(user_ids), when(), f"key{i}")
+        room.participants = list({room.creator_id, *(rng.choice(user_ids) for _ in range(rng.randrange(5)))})
+        rooms[room.room_id] = room
+
+    notifications = sorted(({"user_id": rng.choice(user_ids), "message": f"Notification {i}", "timestamp": when()}
+                            for i in range(sizes["notifications"])), key=lambda n: n["timestamp"])
+
+    badges = {uid: [Badge(_id(rng), "Welcome", uid, start)] for uid in user_ids}
+    first_posters = set()
+    for post in posts:
+        if post.user_id not in first_posters:
+            first_posters.add(post.user_id)
+            badges[post.user_id] = badges[post.user_id] + [Badge(_id(rng), "First Post", post.user_id, post.timestamp)]
+    for community in communities.values():
+        badges[community.creator_id] = badges[community.creator_id] + [
+            Badge(_id(rng), "Community Leader", community.creator_id, start)]
+
+    db = Database()
+    db.load(users=users, communities=communities, posts=posts, messages=messages, study_rooms=rooms,
+            badges=badges, tasks=tasks, notifications=notifications)
+    return db
+
+def measure(func, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {"calls": repeat, "mean_ms": sum(samples) / repeat * 1000, "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000, "max_ms": samples[-1] * 1000}
+
+# Times each operation against `db`. Reads run first on a warm snapshot; writes run last
+# because every write invalidates it.
+def run_suite(db, repeat=20, seed=0):
+    rng = random.Random(seed + 1)
+    user_ids = list(db.users)
+    community_ids = list(db.communities)
+    post_ids = [p.post_id for p in db.posts]
+    pairs = [(m.sender_id, m.receiver_id) for m in rng.sample(db.messages, min(repeat, len(db.messages)))]
+    heavy = max(1, repeat // 5)  # whole-store aggregates are slow; time fewer of them
+    counter = iter(range(sys.maxsize))
+
+    def new_user():
+        n = next(counter)
+        return (FreeUser(_id(rng), f"bench{n}", f"bench{n}@example.com"),)
+
+    def new_post():
+        return (Post(_id(rng), "Benchmark post", rng.choice(user_ids), rng.choice(community_ids), rng.choice(TAGS)),)
+
+    rooms = list(db.study_rooms.values())
+
+    def window():
+        start = rng.choice(rooms).scheduled_time if rooms else datetime.now()
+        return start, start + timedelta(days=1)
+
+    def feed():
+        return db.posts_page(0, 20)  # the first page, as the Explore feed reads it
+
+    db.snapshot()
+    results = {
+        "get_tasks": measure(db.get_tasks, repeat, lambda: (rng.choice(user_ids),)),
+        "get_notifications": measure(db.get_notifications, repeat, lambda: (rng.choice(user_ids),)),
+        "chat_history": measure(db.get_conversation, repeat, lambda: rng.choice(pairs)),
+        "upcoming_rooms": measure(db.upcoming_rooms, repeat, window),
+        "user_rooms": measure(db.get_user_rooms, repeat, lambda: (rng.choice(user_ids),)),
+        "leaderboard": measure(lambda: leaderboard_rows(db.snapshot()), heavy),
+        "feed": measure(feed, heavy),
+        "trending": measure(db.trending_posts, repeat, lambda: (rng.choice(community_ids + [None]),)),
+        "add_user": measure(db.add_user, repeat, new_user),
+        "add_post": measure(db.add_post, repeat, new_post),
+        "join_community": measure(db.join_community, repeat, lambda: (rng.choice(user_ids), rng.choice(community_ids))),
+        "add_like": measure(db.add_like, repeat, lambda: (rng.choice(post_ids), rng.choice(user_ids))),
+    }
+    # The first read after a write pays for sharing out the collections it touched
+    writes = {"like": lambda: db.add_like(rng.choice(post_ids), rng.choice(user_ids)),
+              "join": lambda: db.join_community(rng.choice(user_ids), rng.choice(community_ids)),
+              "update_user": lambda: db.update_user(db.get_user(rng.choice(user_ids)))}
+    for name, write in writes.items():
+        results[f"snapshot_after_{name}"] = measure(db.snapshot, repeat, lambda: write() or ())
+
+    # Analytics is built once, then each update folds in only the writes since the last one
+    analytics = EngagementAnalytics()
+    analytics.update(db.snapshot())
+
+    def write_then_snapshot():
+        db.add_post(new_post()[0])
+        db.add_like(rng.choice(post_ids), rng.choice(user_ids))
+        return (db.snapshot(),)
+
+    results["analytics_update"] = measure(analytics.update, repeat, write_then_snapshot)
+    return results
+
+# Returns the operations whose median got slower than the baseline by more than
+# `tolerance` (a fraction). Differences under `min_ms` are treated as noise.
+def compare(results, baseline, tolerance=0.25, min_ms=0.05):
+    if baseline["meta"]["sizes"] != results["meta"]["sizes"]:
+        raise ValueError("Baseline was recorded with different dataset sizes")
+    regressions = []
+    for name, current in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        slower = current["p50_ms"] - before["p50_ms"]
+        if slower > min_ms and current["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            regressions.append({"name": name, "baseline_ms": before["p50_ms"], "current_ms": current["p50_ms"],
+                                "ratio": current["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Database operations on synthetic data.")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for every dataset size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per operation")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="compare against this results file, exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown as a fraction")
+    parser.add_argument("--save-baseline", help="also write the results here")
+    parser.add_argument("--dataset", help="load this columnar export (see columnar.py) instead of generating")
+    parser.add_argument("--save-dataset", help="export the generated dataset here for later --dataset runs")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.dataset:
+        db = columnar.import_database(args.dataset)
+        sizes = {name: len(getattr(db, name)) for name in SIZES}
+    else:
+        sizes = scaled_sizes(args.scale)
+        db = generate(sizes, args.seed)
+    load_seconds = time.perf_counter() - start
+    if args.save_dataset:
+        columnar.export_database(db, args.save_dataset)
+    results = {"meta": {"sizes": sizes, "seed": args.seed, "repeat": args.repeat, "load_seconds": load_seconds,
+                        "python": platform.python_version(), "timestamp": datetime.now().isoformat()},
+               "results": run_suite(db, args.repeat, args.seed)}
+
+    for path in filter(None, [args.out, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+    print(f"{'Loaded' if args.dataset else 'Generated'} {sizes} in {load_seconds:.1f}s")
+    for name, r in results["results"].items():
+        print(f"{name:22} p50 {r['p50_ms']:10.3f} ms  p95 {r['p95_ms']:10.3f} ms  max {r['max_ms']:10.3f} ms")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(results, baseline, args.tolerance)
+        except ValueError as e:
+            parser.error(str(e))
+        for r in regressions:
+            print(f"REGRESSION {r['name']}: {r['baseline_ms']:.3f} ms -> {r['current_ms']:.3f} ms ({r['ratio']:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Content-addressed blob store for uploaded images. A blob's id is the SHA-256 of its
+# bytes, so uploading the same picture twice stores it once, and a blob never changes
+# after it is written, which lets api.py serve it with a permanent cache lifetime.
+# Square thumbnails are generated once at upload time. Layout on disk:
+#   <root>/<id[:2]>/<id>            original upload
+#   <root>/<id[:2]>/<id>_<size>     thumbnail, JPEG (PNG when the image has transparency)
+BLOB_ID = re.compile(r"^[0-9a-f]{64}$")
+CONTENT_TYPES = {b"\x89PNG": "image/png", b"\xff\xd8\xff": "image/jpeg", b"GIF8": "image/gif", b"RIFF": "image/webp"}
+
+def content_type(head):
+    return next((ctype for magic, ctype in CONTENT_TYPES.items() if head.startswith(magic)),
+                "application/octet-stream")
+
+class BlobStore:
+    SIZES = (64, 128, 256)
+
+    def __init__(self, root="blobs", max_bytes=5 * 2**20):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("STUDYHIVE_BLOB_DIR", "blobs"),
+                   int(os.environ.get("STUDYHIVE_BLOB_MAX_BYTES", 5 * 2**20)))
+
+    def path(self, blob_id, size=None):
+        # Returns None for ids that cannot name a blob, so callers never build paths from raw input
+        if not BLOB_ID.match(blob_id or "") or (size is not None and size not in self.SIZES):
+            return None
+        name = blob_id if size is None else f"{blob_id}_{size}"
+        return os.path.join(self.root, blob_id[:2], name)
+
+    def exists(self, blob_id):
+        path = self.path(blob_id)
+        return path is not None and os.path.exists(path)
+
+    # Raises ValueError when an upload of `size` bytes is over the limit
+    def check_size(self, size):
+        if size > self.max_bytes:
+            raise ValueError(f"Image is larger than {self.max_bytes // 2**20} MB")
+
+    def put(self, data):
+        self.check_size(len(data))
+        blob_id = hashlib.sha256(data).hexdigest()
+        if self.exists(blob_id):  # stored blobs were decoded when first put
+            return blob_id
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.load()
+                thumbnails = {size: self._thumbnail(image, size) for size in self.SIZES}
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+            raise ValueError("Upload is not a readable image") from e
+        os.makedirs(os.path.dirname(self.path(blob_id)), exist_ok=True)
+        # Thumbnails first: the original appearing is what marks a blob complete
+        for size, thumbnail in thumbnails.items():
+            self._write(self.path(blob_id, size), thumbnail)
+        self._write(self.path(blob_id), data)
+        return blob_id
+
+    def read(self, blob_id, size=None):
+        path = self.path(blob_id, size)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _thumbnail(image, size):
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        thumbnail = ImageOps.fit(image.convert("RGBA" if has_alpha else "RGB"), (size, size))
+        out = io.BytesIO()
+        if has_alpha:
+            thumbnail.save(out, "PNG", optimize=True)
+        else:
+            thumbnail.save(out, "JPEG", quality=85, optimize=True)
+        return out.getvalue()
+
+    @staticmethod
+    def _write(path, data):
+        # Write to a temp file and rename, so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -0,0 +1,204 @@
+import gc
+import os
+from contextlib import contextmanager
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from database import (Database, FreeUser, PremiumUser, Community, Post, Message, StudyRoom, Badge, Task,
+                      PomodoroTimer)
+from ratings import RatingStore
+
+# Columnar dump and load of a whole Database, one file per table (see bench.py --dataset)
+# Likes and comments point at their post by row number, as post ids need not be unique
+TIMESTAMP = pa.timestamp("us")
+SCHEMAS = {
+    "users": pa.schema([("user_id", pa.string()), ("username", pa.string()), ("email", pa.string()),
+                        ("bio", pa.string()), ("profile_picture", pa.string()), ("is_premium", pa.bool_())]),
+    "user_communities": pa.schema([("user_id", pa.string()), ("community_id", pa.string())]),
+    "communities": pa.schema([("community_id", pa.string()), ("name", pa.string()), ("creator_id", pa.string())]),
+    "community_members": pa.schema([("community_id", pa.string()), ("user_id", pa.string())]),
+    "posts": pa.schema([("post_id", pa.string()), ("content", pa.string()), ("user_id", pa.string()),
+                        ("community_id", pa.string()), ("tag", pa.string()), ("timestamp", TIMESTAMP)]),
+    "post_likes": pa.schema([("post_index", pa.int64()), ("user_id", pa.string())]),
+    "post_comments": pa.schema([("post_index", pa.int64()), ("user_id", pa.string()), ("content", pa.string()),
+                                ("timestamp", TIMESTAMP)]),
+    "messages": pa.schema([("message_id", pa.string()), ("sender_id", pa.string()), ("receiver_id", pa.string()),
+                           ("content", pa.string()), ("community_id", pa.string()), ("timestamp", TIMESTAMP)]),
+    "study_rooms": pa.schema([("room_id", pa.string()), ("name", pa.string()), ("creator_id", pa.string()),
+                              ("scheduled_time", TIMESTAMP), ("meeting_key", pa.string()), ("archived", pa.bool_())]),
+    "room_participants": pa.schema([("room_id", pa.string()), ("user_id", pa.string())]),
+    "badges": pa.schema([("badge_id", pa.string()), ("name", pa.string()), ("user_id", pa.string()),
+                         ("timestamp", TIMESTAMP)]),
+    "post_ratings": pa.schema([("post_id", pa.string()), ("user_id", pa.string()), ("rating", pa.int64())]),
+    "community_ratings": pa.schema([("community_id", pa.string()), ("user_id", pa.string()),
+                                    ("rating", pa.int64())]),
+    "tasks": pa.schema([("task_id", pa.string()), ("user_id", pa.string()), ("title", pa.string()),
+                        ("status", pa.string()), ("room_id", pa.string())]),
+    "notifications": pa.schema([("user_id", pa.string()), ("message", pa.string()), ("timestamp", TIMESTAMP)]),
+    "timers": pa.schema([("user_id", pa.string()), ("mode", pa.string()), ("deadline", pa.float64()),
+                         ("remaining", pa.float64()), ("sessions_completed", pa.int64())]),
+}
+FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+
+# Export and import allocate millions of short-lived tuples and records; with the cyclic
+# collector running, they trigger repeated full collections that find nothing to free.
+@contextmanager
+def _gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _columns(rows, fields):
+    return {field: [row[i] for row in rows] for i, field in enumerate(fields)}
+
+# Every table comes from one snapshot, so they agree without holding the lock
+def _tables(db):
+    data = _rows(db.snapshot())
+    return {name: pa.Table.from_pydict(columns, schema=SCHEMAS[name]) for name, columns in data.items()}
+
+def _rows(snap):
+    archived = list(snap.archived_rooms.values())
+    timers = list(snap.timers.values())
+    post_ratings = snap.posts_ratings.ratings()
+    community_ratings = snap.communities_ratings.ratings()
+    users = list(snap.users.values())
+    communities = list(snap.communities.values())
+    posts = list(snap.posts)
+    rooms = [(room, False) for room in snap.study_rooms.values()] + [(room, True) for room in archived]
+    return {
+        "users": _columns([(u.user_id, u.username, u.email, u.bio, u.profile_picture, u.is_premium) for u in users],
+                          SCHEMAS["users"].names),
+        "user_communities": _columns([(u.user_id, cid) for u in users for cid in u.communities],
+                                     ("user_id", "community_id")),
+        "communities": _columns([(c.community_id, c.name, c.creator_id) for c in communities],
+                                SCHEMAS["communities"].names),
+        "community_members": _columns([(c.community_id, uid) for c in communities for uid in c.members],
+                                      ("community_id", "user_id")),
+        "posts": _columns([(p.post_id, p.content, p.user_id, p.community_id, p.tag, p.timestamp) for p in posts],
+                          SCHEMAS["posts"].names),
+        "post_likes": _columns([(i, uid) for i, p in enumerate(posts) for uid in p.likes], ("post_index", "user_id")),
+        "post_comments": _columns([(i, c["user_id"], c["content"], c["timestamp"]) for i, p in enumerate(posts)
+                                   for c in p.comments], ("post_index", "user_id", "content", "timestamp")),
+        "messages": _columns([(m.message_id, m.sender_id, m.receiver_id, m.content, m.community_id, m.timestamp)
+                              for m in snap.messages], SCHEMAS["messages"].names),
+        "study_rooms": _columns([(r.room_id, r.name, r.creator_id, r.scheduled_time, r.meeting_key, archived)
+                                 for r, archived in rooms], SCHEMAS["study_rooms"].names),
+        "room_participants": _columns([(r.room_id, uid) for r, _ in rooms for uid in r.participants],
+                                      ("room_id", "user_id")),
+        "badges": _columns([(b.badge_id, b.name, b.user_id, b.timestamp) for badges in snap.badges.values()
+                            for b in badges], SCHEMAS["badges"].names),
+        "post_ratings": _columns(post_ratings, SCHEMAS["post_ratings"].names),
+        "community_ratings": _columns(community_ratings, SCHEMAS["community_ratings"].names),
+        "tasks": _columns([(t.task_id, t.user_id, t.title, t.status, t.room_id) for t in snap.tasks],
+                          SCHEMAS["tasks"].names),
+        "notifications": _columns([(n["user_id"], n["message"], n["timestamp"]) for n in snap.notifications],
+                                  ("user_id", "message", "timestamp")),
+        "timers": _columns([(t.user_id, t.mode, t.deadline, t.remaining, t.sessions_completed) for t in timers],
+                           SCHEMAS["timers"].names),
+    }
+
+def export_database(db, directory, fmt="parquet"):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    os.makedirs(directory, exist_ok=True)
+    with _gc_paused():
+        tables = _tables(db)
+    for name, table in tables.items():
+        path = os.path.join(directory, name + FORMATS[fmt])
+        if fmt == "parquet":
+            pq.write_table(table, path)
+        else:
+            feather.write_feather(table, path)
+    return {name: table.num_rows for name, table in tables.items()}
+
+def _pylist(column):
+    # Arrow builds datetimes one Python call at a time; numpy converts the whole column in C
+    if pa.types.is_timestamp(column.type) and not column.null_count:
+        return column.to_numpy().astype(object).tolist()
+    return column.to_pylist()
+
+def _read(directory, name):
+    for fmt, ext in FORMATS.items():
+        path = os.path.join(directory, name + ext)
+        if os.path.exists(path):
+            table = pq.read_table(path) if fmt == "parquet" else feather.read_table(path)
+            return {field: _pylist(table.column(field)) for field in SCHEMAS[name].names}
+    raise FileNotFoundError(f"No {name} table in {directory}")
+
+def import_database(directory, db=None):
+    with _gc_paused():
+        return _import(directory, db or Database())
+
+def _import(directory, db):
+    t = {name: _read(directory, name) for name in SCHEMAS}
+
+    users = {}
+    u = t["users"]
+    for uid, username, email, bio, picture, premium in zip(u["user_id"], u["username"], u["email"], u["bio"],
+                                                           u["profile_picture"], u["is_premium"]):
+        users[uid] = (PremiumUser if premium else FreeUser)(uid, username, email, bio, picture)
+    joined = {}
+    for uid, cid in zip(t["user_communities"]["user_id"], t["user_communities"]["community_id"]):
+        joined.setdefault(uid, []).append(cid)
+    for uid, cids in joined.items():
+        users[uid].communities = cids
+
+    communities = {}
+    c = t["communities"]
+    for cid, name, creator in zip(c["community_id"], c["name"], c["creator_id"]):
+        communities[cid] = community = Community(cid, name, creator)
+        community.members = []
+    for cid, uid in zip(t["community_members"]["community_id"], t["community_members"]["user_id"]):
+        communities[cid].members.append(uid)
+
+    p = t["posts"]
+    posts = [Post(*row) for row in zip(p["post_id"], p["content"], p["user_id"], p["community_id"], p["tag"],
+                                        p["timestamp"])]
+    for i, uid in zip(t["post_likes"]["post_index"], t["post_likes"]["user_id"]):
+        posts[i].likes.append(uid)
+    pc = t["post_comments"]
+    for i, uid, content, when in zip(pc["post_index"], pc["user_id"], pc["content"], pc["timestamp"]):
+        posts[i].comments.append({"user_id": uid, "content": content, "timestamp": when})
+
+    m = t["messages"]
+    messages = [Message(*row) for row in zip(m["message_id"], m["sender_id"], m["receiver_id"], m["content"],
+                                             m["community_id"], m["timestamp"])]
+
+    study_rooms, archived_rooms = {}, {}
+    r = t["study_rooms"]
+    all_rooms = {}
+    for rid, name, creator, when, key, archived in zip(r["room_id"], r["name"], r["creator_id"],
+                                                       r["scheduled_time"], r["meeting_key"], r["archived"]):
+        room = all_rooms[rid] = StudyRoom(rid, name, creator, when, key)
+        room.participants = []
+        (archived_rooms if archived else study_rooms)[rid] = room
+    for rid, uid in zip(t["room_participants"]["room_id"], t["room_participants"]["user_id"]):
+        all_rooms[rid].participants.append(uid)
+
+    badges = {uid: [] for uid in users}
+    b = t["badges"]
+    for badge in (Badge(*row) for row in zip(b["badge_id"], b["name"], b["user_id"], b["timestamp"])):
+        badges.setdefault(badge.user_id, []).append(badge)
+
+    tk = t["tasks"]
+    tasks = {row[0]: Task(*row) for row in zip(tk["task_id"], tk["user_id"], tk["title"], tk["status"],
+                                                tk["room_id"])}
+    n = t["notifications"]
+    notifications = [{"user_id": uid, "message": message, "timestamp": when}
+                     for uid, message, when in zip(n["user_id"], n["message"], n["timestamp"])]
+    pr, cr = t["post_ratings"], t["community_ratings"]
+    tm = t["timers"]
+    timers = {row[0]: PomodoroTimer(*row) for row in zip(tm["user_id"], tm["mode"], tm["deadline"], tm["remaining"],
+                                                         tm["sessions_completed"])}
+
+    db.load(users=users, communities=communities, posts=posts, messages=messages, study_rooms=study_rooms,
+            archived_rooms=archived_rooms, badges=badges, tasks=tasks, notifications=notifications, timers=timers,
+            posts_ratings=RatingStore.from_ratings(zip(pr["post_id"], pr["user_id"], pr["rating"])),
+            communities_ratings=RatingStore.from_ratings(zip(cr["community_id"], cr["user_id"], cr["rating"])))
+    return db
@@ -0,0 +1,931 @@
+import bisect
+import copy
+import heapq
+import uuid
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from operator import attrgetter, itemgetter
+from types import MappingProxyType
+
+from badges import (BadgeEngine, USER_JOINED, COMMUNITY_CREATED, POST_CREATED, ROOM_CREATED,
+                    POMODORO_COMPLETED)
+from trending import TrendingIndex, LIKE_WEIGHT, COMMENT_WEIGHT, RATING_WEIGHT
+from persistent import CowList, CowMap
+from ratings import RatingStore, RatingSummary
+
+# Readers-writer lock; waiting writers block new readers. Re-entrant, but a read lock cannot be upgraded
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # thread id -> read depth
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            elif me in self._readers:
+                self._readers[me] += 1
+            else:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._readers[me] = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                if self._writer == me:
+                    self._write_depth -= 1
+                else:
+                    self._readers[me] -= 1
+                    if not self._readers[me]:
+                        del self._readers[me]
+                        if not self._readers:
+                            self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+            else:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+                self._write_depth = 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+# Read-only view of the first `length` items of an append-only list. Later appends
+# never show up, so holding one costs O(1) and iterating it needs no lock.
+class LogView:
+    __slots__ = ("_items", "_length")
+
+    def __init__(self, items, length):
+        self._items = items
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        items = self._items
+        for i in range(self._length):
+            yield items[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._items[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("LogView index out of range")
+        return self._items[index]
+
+# Community membership as sets both ways, so joins are idempotent and lookups O(1)
+class MembershipIndex:
+    def __init__(self):
+        self._members = {}  # community_id -> set of user_ids
+        self._joined = {}  # user_id -> set of community_ids
+
+    # Returns False when the user was already a member
+    def add(self, user_id, community_id):
+        members = self._members.setdefault(community_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self._joined.setdefault(user_id, set()).add(community_id)
+        return True
+
+    def is_member(self, user_id, community_id):
+        return user_id in self._members.get(community_id, ())
+
+    def count(self, community_id):
+        return len(self._members.get(community_id, ()))
+
+    def joined(self, user_id):
+        return self._joined.get(user_id, frozenset())
+
+# Read-only view of the whole Database as of `version`, which doubles as a cache key.
+# `versions` counts writes per collection, for caches that only depend on some of them.
+class Snapshot:
+    __slots__ = ("version", "versions", "users", "communities", "posts", "messages", "study_rooms", "badges",
+                 "posts_ratings", "communities_ratings", "tasks", "notifications", "interactions", "archived_rooms",
+                 "timers")
+
+    def __init__(self, version, versions=None, **collections):
+        self.version = version
+        self.versions = versions or {}
+        for name, value in collections.items():
+            setattr(self, name, value)
+
+    def data_version(self, *collections):
+        return tuple(self.versions.get(name, 0) for name in collections)
+
+# In-Memory Database
+# Shared by every session (see app.get_database); writes take the write lock and replace
+# stored records rather than changing them, so snapshots can share them.
+class Database:
+    KEYED = ("users", "communities", "study_rooms", "badges", "posts_ratings", "communities_ratings", "tasks",
+             "archived_rooms", "timers")
+
+    def __init__(self):
+        self.users = CowMap()  # user_id -> User
+        self.communities = CowMap()  # community_id -> Community
+        self.memberships = MembershipIndex()
+        self.posts = CowList()  # List of Post
+        self._post_index = {}  # post_id -> position in posts of the first Post with that id
+        self.messages = []  # List of Message
+        self.study_rooms = CowMap()  # room_id -> StudyRoom, until archived
+        self.archived_rooms = CowMap()  # room_id -> StudyRoom that has finished
+        self._room_index = []  # (scheduled_time, room_id) of study_rooms, sorted
+        self._rooms_by_key = {}  # meeting_key -> room_id
+        self._rooms_by_user = {}  # user_id -> set of room_ids they take part in
+        self.badges = CowMap()  # user_id -> List of Badge
+        self.badge_engine = BadgeEngine()
+        self.trending = TrendingIndex()
+        self.posts_ratings = RatingStore()  # post_id -> RatingSummary, one rating per user
+        self.communities_ratings = RatingStore()  # community_id -> RatingSummary
+        self.tasks = CowMap()  # task_id -> Task
+        self.notifications = []  # List of Notification
+        # (timestamp, kind, user_id, community_id, tag) per like and comment made through
+        # add_like/add_comment, append-only. It gives likes a time and lets consumers such
+        # as analytics.py pick up new engagement without rescanning posts. Not persisted.
+        self.interactions = []
+        self.timers = CowMap()  # user_id -> PomodoroTimer
+        self.lock = RWLock()
+        self.version = 0
+        self.versions = Counter()  # collection -> writes that touched it
+        self._pending = set()  # collections touched by the write in progress
+        self._write_depth = 0
+        self._dirty = set(self.KEYED)
+        self._snapshot = Snapshot(-1)
+        self._snapshot_lock = threading.Lock()
+        self._rows = {}  # chart name -> (data version, rows)
+
+    # Nested writes (add_post emitting a badge, say) fold into the outermost one, which
+    # bumps the version once for everything they touched.
+    @contextmanager
+    def _writing(self, *collections):
+        with self.lock.write():
+            self._pending.update(collections)
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._dirty.update(self._pending)
+                    self.version += 1
+                    for name in self._pending:
+                        self.versions[name] += 1
+                    self._pending.clear()
+
+    def snapshot(self):
+        snap = self._snapshot
+        if snap.version == self.version:
+            return snap
+        with self.lock.read(), self._snapshot_lock:
+            prev = self._snapshot
+            if prev.version == self.version:
+                return prev
+            keyed = {}
+            for name in self.KEYED:
+                if name in self._dirty:
+                    live = getattr(self, name)
+                    keyed[name] = live.freeze() if name != "tasks" else live.freeze().values()
+                else:
+                    keyed[name] = getattr(prev, name)
+            self._dirty.clear()
+            snap = Snapshot(self.version, MappingProxyType(dict(self.versions)),
+                            posts=self.posts.freeze(),
+                            messages=LogView(self.messages, len(self.messages)),
+                            notifications=LogView(self.notifications, len(self.notifications)),
+                            interactions=LogView(self.interactions, len(self.interactions)),
+                            **keyed)
+            self._snapshot = snap
+            return snap
+
+    # Writes so far to each of the named collections, as Snapshot.data_version reports them
+    def data_version(self, *collections):
+        with self.lock.read():
+            return tuple(self.versions[name] for name in collections)
+
+    # Rows for a chart, built from a snapshot and kept until a collection they read changes
+    def _chart_rows(self, name, collections, build):
+        snap = self.snapshot()
+        version = snap.data_version(*collections)
+        cached = self._rows.get(name)
+        if cached is None or cached[0] != version:
+            cached = self._rows[name] = (version, build(snap))
+        return cached[1]
+
+    # Replaces the named collections in one write and rebuilds every index (and badge counter) from them
+    LOADABLE = KEYED + ("posts", "messages", "notifications")
+
+    def load(self, **collections):
+        unknown = set(collections) - set(self.LOADABLE)
+        if unknown:
+            raise ValueError(f"Unknown collections: {', '.join(sorted(unknown))}")
+        touched = (*collections, "likes", "comments", "interactions") if "posts" in collections else collections
+        with self._writing(*touched):
+            for name, value in collections.items():
+                if name == "posts":
+                    value = CowList(value)
+                elif name in self.KEYED and not isinstance(value, RatingStore):
+                    value = CowMap(value)
+                setattr(self, name, value)
+            if "posts" in collections:
+                self.interactions = []
+            self._reindex()
+
+    def _reindex(self):
+        self._post_index = {}
+        for i, post in enumerate(self.posts):
+            self._post_index.setdefault(post.post_id, i)
+        self.memberships = MembershipIndex()
+        for community in self.communities.values():
+            for uid in community.members:
+                self.memberships.add(uid, community.community_id)
+        self._room_index = sorted((r.scheduled_time, r.room_id) for r in self.study_rooms.values())
+        self._rooms_by_key = {}
+        self._rooms_by_user = {}
+        for room in self.study_rooms.values():
+            self._rooms_by_key[room.meeting_key] = room.room_id
+            for uid in room.participants:
+                self._rooms_by_user.setdefault(uid, set()).add(room.room_id)
+        engine = self.badge_engine
+        engine.counters.clear()
+        engine.awarded.clear()
+        for uid, badges in self.badges.items():
+            for badge in badges:
+                engine.claim(uid, badge.name)
+        counts = {USER_JOINED: Counter(self.users),
+                  POST_CREATED: Counter(p.user_id for p in self.posts),
+                  COMMUNITY_CREATED: Counter(c.creator_id for c in self.communities.values()),
+                  ROOM_CREATED: Counter(r.creator_id for rooms in (self.study_rooms, self.archived_rooms)
+                                        for r in rooms.values()),
+                  POMODORO_COMPLETED: Counter({t.user_id: t.sessions_completed for t in self.timers.values()})}
+        for event, per_user in counts.items():
+            for uid, n in per_user.items():
+                engine.counters[(uid, event)] = n
+        self.trending.rebuild((self.posts[i] for i in self._post_index.values()), self.posts_ratings)
+
+    def add_user(self, user):
+        if not user.username.strip():
+            raise ValueError("Username cannot be empty")
+        with self._writing("users", "badges"):
+            if any(u.username.lower() == user.username.lower() for u in self.users.values()):
+                raise ValueError("Username already taken")
+            self.users[user.user_id] = user
+            self.badges[user.user_id] = []
+            self._emit(USER_JOINED, user.user_id)
+
+    def get_user(self, user_id):
+        with self.lock.read():
+            return self.users.get(user_id)
+
+    def find_user_by_username(self, username):
+        return next((u for u in self.snapshot().users.values() if u.username.lower() == username.lower()), None)
+
+    def list_users(self):
+        return self.snapshot().users.values()
+
+    # {user_id: User} for those of `user_ids` that exist, for a page of authors
+    def get_users(self, user_ids):
+        with self.lock.read():
+            return {uid: self.users[uid] for uid in user_ids if uid in self.users}
+
+    def update_user(self, user):
+        with self._writing("users"):
+            self.users[user.user_id] = user
+
+    def add_community(self, community):
+        with self._writing("communities", "users"):
+            community.members = list(dict.fromkeys(community.members))
+            self.communities[community.community_id] = community
+            for uid in community.members:
+                self.memberships.add(uid, community.community_id)
+            creator = self.users.get(community.creator_id)
+            if creator:
+                self.users[creator.user_id] = _joined(creator, community.community_id)
+                self._emit(COMMUNITY_CREATED, creator.user_id)
+
+    def get_community(self, community_id):
+        with self.lock.read():
+            return self.communities.get(community_id)
+
+    def list_communities(self):
+        return self.snapshot().communities.values()
+
+    def get_communities(self, community_ids):
+        with self.lock.read():
+            return {cid: self.communities[cid] for cid in community_ids if cid in self.communities}
+
+    def find_community_by_name(self, name):
+        return next((c for c in self.snapshot().communities.values() if c.name == name), None)
+
+    def join_community(self, user_id, community_id):
+        with self._writing("communities", "users"):
+            user = self.users.get(user_id)
+            community = self.communities.get(community_id)
+            if user and community and self.memberships.add(user_id, community_id):
+                self.users[user_id] = _joined(user, community_id)
+                self.communities[community_id] = _updated(community, members=community.members + [user_id])
+
+    def is_member(self, user_id, community_id):
+        with self.lock.read():
+            return self.memberships.is_member(user_id, community_id)
+
+    def member_count(self, community_id):
+        with self.lock.read():
+            return self.memberships.count(community_id)
+
+    def get_user_communities(self, user_id):
+        with self.lock.read():
+            joined = [self.communities[cid] for cid in self.memberships.joined(user_id) if cid in self.communities]
+        return sorted(joined, key=lambda c: c.name.lower())
+
+    # Walks communities in creation order and skips joined ones with a set lookup, so
+    # with a `limit` it stops after that many instead of visiting every community.
+    def communities_not_joined(self, user_id, limit=None):
+        found = []
+        with self.lock.read():
+            joined = self.memberships.joined(user_id)
+            for community in self.communities.values():
+                if limit is not None and len(found) >= limit:
+                    break
+                if community.community_id not in joined:
+                    found.append(community)
+        return found
+
+    def add_post(self, post):
+        with self._writing("posts"):
+            self.posts.append(post)
+            if self._post_index.setdefault(post.post_id, len(self.posts) - 1) == len(self.posts) - 1:
+                self.trending.add_post(post)
+            self._emit(POST_CREATED, post.user_id)
+
+    def get_post(self, post_id):
+        with self.lock.read():
+            return self._post(post_id)
+
+    def _post(self, post_id):
+        i = self._post_index.get(post_id)
+        return None if i is None else self.posts[i]
+
+    # Best first, from the bounded top-K the trending index keeps per community and globally
+    def trending_posts(self, community_id=None, limit=None):
+        with self.lock.read():
+            return [self._post(post_id) for post_id, _ in self.trending.top(community_id, limit)]
+
+    def list_posts(self, user_id=None):
+        posts = self.snapshot().posts
+        if user_id:
+            return [p for p in posts if p.user_id == user_id]
+        return posts
+
+    # (total, posts) for one page of the feed, newest first; `user_id` limits it to that
+    # user's posts. Only the page is sorted out of the log, not every post.
+    def posts_page(self, offset=0, limit=None, user_id=None):
+        posts = self.list_posts(user_id)
+        if limit is None:
+            return len(posts), sorted(posts, key=attrgetter("timestamp"), reverse=True)[offset:]
+        return len(posts), heapq.nlargest(offset + limit, posts, key=attrgetter("timestamp"))[offset:]
+
+    # Likes and comments have their own versions, so caches of post counts survive them
+    def add_like(self, post_id, user_id):
+        with self._writing("likes", "interactions"):
+            post = self._post(post_id)
+            if post and user_id not in post.likes:
+                self.posts[self._post_index[post_id]] = _updated(post, likes=post.likes + [user_id])
+                self.interactions.append((datetime.now(), "like", user_id, post.community_id, post.tag))
+                self.trending.add(post_id, post.community_id, self.interactions[-1][0], LIKE_WEIGHT)
+
+    def add_comment(self, post_id, user_id, content):
+        with self._writing("comments", "interactions"):
+            post = self._post(post_id)
+            if post:
+                comment = {"user_id": user_id, "content": content, "timestamp": datetime.now()}
+                self.posts[self._post_index[post_id]] = _updated(post, comments=post.comments + [comment])
+                self.interactions.append((comment["timestamp"], "comment", user_id, post.community_id, post.tag))
+                self.trending.add(post_id, post.community_id, comment["timestamp"], COMMENT_WEIGHT)
+
+    def add_message(self, message):
+        with self._writing("messages"):
+            self.messages.append(message)
+            self.notify_user(message.receiver_id, f"New message from {self.get_user(message.sender_id).username}")
+
+    def get_conversation(self, user_id, other_id):
+        return [m for m in self.snapshot().messages
+                if (m.sender_id == user_id and m.receiver_id == other_id) or
+                   (m.sender_id == other_id and m.receiver_id == user_id)]
+
+    def add_study_room(self, room):
+        with self._writing("study_rooms"):
+            previous = self.study_rooms.get(room.room_id)
+            if previous:
+                self._unindex_room(previous)
+            self.study_rooms[room.room_id] = room
+            bisect.insort(self._room_index, (room.scheduled_time, room.room_id))
+            self._rooms_by_key[room.meeting_key] = room.room_id
+            for user_id in room.participants:
+                self._rooms_by_user.setdefault(user_id, set()).add(room.room_id)
+            self._emit(ROOM_CREATED, room.creator_id)
+
+    def _unindex_room(self, room):
+        entry = (room.scheduled_time, room.room_id)
+        i = bisect.bisect_left(self._room_index, entry)
+        if i < len(self._room_index) and self._room_index[i] == entry:
+            del self._room_index[i]
+        if self._rooms_by_key.get(room.meeting_key) == room.room_id:
+            del self._rooms_by_key[room.meeting_key]
+        for user_id in room.participants:
+            self._rooms_by_user.get(user_id, set()).discard(room.room_id)
+
+    def list_study_rooms(self):
+        return self.snapshot().study_rooms.values()
+
+    # Rooms scheduled in [start, end), earliest first, found by bisecting the time index,
+    # so the cost depends on the rooms in the window rather than on all rooms ever made.
+    def upcoming_rooms(self, start=None, end=None, user_id=None):
+        with self.lock.read():
+            index = self._room_index
+            lo = bisect.bisect_left(index, (start,)) if start else 0
+            hi = bisect.bisect_left(index, (end,)) if end else len(index)
+            mine = self._rooms_by_user.get(user_id, set()) if user_id else None
+            return [self.study_rooms[rid] for _, rid in index[lo:hi] if mine is None or rid in mine]
+
+    def get_user_rooms(self, user_id):
+        with self.lock.read():
+            rooms = [self.study_rooms[rid] for rid in self._rooms_by_user.get(user_id, ())]
+        return sorted(rooms, key=lambda r: r.scheduled_time)
+
+    def find_room_by_key(self, meeting_key):
+        with self.lock.read():
+            return self.study_rooms.get(self._rooms_by_key.get(meeting_key))
+
+    def join_study_room(self, room_id, user_id):
+        with self._writing("study_rooms"):
+            room = self.study_rooms.get(room_id)
+            if room and user_id not in room.participants:
+                self.study_rooms[room_id] = _updated(room, participants=room.participants + [user_id])
+                self._rooms_by_user.setdefault(user_id, set()).add(room_id)
+                return True
+            return False
+
+    # Moves rooms that ended before `now` from study_rooms to archived_rooms. They sit at
+    # the front of the time index, so a sweep with nothing to do is one read-locked check
+    # and does not bump the version. Returns how many rooms were archived.
+    def archive_finished_rooms(self, now=None):
+        cutoff = (now or datetime.now()) - StudyRoom.DURATION
+        with self.lock.read():
+            if not self._room_index or self._room_index[0][0] > cutoff:
+                return 0
+        with self._writing("study_rooms", "archived_rooms"):
+            count = 0
+            while count < len(self._room_index) and self._room_index[count][0] <= cutoff:
+                count += 1
+            for _, room_id in self._room_index[:count]:
+                room = self.archived_rooms[room_id] = self.study_rooms.pop(room_id)
+                if self._rooms_by_key.get(room.meeting_key) == room_id:
+                    del self._rooms_by_key[room.meeting_key]
+                for user_id in room.participants:
+                    self._rooms_by_user.get(user_id, set()).discard(room_id)
+            del self._room_index[:count]
+            return count
+
+    # Awards a badge directly, outside the rules. Returns False if the user already has it.
+    def award_badge(self, user_id, badge_name):
+        with self._writing("badges"):
+            badges = self.badges[user_id]
+            if not self.badge_engine.claim(user_id, badge_name):
+                return False
+            self.badges[user_id] = badges + [Badge(str(uuid.uuid4()), badge_name, user_id)]
+            return True
+
+    # Feeds a domain event to the badge engine and stores whatever it awards. Events for
+    # users the store does not know are dropped.
+    def _emit(self, event, user_id):
+        if user_id not in self.users:
+            return
+        earned = self.badge_engine.emit(event, user_id)
+        if earned:
+            with self._writing("badges"):
+                self.badges[user_id] = self.badges[user_id] + [Badge(str(uuid.uuid4()), name, user_id)
+                                                               for name in earned]
+
+    def get_badges(self, user_id):
+        with self.lock.read():
+            return self.badges.get(user_id, [])
+
+    # Sets `user_id`'s rating of the post. Only a user's first rating of a post counts
+    # towards trending, so re-rating cannot pump a score. Raises ValueError unless it is
+    # 1 to 5 stars.
+    def add_rating(self, post_id, user_id, rating):
+        with self._writing("posts_ratings"):
+            previous = self.posts_ratings.rate(post_id, user_id, rating)
+            post = self._post(post_id)
+            if post and previous is None:
+                self.trending.add(post_id, post.community_id, datetime.now(), RATING_WEIGHT)
+
+    # {post_id: RatingSummary} for those of `post_ids` that have been rated
+    def get_ratings(self, post_ids):
+        with self.lock.read():
+            return {pid: self.posts_ratings[pid] for pid in post_ids if pid in self.posts_ratings}
+
+    # RatingSummary of the post, None when nobody has rated it
+    def get_rating(self, post_id):
+        with self.lock.read():
+            return self.posts_ratings.get(post_id)
+
+    def get_user_rating(self, post_id, user_id):
+        with self.lock.read():
+            return self.posts_ratings.user_rating(post_id, user_id)
+
+    def add_community_rating(self, community_id, user_id, rating):
+        with self._writing("communities_ratings"):
+            self.communities_ratings.rate(community_id, user_id, rating)
+
+    def get_community_rating(self, community_id):
+        with self.lock.read():
+            return self.communities_ratings.get(community_id)
+
+    def get_user_community_rating(self, community_id, user_id):
+        with self.lock.read():
+            return self.communities_ratings.user_rating(community_id, user_id)
+
+    def add_task(self, task):
+        with self._writing("tasks"):
+            self.tasks[task.task_id] = task
+
+    def delete_task(self, task_id):
+        with self._writing("tasks"):
+            self.tasks.pop(task_id, None)
+
+    def get_tasks(self, user_id=None, room_id=None):
+        tasks = self.snapshot().tasks
+        if room_id:
+            return [t for t in tasks if t.room_id == room_id]
+        elif user_id:
+            return [t for t in tasks if t.user_id == user_id]
+        return list(tasks)
+
+    # Finishes an elapsed phase on read. The common case, a timer that is still counting,
+    # only takes the read lock and does not bump the version.
+    def get_timer(self, user_id, now=None):
+        with self.lock.read():
+            timer = self.timers.get(user_id) or PomodoroTimer(user_id)
+            if not timer.is_due(now):
+                return timer
+        with self._writing("timers"):
+            timer = self.timers.get(user_id) or PomodoroTimer(user_id)
+            if timer.is_due(now):
+                timer = self.timers[user_id] = timer.next_phase()
+                if timer.mode == "Break":
+                    self._emit(POMODORO_COMPLETED, user_id)
+            return timer
+
+    def toggle_timer(self, user_id, now=None):
+        with self._writing("timers"):
+            timer = self.timers[user_id] = self.get_timer(user_id, now).toggled(now)
+            return timer
+
+    def notify_user(self, user_id, message):
+        with self._writing("notifications"):
+            self.notifications.append({"user_id": user_id, "message": message, "timestamp": datetime.now()})
+
+    # Leaderboard rows, best score first
+    def leaderboard(self, limit=None):
+        rows = self._chart_rows("leaderboard", ("users", "badges", "posts", "tasks"),
+                                lambda snap: sorted(leaderboard_rows(snap), key=itemgetter("Score"), reverse=True))
+        return rows[:limit]
+
+    def community_activity(self):
+        return self._chart_rows("community_activity", ("users",), community_activity_rows)
+
+    def get_notifications(self, user_id):
+        return [n for n in self.snapshot().notifications if n["user_id"] == user_id]
+
+# Background thread that archives finished study rooms every `interval` seconds
+class RoomSweeper:
+    def __init__(self, db, interval=60):
+        self.db = db
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="room-sweeper", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.db.archive_finished_rooms()
+            except Exception as e:
+                print(f"Room sweep failed: {str(e)}")
+
+# Leaderboard rows for a snapshot: one pass over posts and tasks, then one row per user.
+def leaderboard_rows(snap):
+    post_counts = Counter(p.user_id for p in snap.posts)
+    tasks_done = Counter(t.user_id for t in snap.tasks if t.status == "Done")
+    rows = []
+    for user in snap.users.values():
+        badge_count = len(snap.badges.get(user.user_id, []))
+        post_count = post_counts[user.user_id]
+        done = tasks_done[user.user_id]
+        rows.append({"Username": user.username, "Badges": badge_count, "Posts": post_count,
+                     "Tasks Done": done, "Score": badge_count * 10 + post_count * 5 + done * 3})
+    return rows
+
+def community_activity_rows(snap):
+    return [{"Username": user.username, "Communities Joined": len(user.communities)}
+            for user in snap.users.values()]
+
+# User Classes
+class User(ABC):
+    def __init__(self, user_id, username, email, bio="", profile_picture=None):
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+        self.bio = bio
+        self.profile_picture = profile_picture
+        self.communities = []
+        self.is_premium = False
+
+    def join_community(self, community_id):
+        if community_id not in self.communities:
+            self.communities = self.communities + [community_id]
+
+    @abstractmethod
+    def display_profile(self):
+        pass
+
+    def to_dict(self):
+        return {"user_id": self.user_id, "username": self.username, "email": self.email, "bio": self.bio,
+                "profile_picture": self.profile_picture, "communities": list(self.communities),
+                "is_premium": self.is_premium}
+
+    @staticmethod
+    def from_dict(data):
+        cls = PremiumUser if data.get("is_premium") else FreeUser
+        user = cls(data["user_id"], data["username"], data["email"], data.get("bio", ""), data.get("profile_picture"))
+        user.communities = list(data.get("communities", []))
+        return user
+
+class FreeUser(User):
+    def display_profile(self):
+        return f"{self.username} (Free) | Communities: {len(self.communities)}"
+
+class PremiumUser(User):
+    def __init__(self, user_id, username, email, bio="", profile_picture=None):
+        super().__init__(user_id, username, email, bio, profile_picture)
+        self.is_premium = True
+
+    def display_profile(self):
+        return f"{self.username} (Premium ✨) | Communities: {len(self.communities)} | Ad-Free"
+
+# Community
+class Community:
+    def __init__(self, community_id, name, creator_id):
+        self.community_id = community_id
+        self.name = name
+        self.creator_id = creator_id
+        self.members = [creator_id]
+
+    def to_dict(self):
+        return {"community_id": self.community_id, "name": self.name, "creator_id": self.creator_id,
+                "members": list(self.members)}
+
+    @classmethod
+    def from_dict(cls, data):
+        community = cls(data["community_id"], data["name"], data["creator_id"])
+        community.members = list(data.get("members", community.members))
+        return community
+
+# Post
+class Post:
+    def __init__(self, post_id, content, user_id, community_id, tag, timestamp=None):
+        self.post_id = post_id
+        self.content = content
+        self.user_id = user_id
+        self.community_id = community_id
+        self.tag = tag
+        self.timestamp = timestamp or datetime.now()
+        self.likes = []
+        self.comments = []
+
+    def to_dict(self):
+        return {"post_id": self.post_id, "content": self.content, "user_id": self.user_id,
+                "community_id": self.community_id, "tag": self.tag, "timestamp": self.timestamp.isoformat(),
+                "likes": list(self.likes),
+                "comments": [dict(c, timestamp=c["timestamp"].isoformat()) for c in self.comments]}
+
+    @classmethod
+    def from_dict(cls, data):
+        post = cls(data["post_id"], data["content"], data["user_id"], data["community_id"], data["tag"],
+                   _parse_time(data.get("timestamp")))
+        post.likes = list(data.get("likes", []))
+        post.comments = [dict(c, timestamp=_parse_time(c["timestamp"])) for c in data.get("comments", [])]
+        return post
+
+# Message
+class Message:
+    def __init__(self, message_id, sender_id, receiver_id, content, community_id=None, timestamp=None):
+        self.message_id = message_id
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.content = content
+        self.community_id = community_id
+        self.timestamp = timestamp or datetime.now()
+
+    def to_dict(self):
+        return {"message_id": self.message_id, "sender_id": self.sender_id, "receiver_id": self.receiver_id,
+                "content": self.content, "community_id": self.community_id, "timestamp": self.timestamp.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["message_id"], data["sender_id"], data["receiver_id"], data["content"],
+                   data.get("community_id"), _parse_time(data.get("timestamp")))
+
+# Study Room
+class StudyRoom:
+    DURATION = timedelta(hours=2)  # a room counts as finished this long after it starts
+
+    def __init__(self, room_id, name, creator_id, scheduled_time, meeting_key, participants=None):
+        self.room_id = room_id
+        self.name = name
+        self.creator_id = creator_id
+        self.scheduled_time = scheduled_time
+        self.meeting_key = meeting_key
+        self.participants = participants or [creator_id]
+
+    def to_dict(self):
+        return {"room_id": self.room_id, "name": self.name, "creator_id": self.creator_id,
+                "scheduled_time": self.scheduled_time.isoformat(), "meeting_key": self.meeting_key,
+                "participants": list(self.participants)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["room_id"], data["name"], data["creator_id"], _parse_time(data["scheduled_time"]),
+                   data["meeting_key"], list(data.get("participants") or []) or None)
+
+# Badge
+class Badge:
+    def __init__(self, badge_id, name, user_id, timestamp=None):
+        self.badge_id = badge_id
+        self.name = name
+        self.user_id = user_id
+        self.timestamp = timestamp or datetime.now()
+
+    def to_dict(self):
+        return {"badge_id": self.badge_id, "name": self.name, "user_id": self.user_id,
+                "timestamp": self.timestamp.isoformat()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["badge_id"], data["name"], data["user_id"], _parse_time(data.get("timestamp")))
+
+# Task
+class Task:
+    def __init__(self, task_id, user_id, title, status, room_id=None):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.title = title
+        self.status = status
+        self.room_id = room_id
+
+    def to_dict(self):
+        return {"task_id": self.task_id, "user_id": self.user_id, "title": self.title, "status": self.status,
+                "room_id": self.room_id}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["task_id"], data["user_id"], data["title"], data["status"], data.get("room_id"))
+
+# Pomodoro timer state kept in the store, so every tab and process sees the same timer.
+# Only epoch timestamps are stored; remaining time is computed when read. Instances are
+# never mutated: each change returns a new timer, so one a reader holds never changes.
+class PomodoroTimer:
+    DURATIONS = {"Work": 1500, "Break": 300}
+
+    def __init__(self, user_id, mode="Work", deadline=None, remaining=None, sessions_completed=0):
+        self.user_id = user_id
+        self.mode = mode
+        self.deadline = deadline  # epoch seconds while running, None while paused
+        self.remaining = self.DURATIONS[mode] if remaining is None else remaining  # seconds left while paused
+        self.sessions_completed = sessions_completed
+
+    @property
+    def running(self):
+        return self.deadline is not None
+
+    def seconds_left(self, now=None):
+        if not self.running:
+            return self.remaining
+        return max(0.0, self.deadline - (time.time() if now is None else now))
+
+    def is_due(self, now=None):
+        return self.running and self.seconds_left(now) <= 0
+
+    def toggled(self, now=None):
+        now = time.time() if now is None else now
+        if self.running:
+            return PomodoroTimer(self.user_id, self.mode, None, self.seconds_left(now), self.sessions_completed)
+        return PomodoroTimer(self.user_id, self.mode, now + self.remaining, None, self.sessions_completed)
+
+    # The phase that follows an elapsed one; like the original timer it waits to be started
+    def next_phase(self):
+        if self.mode == "Work":
+            return PomodoroTimer(self.user_id, "Break", sessions_completed=self.sessions_completed + 1)
+        return PomodoroTimer(self.user_id, "Work", sessions_completed=self.sessions_completed)
+
+    def to_dict(self):
+        return {"user_id": self.user_id, "mode": self.mode, "deadline": self.deadline, "remaining": self.remaining,
+                "sessions_completed": self.sessions_completed}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["user_id"], data["mode"], data.get("deadline"), data.get("remaining"),
+                   data.get("sessions_completed", 0))
+
+# Shallow copy of a stored record with `changes` applied, to store in its place
+def _updated(record, **changes):
+    record = copy.copy(record)
+    for name, value in changes.items():
+        setattr(record, name, value)
+    return record
+
+def _joined(user, community_id):
+    user = copy.copy(user)
+    user.join_community(community_id)
+    return user
+
+# Wire format shared by api.py and the app's DatabaseClient; archived rooms and timers stay server-side
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+def notification_to_dict(notification):
+    return dict(notification, timestamp=notification["timestamp"].isoformat())
+
+def notification_from_dict(data):
+    return dict(data, timestamp=_parse_time(data["timestamp"]))
+
+def snapshot_to_dict(snap):
+    return {
+        "version": snap.version,
+        "versions": dict(snap.versions),
+        "users": [u.to_dict() for u in snap.users.values()],
+        "communities": [c.to_dict() for c in snap.communities.values()],
+        "posts": [p.to_dict() for p in snap.posts],
+        "messages": [m.to_dict() for m in snap.messages],
+        "study_rooms": [r.to_dict() for r in snap.study_rooms.values()],
+        "badges": {uid: [b.to_dict() for b in badges] for uid, badges in snap.badges.items()},
+        "posts_ratings": {pid: r.to_dict() for pid, r in snap.posts_ratings.items()},
+        "communities_ratings": {cid: r.to_dict() for cid, r in snap.communities_ratings.items()},
+        "tasks": [t.to_dict() for t in snap.tasks],
+        "notifications": [notification_to_dict(n) for n in snap.notifications],
+        "interactions": [[when.isoformat(), *rest] for when, *rest in snap.interactions],
+    }
+
+def snapshot_from_dict(data):
+    return Snapshot(
+        data["version"],
+        MappingProxyType(data.get("versions", {})),
+        users=MappingProxyType({u["user_id"]: User.from_dict(u) for u in data["users"]}),
+        communities=MappingProxyType({c["community_id"]: Community.from_dict(c) for c in data["communities"]}),
+        posts=tuple(Post.from_dict(p) for p in data["posts"]),
+        messages=tuple(Message.from_dict(m) for m in data["messages"]),
+        study_rooms=MappingProxyType({r["room_id"]: StudyRoom.from_dict(r) for r in data["study_rooms"]}),
+        badges=MappingProxyType({uid: [Badge.from_dict(b) for b in badges] for uid, badges in data["badges"].items()}),
+        posts_ratings=MappingProxyType({pid: RatingSummary.from_dict(r) for pid, r in data["posts_ratings"].items()}),
+        communities_ratings=MappingProxyType({cid: RatingSummary.from_dict(r)
+                                              for cid, r in data["communities_ratings"].items()}),
+        tasks=tuple(Task.from_dict(t) for t in data["tasks"]),
+        notifications=tuple(notification_from_dict(n) for n in data["notifications"]),
+        interactions=tuple((_parse_time(when), *rest) for when, *rest in data.get("interactions", [])),
+    )
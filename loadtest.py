@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import aiohttp
+
+from perf import percentile
+
+# Load generator for api.py on localhost. It starts the server itself (in this process or as
+# a uvicorn subprocess, optionally with several workers) or targets --url, then drives
+# /notify, /notifications and /chat WebSockets and reports throughput, latency percentiles,
+# error rates and server RSS.
+#   python loadtest.py --concurrency 500 --duration 30                # closed: 500 clients back to back
+#   python loadtest.py --rate 2000 --duration 30 --server subprocess  # open: 2000 arrivals per second
+#   python loadtest.py --sockets 5000 --mix chat=1                    # WebSocket fan-in
+# Open-workload latency is measured from each request's scheduled start, so a stalled
+# server shows up as latency instead of silently lowering the offered load.
+OPS = ("notify", "notifications", "chat")
+
+# The servers started here get limits sized for the test; rate limiting from a single
+# client IP would otherwise turn most of the load into 429s. --keep-limits keeps them.
+LOAD_LIMITS = {"STUDYHIVE_IP_RATE": "1000000", "STUDYHIVE_IP_BURST": "1000000", "STUDYHIVE_USER_RATE": "1000000",
+               "STUDYHIVE_USER_BURST": "1000000", "STUDYHIVE_MAX_INFLIGHT": "100000",
+               "STUDYHIVE_MAX_SOCKETS": "100000"}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Resident memory of a process and its children in bytes, from /proc (Linux only).
+def process_rss(pid):
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            total += next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, StopIteration):
+        return total or None
+    return total + sum(process_rss(child) or 0 for child in children)
+
+class InProcessServer:
+    def __init__(self, keep_limits=False):
+        if not keep_limits:
+            os.environ.update(LOAD_LIMITS)
+        import uvicorn
+        import api
+        if not keep_limits:
+            _raise_limits(api)
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.pid = os.getpid()  # RSS includes the load generator itself
+        self._server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=self.port,
+                                                     log_level="warning", backlog=65535))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(10)
+
+# api.py reads its limits at import time; when it was imported earlier (e.g. by tests) the
+# limiters already exist, so they are widened in place.
+def _raise_limits(api):
+    api.limits = api.Limits.from_env()
+    for limiter in (api.notify_user_limiter, api.notify_ip_limiter, api.chat_user_limiter, api.chat_ip_limiter):
+        limiter.rate = limiter.burst = float(LOAD_LIMITS["STUDYHIVE_IP_RATE"])
+
+class SubprocessServer:
+    def __init__(self, workers=1, keep_limits=False):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self.env = dict(os.environ, **({} if keep_limits else LOAD_LIMITS))
+        if workers > 1:
+            self.env.setdefault("STUDYHIVE_STATE_BACKEND", "sqlite")
+            self.env["WEB_CONCURRENCY"] = str(workers)
+        self._proc = None
+
+    @property
+    def pid(self):
+        return self._proc.pid
+
+    def start(self):
+        self._proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--workers", str(self.workers), "--backlog", "65535", "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=self.env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {self._proc.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("uvicorn did not start within 30s")
+
+    def stop(self):
+        self._proc.terminate()
+        try:
+            self._proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {op: [] for op in OPS}
+        self.errors = {op: Counter() for op in OPS}
+        self.connects = []  # chat WebSocket handshake times
+        self.dropped = 0  # open workload arrivals skipped because max_outstanding was reached
+
+    def record(self, op, seconds, error=None):
+        if error is None:
+            self.latencies[op].append(seconds)
+        else:
+            self.errors[op][error] += 1
+
+    def report(self, elapsed):
+        ops = {}
+        for op in OPS:
+            samples = sorted(self.latencies[op])
+            errors = sum(self.errors[op].values())
+            total = len(samples) + errors
+            if not total:
+                continue
+            ops[op] = {"requests": total, "ok": len(samples), "errors": errors, "error_rate": errors / total,
+                       "throughput_rps": len(samples) / elapsed,
+                       "p50_ms": percentile(samples, 50) * 1000, "p95_ms": percentile(samples, 95) * 1000,
+                       "p99_ms": percentile(samples, 99) * 1000, "max_ms": samples[-1] * 1000 if samples else 0.0,
+                       "error_kinds": dict(self.errors[op])}
+        return ops
+
+# One chat WebSocket. Every sent message carries a token; the server echoes it back on
+# the sender's socket, and that echo completes the round trip.
+class ChatClient:
+    def __init__(self, session, ws_base, sender, receiver):
+        self.session = session
+        self.url = f"{ws_base}/chat/{sender}/{receiver}"
+        self.ws = None
+        self.pending = {}
+        self._reader = None
+
+    async def connect(self):
+        self.ws = await self.session.ws_connect(self.url, heartbeat=None)
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            if "error" in data:
+                # Refused frames are not echoed; fail the oldest waiter
+                if self.pending:
+                    self.pending.pop(next(iter(self.pending))).set_exception(RuntimeError(data["error"]))
+                continue
+            future = self.pending.pop(data.get("content"), None)
+            if future and not future.done():
+                future.set_result(None)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("socket closed"))
+
+    async def round_trip(self):
+        token = uuid.uuid4().hex
+        future = self.pending[token] = asyncio.get_running_loop().create_future()
+        try:
+            await self.ws.send_str(token)
+            await future
+        finally:
+            self.pending.pop(token, None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await self._reader
+
+class LoadTest:
+    def __init__(self, url, mix, users=1000, sockets=100, timeout=10.0, seed=0):
+        self.url = url.rstrip("/")
+        self.weights = [mix.get(op, 0) for op in OPS]
+        self.users = [f"load-{i}" for i in range(users)]
+        self.socket_count = sockets if mix.get("chat") else 0
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.recorder = Recorder()
+        self.session = None
+        self.chats = []
+
+    async def setup(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        ws_base = self.url.replace("http", "ws", 1)
+        for i in range(self.socket_count):
+            chat = ChatClient(self.session, ws_base, self.users[i % len(self.users)],
+                              self.users[(i + 1) % len(self.users)])
+            start = time.perf_counter()
+            try:
+                await chat.connect()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.recorder.errors["chat"][f"connect:{type(e).__name__}"] += 1
+                continue
+            self.recorder.connects.append(time.perf_counter() - start)
+            self.chats.append(chat)
+
+    async def teardown(self):
+        await asyncio.gather(*(chat.close() for chat in self.chats), return_exceptions=True)
+        await self.session.close()
+
+    async def _request(self, op):
+        user = self.rng.choice(self.users)
+        if op == "notify":
+            async with self.session.post(f"{self.url}/notify", json={"user_id": user, "message": "load test"}) as r:
+                await r.read()
+                return None if r.status == 200 else f"http_{r.status}"
+        if op == "notifications":
+            async with self.session.get(f"{self.url}/notifications", params={"user_id": user}) as r:
+                await r.read()
+                return None if r.status == 200 else f"http_{r.status}"
+        if not self.chats:
+            return "no_socket"
+        await self.rng.choice(self.chats).round_trip()
+        return None
+
+    async def one(self, op, started):
+        try:
+            error = await asyncio.wait_for(self._request(op), self.timeout)
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except Exception as e:
+            error = type(e).__name__
+        self.recorder.record(op, time.perf_counter() - started, error)
+
+    def pick(self):
+        return self.rng.choices(OPS, self.weights)[0]
+
+    # Closed workload: `concurrency` clients, each issuing its next request when the last one returns.
+    async def closed(self, concurrency, duration):
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            while time.perf_counter() < deadline:
+                await self.one(self.pick(), time.perf_counter())
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    # Open workload: Poisson arrivals at `rate` per second regardless of how fast responses come back.
+    async def open(self, rate, duration, max_outstanding=10000):
+        start = time.perf_counter()
+        scheduled = start
+        tasks = set()
+        while True:
+            scheduled += self.rng.expovariate(rate)
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= max_outstanding:
+                self.recorder.dropped += 1
+                continue
+            task = asyncio.create_task(self.one(self.pick(), scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op not in OPS:
+            raise ValueError(f"Unknown operation in mix: {op}")
+        mix[op] = float(weight or 1)
+    return mix
+
+async def drive(test, args, pid=None):
+    rss = {"start": process_rss(pid) if pid else None, "peak": None}
+
+    async def watch_rss():
+        while True:
+            value = process_rss(pid)
+            if value is not None:
+                rss["peak"] = max(rss["peak"] or 0, value)
+            await asyncio.sleep(0.5)
+
+    watcher = asyncio.create_task(watch_rss()) if pid else None
+    await test.setup()
+    started = time.perf_counter()
+    try:
+        if args.rate:
+            await test.open(args.rate, args.duration, args.max_outstanding)
+        else:
+            await test.closed(args.concurrency, args.duration)
+    finally:
+        elapsed = time.perf_counter() - started
+        if watcher:
+            watcher.cancel()
+        rss["end"] = process_rss(pid) if pid else None
+        await test.teardown()
+    connects = sorted(test.recorder.connects)
+    return {
+        "meta": {"url": test.url, "server": args.server, "workers": args.workers,
+                 "workload": "open" if args.rate else "closed", "rate": args.rate, "concurrency": args.concurrency,
+                 "duration": args.duration, "elapsed": elapsed, "mix": dict(zip(OPS, test.weights)),
+                 "sockets": len(test.chats), "dropped_arrivals": test.recorder.dropped},
+        "ops": test.recorder.report(elapsed),
+        "connect": {"count": len(connects), "p50_ms": percentile(connects, 50) * 1000,
+                    "p99_ms": percentile(connects, 99) * 1000},
+        "server_rss_mb": {k: round(v / 2**20, 1) if v else None for k, v in rss.items()},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive api.py with concurrent notify, notifications and chat load.")
+    parser.add_argument("--server", choices=["inprocess", "subprocess"], default="inprocess",
+                        help="how to start api.py (ignored with --url)")
+    parser.add_argument("--url", help="target an already running server instead")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --server subprocess")
+    parser.add_argument("--keep-limits", action="store_true", help="keep the server's rate and concurrency limits")
+    parser.add_argument("--mix", default="notify=1,notifications=1,chat=1", help="operation weights")
+    parser.add_argument("--concurrency", type=int, default=100, help="clients in the closed workload")
+    parser.add_argument("--rate", type=float, help="arrivals per second; selects the open workload")
+    parser.add_argument("--max-outstanding", type=int, default=10000, help="open workload in-flight cap")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sockets", type=int, default=100, help="chat WebSockets held open during the run")
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = None
+    if not args.url:
+        server = (SubprocessServer(args.workers, args.keep_limits) if args.server == "subprocess"
+                  else InProcessServer(args.keep_limits))
+        server.start()
+    try:
+        test = LoadTest(args.url or server.url, mix, args.users, args.sockets, args.timeout, args.seed)
+        report = asyncio.run(drive(test, args, server.pid if server else None))
+    finally:
+        if server:
+            server.stop()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    meta = report["meta"]
+    print(f"{meta['workload']} workload against {meta['url']} for {meta['elapsed']:.1f}s, "
+          f"{meta['sockets']} sockets, {meta['dropped_arrivals']} dropped arrivals")
+    for op, r in report["ops"].items():
+        print(f"{op:14} {r['throughput_rps']:9.1f} req/s  p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  "
+              f"p99 {r['p99_ms']:8.2f} ms  errors {r['error_rate']:.2%} {r['error_kinds'] or ''}")
+    print(f"server RSS MB: {report['server_rss_mb']}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import codecs
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+import pypdf
+from whoosh.analysis import StemmingAnalyzer
+from whoosh.fields import Schema, ID, NUMERIC, TEXT
+from whoosh.highlight import ContextFragmenter, HtmlFormatter
+from whoosh.index import create_in, exists_in, open_dir
+from whoosh.qparser import OrGroup, QueryParser
+from whoosh.query import Or, Term
+
+# Study-material library on local disk. Uploads are streamed to a temp file in chunks
+# while being hashed, so a file is never held in memory whole, and identical content
+# is stored once no matter how often or where it is shared. Text is extracted once per
+# file into a UTF-8 sidecar; previews and summaries read byte slices of it through mmap.
+#   <root>/<id[:2]>/<id>          original upload (id = SHA-256 of its bytes)
+#   <root>/<id[:2]>/<id>.txt      extracted text, pages back to back
+#   <root>/catalog.jsonl          one line per file and per listing, append-only
+CHUNK_SIZE = 1 << 20
+TEXT_PAGE_CHARS = 3000  # plain text has no pages; it is split into chunks of about this size
+
+class Material:
+    def __init__(self, material_id, content_type, size, text_bytes=0, page_offsets=None):
+        self.material_id = material_id
+        self.content_type = content_type
+        self.size = size
+        self.text_bytes = text_bytes
+        self.page_offsets = page_offsets or []  # byte offset in the text file where each page starts
+
+    @property
+    def pages(self):
+        return len(self.page_offsets)
+
+    def page_span(self, page):
+        start = self.page_offsets[page]
+        end = self.page_offsets[page + 1] if page + 1 < self.pages else self.text_bytes
+        return start, end
+
+    def to_dict(self):
+        return {"material_id": self.material_id, "content_type": self.content_type, "size": self.size,
+                "text_bytes": self.text_bytes, "page_offsets": self.page_offsets}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["material_id"], data["content_type"], data["size"], data.get("text_bytes", 0),
+                   data.get("page_offsets"))
+
+# A material as shared in one community: the same file can be listed in several.
+class Listing:
+    def __init__(self, material_id, community_id, name, uploader_id, uploaded_at=None):
+        self.material_id = material_id
+        self.community_id = community_id
+        self.name = name
+        self.uploader_id = uploader_id
+        self.uploaded_at = uploaded_at or time.time()
+
+    def to_dict(self):
+        return {"material_id": self.material_id, "community_id": self.community_id, "name": self.name,
+                "uploader_id": self.uploader_id, "uploaded_at": self.uploaded_at}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["material_id"], data["community_id"], data["name"], data["uploader_id"],
+                   data["uploaded_at"])
+
+def pdf_pages(path):
+    reader = pypdf.PdfReader(path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+def text_pages(path):
+    # Incremental decode, so multi-byte characters split across chunks survive
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            buffer += decoder.decode(chunk)
+            while len(buffer) >= TEXT_PAGE_CHARS:
+                cut = buffer.rfind("\n", 0, TEXT_PAGE_CHARS) + 1 or TEXT_PAGE_CHARS
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+EXTRACTORS = {"application/pdf": pdf_pages, "text/plain": text_pages}
+
+class MaterialLibrary:
+    def __init__(self, root="materials"):
+        self.root = root
+        self.materials = {}  # material_id -> Material
+        self.listings = {}  # community_id -> list of Listing, newest last
+        self._catalog = os.path.join(root, "catalog.jsonl")
+        self._catalog_pos = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.refresh()
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("STUDYHIVE_MATERIALS_DIR", "materials"))
+
+    # Picks up catalog lines appended since the last call, including by other processes
+    def refresh(self):
+        with self._lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        if not os.path.exists(self._catalog) or os.path.getsize(self._catalog) == self._catalog_pos:
+            return
+        with open(self._catalog, "rb") as f:
+            f.seek(self._catalog_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a writer is mid-append; read it next time
+                self._catalog_pos += len(line)
+                self._apply(json.loads(line))
+
+    def _apply(self, record):
+        if record["kind"] == "material":
+            material = Material.from_dict(record)
+            self.materials[material.material_id] = material
+        else:
+            listing = Listing.from_dict(record)
+            listed = self.listings.setdefault(listing.community_id, [])
+            if not any(l.material_id == listing.material_id for l in listed):
+                self.listings[listing.community_id] = listed + [listing]
+
+    # Callers hold the lock. Reading back through the catalog also applies lines other
+    # processes appended in between, in file order.
+    def _append(self, kind, record):
+        with open(self._catalog, "a") as f:
+            f.write(json.dumps(dict(record, kind=kind)) + "\n")
+        self._refresh_locked()
+
+    def path(self, material_id, text=False):
+        return os.path.join(self.root, material_id[:2], material_id + (".txt" if text else ""))
+
+    # Streams `fileobj` to disk and lists it in the community. Returns (listing, is_new_file).
+    def add(self, fileobj, name, content_type, community_id, uploader_id):
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := fileobj.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            material_id = digest.hexdigest()
+            with self._lock:
+                self._refresh_locked()
+                is_new = material_id not in self.materials
+            if is_new:
+                # Extraction runs unlocked; a concurrent upload of the same file writes identical results
+                os.makedirs(os.path.dirname(self.path(material_id)), exist_ok=True)
+                os.replace(tmp, self.path(material_id))
+                material = self._extract(material_id, content_type, size)
+            with self._lock:
+                self._refresh_locked()
+                if material_id not in self.materials:
+                    self._append("material", material.to_dict())
+                listing = next((l for l in self.listings.get(community_id, []) if l.material_id == material_id), None)
+                if listing is None:
+                    listing = Listing(material_id, community_id, name, uploader_id)
+                    self._append("listing", listing.to_dict())
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return listing, is_new
+
+    def _extract(self, material_id, content_type, size):
+        extractor = EXTRACTORS.get(content_type)
+        offsets = []
+        written = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, "wb") as out:
+            if extractor:
+                try:
+                    for page in extractor(self.path(material_id)):
+                        data = page.encode("utf-8")
+                        offsets.append(written)
+                        out.write(data)
+                        written += len(data)
+                except (pypdf.errors.PyPdfError, UnicodeDecodeError, ValueError):
+                    offsets, written = [], 0  # keep the file, it just has no searchable text
+                    out.seek(0)
+                    out.truncate()
+        os.replace(tmp, self.path(material_id, text=True))
+        return Material(material_id, content_type, size, written, offsets)
+
+    def list(self, community_id):
+        self.refresh()
+        return sorted(self.listings.get(community_id, []), key=lambda l: l.uploaded_at, reverse=True)
+
+    def get(self, material_id):
+        self.refresh()
+        return self.materials.get(material_id)
+
+    # Decoded text of bytes [start, end) of the extracted text, read through mmap, so only
+    # the touched pages of the file are loaded. A slice that cuts a character drops it.
+    def read_text(self, material_id, start=0, end=None):
+        material = self.get(material_id)
+        if material is None or not material.text_bytes:
+            return ""
+        end = material.text_bytes if end is None else min(end, material.text_bytes)
+        with open(self.path(material_id, text=True), "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end].decode("utf-8", errors="ignore")
+
+    def page_text(self, material_id, page):
+        material = self.get(material_id)
+        return self.read_text(material_id, *material.page_span(page))
+
+# Full-text index over the library, one Whoosh document per page. Pages are read from the
+# extracted-text sidecar, so indexing never runs a PDF through the extractor again, and a
+# material is indexed once per content hash however many communities list it. Page text
+# is not stored in the index; snippets are cut from the sidecar for the hits shown.
+class MaterialIndex:
+    SCHEMA = Schema(page_key=ID(unique=True), material_id=ID(stored=True), page=NUMERIC(stored=True),
+                    content=TEXT(analyzer=StemmingAnalyzer()))
+
+    def __init__(self, library, dirname=None):
+        self.library = library
+        self.dirname = dirname or os.path.join(library.root, "index")
+        os.makedirs(self.dirname, exist_ok=True)
+        self.ix = open_dir(self.dirname) if exists_in(self.dirname) else create_in(self.dirname, self.SCHEMA)
+        with self.ix.reader() as reader:
+            self.indexed = {term.decode() for term in reader.lexicon("material_id")}
+        self._searcher = self.ix.searcher()
+        self._parser = QueryParser("content", self.SCHEMA, group=OrGroup.factory(0.9))
+        self._lock = threading.Lock()
+
+    # Indexes every material in the library catalog that is not indexed yet, including
+    # ones added by other processes. Returns how many were indexed.
+    def sync(self):
+        self.library.refresh()
+        pending = [m for m in list(self.library.materials.values()) if m.material_id not in self.indexed]
+        if not pending:
+            return 0
+        with self._lock:
+            writer = self.ix.writer(timeout=10)
+            for material in pending:
+                for page in range(material.pages):
+                    # update_document keeps this idempotent if another process indexed it first
+                    writer.update_document(page_key=f"{material.material_id}:{page}", material_id=material.material_id,
+                                           page=page, content=self.library.page_text(material.material_id, page))
+            writer.commit()
+            self.indexed.update(m.material_id for m in pending)
+        return len(pending)
+
+    # Page-level hits, best first: dicts with material_id, page (0-based), score and an
+    # HTML snippet with matches in <b>. community_id limits hits to what it lists.
+    def search(self, query_string, community_id=None, limit=10):
+        self.sync()
+        query = self._parser.parse(query_string)
+        allowed = None
+        if community_id is not None:
+            listed = self.library.list(community_id)
+            if not listed:
+                return []
+            allowed = Or([Term("material_id", l.material_id) for l in listed])
+        with self._lock:
+            self._searcher = self._searcher.refresh()
+            results = self._searcher.search(query, limit=limit, filter=allowed)
+            results.fragmenter = ContextFragmenter(maxchars=200, surround=60)
+            results.formatter = HtmlFormatter(tagname="b")
+            hits = []
+            for hit in results:
+                text = self.library.page_text(hit["material_id"], hit["page"])
+                hits.append({"material_id": hit["material_id"], "page": hit["page"], "score": hit.score,
+                             "snippet": hit.highlights("content", text=text, top=2)})
+        return hits
+
+    def close(self):
+        self._searcher.close()
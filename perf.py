@@ -0,0 +1,184 @@
+import cProfile
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Always-on timing layer for Streamlit reruns: a measured block costs two perf_counter
+# calls and a deque append. The last `window` samples per name are kept, and
+# percentiles are only computed when someone asks for a summary.
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank: the smallest sample with at least q% of the samples at or below it
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+class Timings:
+    def __init__(self, window=1000):
+        self.window = window
+        self._samples = {}  # name -> deque of seconds
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[name] += 1
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def wrap(self, name):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        with self._lock:
+            items = [(name, sorted(samples), self._counts[name]) for name, samples in self._samples.items()]
+        rows = [{"name": name, "count": count,
+                 "p50_ms": percentile(values, 50) * 1000, "p95_ms": percentile(values, 95) * 1000,
+                 "p99_ms": percentile(values, 99) * 1000, "max_ms": values[-1] * 1000,
+                 "total_ms": sum(values) * 1000}
+                for name, values, count in items]
+        return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+timings = Timings()
+
+# Bounded LRU for values derived from store data (aggregates, chart figures), keyed by
+# name and the data version they were built from. A write to the collections a value
+# depends on changes its version, so stale entries are never returned; they age out.
+class VersionedCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name, version, build):
+        key = (name, version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = build()  # outside the lock; two sessions may build the same value once each
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+# Wraps a Database or DatabaseClient so every public method call is recorded as
+# "db.<method>". Wrappers are built once per method name; attributes pass through.
+class InstrumentedDatabase:
+    def __init__(self, db, registry=timings):
+        self._db = db
+        self._registry = registry
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        wrapped = self._registry.wrap(f"db.{name}")(attr)
+        self.__dict__[name] = wrapped
+        return wrapped
+
+# Collects the calling thread's stacks every `interval` seconds from a helper thread and
+# writes them in the collapsed "frame;frame;frame count" format flamegraph tools read.
+class StackSampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+# Profiling mode: STUDYHIVE_PROFILE=cprofile writes one .prof file per rerun (open it
+# with pstats or snakeviz), STUDYHIVE_PROFILE=sample writes one .folded stack file.
+# Output goes to STUDYHIVE_PROFILE_DIR (default "profiles"). Unset, from_env() returns
+# None and reruns run unwrapped.
+class RerunProfiler:
+    def __init__(self, mode, out_dir="profiles", interval=0.005):
+        if mode not in ("cprofile", "sample"):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        self.mode = mode
+        self.out_dir = out_dir
+        self.interval = interval
+
+    @classmethod
+    def from_env(cls):
+        mode = os.environ.get("STUDYHIVE_PROFILE")
+        return cls(mode, os.environ.get("STUDYHIVE_PROFILE_DIR", "profiles")) if mode else None
+
+    def run(self, func, label="rerun"):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stem = os.path.join(self.out_dir, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func)
+            finally:
+                profile.dump_stats(stem + ".prof")
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        try:
+            return func()
+        finally:
+            sampler.stop()
+            sampler.dump(stem + ".folded")
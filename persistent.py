@@ -0,0 +1,166 @@
+from collections.abc import ItemsView, Mapping, MutableMapping, Sequence, ValuesView
+from itertools import islice
+
+# Copy-on-write collections: freeze() shares shards/chunks, the next write to one copies it
+
+# Hash-sharded (position, value) entries; the key log keeps insertion order
+class FrozenMap(Mapping):
+    SHARDS = 256
+
+    def __init__(self, shards, order, order_len, length):
+        self._shards = shards
+        self._order = order
+        self._order_len = order_len
+        self._len = length
+
+    def __getitem__(self, key):
+        return self._shards[hash(key) % self.SHARDS][key][1]
+
+    def __contains__(self, key):
+        return key in self._shards[hash(key) % self.SHARDS]
+
+    def get(self, key, default=None):
+        entry = self._shards[hash(key) % self.SHARDS].get(key)
+        return default if entry is None else entry[1]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return (key for key, _ in self._entries())
+
+    def _entries(self):
+        shards, order, n = self._shards, self._order, self.SHARDS
+        for pos in range(self._order_len):
+            key = order[pos]
+            entry = shards[hash(key) % n].get(key)
+            if entry is not None and entry[0] == pos:
+                yield key, entry[1]
+
+    def values(self):
+        return _Values(self)
+
+    def items(self):
+        return _Items(self)
+
+class _Values(ValuesView):
+    def __iter__(self):
+        return (value for _, value in self._mapping._entries())
+
+class _Items(ItemsView):
+    def __iter__(self):
+        return self._mapping._entries()
+
+class CowMap(FrozenMap, MutableMapping):
+    def __init__(self, items=()):
+        self._shards = [{} for _ in range(self.SHARDS)]
+        self._shared = [False] * self.SHARDS
+        self._order = []
+        self._len = 0
+        self.update(items)
+
+    @property
+    def _order_len(self):
+        return len(self._order)
+
+    def _writable(self, key):
+        i = hash(key) % self.SHARDS
+        if self._shared[i]:
+            self._shards[i] = dict(self._shards[i])
+            self._shared[i] = False
+        return self._shards[i]
+
+    def __setitem__(self, key, value):
+        shard = self._writable(key)
+        entry = shard.get(key)
+        if entry is None:
+            shard[key] = (len(self._order), value)
+            self._order.append(key)
+            self._len += 1
+        else:
+            shard[key] = (entry[0], value)
+
+    def __delitem__(self, key):
+        del self._writable(key)[key]
+        self._len -= 1
+        if len(self._order) > 2 * self._len + 1024:
+            self._compact()
+
+    # New lists, so frozen views keep their own
+    def _compact(self):
+        entries = list(self._entries())
+        self._shards = [{} for _ in range(self.SHARDS)]
+        self._shared = [False] * self.SHARDS
+        self._order = []
+        self._len = 0
+        self.update(entries)
+
+    def freeze(self):
+        self._shared = [True] * self.SHARDS
+        return FrozenMap(tuple(self._shards), self._order, len(self._order), self._len)
+
+# Appends land past every frozen length, so only replacing an item copies its chunk
+class FrozenList(Sequence):
+    CHUNK = 1024
+
+    def __init__(self, chunks, length):
+        self._chunks = chunks
+        self._len = length
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            items = []
+            while start < stop:
+                chunk, offset = divmod(start, self.CHUNK)
+                part = self._chunks[chunk][offset:offset + stop - start]
+                items.extend(part)
+                start += len(part)
+            return items
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list index out of range")
+        return self._chunks[index // self.CHUNK][index % self.CHUNK]
+
+    def __iter__(self):
+        remaining = self._len
+        for chunk in self._chunks:
+            if remaining <= 0:
+                break
+            yield from islice(chunk, remaining)
+            remaining -= len(chunk)
+
+class CowList(FrozenList):
+    def __init__(self, items=()):
+        items = list(items)
+        self._chunks = [items[i:i + self.CHUNK] for i in range(0, len(items), self.CHUNK)]
+        self._shared = [False] * len(self._chunks)
+        self._len = len(items)
+
+    def append(self, item):
+        if not self._chunks or len(self._chunks[-1]) == self.CHUNK:
+            self._chunks.append([])
+            self._shared.append(False)
+        self._chunks[-1].append(item)
+        self._len += 1
+
+    def __setitem__(self, index, item):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("list assignment index out of range")
+        chunk, offset = divmod(index, self.CHUNK)
+        if self._shared[chunk]:
+            self._chunks[chunk] = list(self._chunks[chunk])
+            self._shared[chunk] = False
+        self._chunks[chunk][offset] = item
+
+    def freeze(self):
+        self._shared = [True] * len(self._chunks)
+        return FrozenList(tuple(self._chunks), self._len)
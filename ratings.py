@@ -0,0 +1,80 @@
+from collections.abc import Mapping
+
+from persistent import CowMap
+
+# One rating per user and target, with a running count/sum/histogram summary per target
+STARS = range(1, 6)
+
+class RatingSummary:
+    def __init__(self, count=0, total=0, histogram=None):
+        self.count = count
+        self.total = total
+        self.histogram = tuple(histogram or (0,) * len(STARS))  # ratings per star, 1 star first
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else None
+
+    # The summary with one user's rating set to `stars`, replacing `previous` if they had one
+    def rated(self, stars, previous=None):
+        histogram = list(self.histogram)
+        histogram[stars - 1] += 1
+        count, total = self.count + 1, self.total + stars
+        if previous is not None:
+            histogram[previous - 1] -= 1
+            count, total = count - 1, total - previous
+        return RatingSummary(count, total, histogram)
+
+    def to_dict(self):
+        return {"count": self.count, "total": self.total, "histogram": list(self.histogram)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["count"], data["total"], data["histogram"])
+
+# Read-only mapping of target_id -> RatingSummary; only rate() changes it
+class RatingStore(Mapping):
+    def __init__(self):
+        self._summaries = CowMap()  # target_id -> RatingSummary
+        self._ratings = CowMap()  # (target_id, user_id) -> stars
+
+    def __getitem__(self, target_id):
+        return self._summaries[target_id]
+
+    def __iter__(self):
+        return iter(self._summaries)
+
+    def __len__(self):
+        return len(self._summaries)
+
+    # Sets the user's rating of the target and returns their previous one (None if new)
+    def rate(self, target_id, user_id, stars):
+        if not isinstance(stars, int) or stars not in STARS:
+            raise ValueError(f"Rating must be {STARS[0]} to {STARS[-1]} stars")
+        key = (target_id, user_id)
+        previous = self._ratings.get(key)
+        if stars != previous:
+            self._ratings[key] = stars
+            self._summaries[target_id] = self._summaries.get(target_id, RatingSummary()).rated(stars, previous)
+        return previous
+
+    def user_rating(self, target_id, user_id):
+        return self._ratings.get((target_id, user_id))
+
+    # (target_id, user_id, stars) for every rating, for exports
+    def ratings(self):
+        return [(target_id, user_id, stars) for (target_id, user_id), stars in self._ratings.items()]
+
+    # Read-only view that later ratings do not change, sharing storage rather than copying it
+    def freeze(self):
+        frozen = RatingStore.__new__(RatingStore)
+        frozen._summaries = self._summaries.freeze()
+        frozen._ratings = self._ratings.freeze()
+        return frozen
+
+    @classmethod
+    def from_ratings(cls, ratings):
+        store = cls()
+        for target_id, user_id, stars in ratings:
+            store.rate(target_id, user_id, stars)
+        return store
@@ -2,8 +2,37 @@ import pytest
 import uuid
 from datetime import datetime, timedelta
 import requests
-from app import Database, FreeUser, PremiumUser, Community, Post, Message, StudyRoom, Task, Badge
-import re
+import socket
+import threading
+import time
+import uvicorn
+import asyncio
+import aiohttp
+import json
+import os
+import subprocess
+import sys
+from app import (Database, FreeUser, PremiumUser, Community, Post, Message, StudyRoom, Task, NotificationOutbox,
+                 DatabaseClient, post_card, post_card_html, analytics_figures, index_post)
+from database import RWLock, RoomSweeper
+from badges import BadgeRule, POST_CREATED
+import api
+from backends import MemoryBackend, SQLiteBackend, RetentionPolicy, StateBackend
+from perf import Timings, InstrumentedDatabase, RerunProfiler, VersionedCache, percentile
+import pstats
+import bench
+import columnar
+import io
+from PIL import Image
+from blobs import BlobStore
+from materials import MaterialLibrary, MaterialIndex
+from analytics import EngagementAnalytics
+from trending import TrendingIndex
+import materials
+import loadtest
+import pandas as pd
+from whoosh.index import open_dir
+from whoosh.qparser import QueryParser
 
 # Mock Streamlit session state for testing
 class MockSessionState:
@@ -44,6 +73,40 @@ def community(db, user):
     db.add_community(comm)
     return comm
 
+# Small seeded bench dataset, exported once per session in the columnar format; each test
+# that asks for seeded_db gets its own Database loaded from it.
+@pytest.fixture(scope="session")
+def dataset_dir(tmp_path_factory):
+    db = bench.generate(bench.scaled_sizes(0.001), seed=3)
+    user_id, post = next(iter(db.users)), db.posts[0]
+    db.add_rating(post.post_id, user_id, 4)
+    db.add_community_rating(next(iter(db.communities)), user_id, 5)
+    db.toggle_timer(user_id, now=0)
+    db.archive_finished_rooms(datetime(2025, 2, 1))
+    path = tmp_path_factory.mktemp("dataset")
+    columnar.export_database(db, str(path))
+    return str(path)
+
+@pytest.fixture
+def seeded_db(dataset_dir):
+    return columnar.import_database(dataset_dir)
+
+# Runs api.py under uvicorn in a background thread so API tests do not need a server
+@pytest.fixture(scope="session")
+def live_api():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(5)
+
 # Functional Tests
 def test_user_creation(db):
     user_id = str(uuid.uuid4())
@@ -74,8 +137,8 @@ def test_community_creation(db, user):
     comm = Community(comm_id, "Math Club", user.user_id)
     db.add_community(comm)
     assert comm_id in db.communities
-    assert comm_id in user.communities
-    assert user.user_id in comm.members
+    assert comm_id in db.get_user(user.user_id).communities
+    assert user.user_id in db.get_community(comm_id).members
     assert any(b.name == "Community Leader" for b in db.badges[user.user_id])
 
 def test_post_creation(db, user, community):
@@ -85,6 +148,16 @@ def test_post_creation(db, user, community):
     assert post in db.posts
     assert any(b.name == "First Post" for b in db.badges[user.user_id])
 
+def test_badges_are_awarded_once_per_user(db, user, community):
+    db.badge_engine.add_rule(BadgeRule("Prolific Poster", POST_CREATED, threshold=3))
+    for n in range(4):
+        db.add_post(Post(str(uuid.uuid4()), f"Tip {n}", user.user_id, community.community_id, "StudyTip"))
+    db.add_community(Community(str(uuid.uuid4()), "Second Club", user.user_id))
+    assert not db.award_badge(user.user_id, "Community Leader")
+    assert db.award_badge(user.user_id, "Helper") and not db.award_badge(user.user_id, "Helper")
+    assert [b.name for b in db.get_badges(user.user_id)] == ["Welcome", "Community Leader", "First Post",
+                                                            "Prolific Poster", "Helper"]
+
 def test_post_like_comment(db, user, community):
     post_id = str(uuid.uuid4())
     post = Post(post_id, "Great tip!", user.user_id, community.community_id, "Motivation")
@@ -94,6 +167,84 @@ def test_post_like_comment(db, user, community):
     db.add_comment(post_id, user.user_id, "Thanks!")
     assert db.posts[0].comments[0]["content"] == "Thanks!"
 
+def test_trending_scores_decay_in_log_space():
+    trending = TrendingIndex(half_life=timedelta(hours=1), k=2)
+    now = datetime(2025, 3, 1, 12)
+    trending.add("a", "c1", now - timedelta(hours=2), 4.0)
+    trending.add("a", "c1", now - timedelta(hours=1), 1.0)
+    trending.add("b", "c1", now, 2.0)
+    assert trending.decayed(trending.scores["a"], now) == pytest.approx(4 / 4 + 1 / 2)
+    assert [post_id for post_id, _ in trending.top("c1")] == ["b", "a"]
+    # Bounded: a third post only gets in by beating the K-th
+    trending.add("c", "c2", now, 1.0)
+    assert [post_id for post_id, _ in trending.top()] == ["b", "a"]
+    trending.add("c", "c2", now, 2.0)
+    assert [post_id for post_id, _ in trending.top()] == ["c", "b"]
+    assert [post_id for post_id, _ in trending.top("c2")] == ["c"] and trending.top("missing") == []
+
+def test_trending_posts_follow_engagement(db, user, premium_user, community):
+    old = Post(str(uuid.uuid4()), "Old tip", user.user_id, community.community_id, "StudyTip",
+               datetime.now() - timedelta(days=2))
+    new = Post(str(uuid.uuid4()), "New tip", user.user_id, community.community_id, "StudyTip")
+    db.add_post(old)
+    db.add_post(new)
+    assert db.trending_posts() == [new, old]
+    for _ in range(3):
+        db.add_comment(old.post_id, premium_user.user_id, "Still useful")
+    assert [p.post_id for p in db.trending_posts(community.community_id)] == [old.post_id, new.post_id]
+    score = db.trending.scores[new.post_id]
+    db.add_rating(new.post_id, premium_user.user_id, 4)
+    db.add_rating(new.post_id, premium_user.user_id, 4)  # the same rating again is not new engagement
+    assert db.trending.scores[new.post_id] > score
+    assert db.trending.decayed(db.trending.scores[new.post_id], datetime.now()) == pytest.approx(2.5, rel=1e-3)
+    db.load(posts=[db.get_post(old.post_id), new])
+    assert [p.post_id for p in db.trending_posts(limit=1)] == [old.post_id] and db.trending_posts("missing") == []
+
+def test_rerating_cannot_inflate_trending(db, user, premium_user, community):
+    liked = Post(str(uuid.uuid4()), "Liked tip", user.user_id, community.community_id, "StudyTip")
+    rated = Post(str(uuid.uuid4()), "Rated tip", user.user_id, community.community_id, "StudyTip")
+    db.add_post(liked)
+    db.add_post(rated)
+    for liker in (user, premium_user):
+        db.add_like(liked.post_id, liker.user_id)
+    db.add_rating(rated.post_id, premium_user.user_id, 5)
+    top = db.trending.top()
+    # A rating changed back and forth, as the Explore slider used to do on every render
+    for _ in range(50):
+        for stars in (1, 5):
+            db.add_rating(rated.post_id, premium_user.user_id, stars)
+    assert db.trending.top() == top
+    assert [p.post_id for p in db.trending_posts()] == [liked.post_id, rated.post_id]
+
+def test_rerating_matches_trending_rebuild(db, user, premium_user, community):
+    post = Post(str(uuid.uuid4()), "Rate me", user.user_id, community.community_id, "StudyTip")
+    db.add_post(post)
+    db.add_rating(post.post_id, premium_user.user_id, 5)
+    for stars in (4, 5, 1, 5, 3):
+        db.add_rating(post.post_id, user.user_id, stars)
+    rebuilt = TrendingIndex()
+    rebuilt.rebuild([post], db.posts_ratings)
+    assert db.trending.scores[post.post_id] == pytest.approx(rebuilt.scores[post.post_id])
+
+def test_ratings_one_per_user_with_running_summary(db, user, premium_user, community):
+    post = Post(str(uuid.uuid4()), "Rate me", user.user_id, community.community_id, "StudyTip")
+    db.add_post(post)
+    assert db.get_rating(post.post_id) is None
+    db.add_rating(post.post_id, user.user_id, 5)
+    db.add_rating(post.post_id, premium_user.user_id, 3)
+    before = db.snapshot().posts_ratings[post.post_id]
+    db.add_rating(post.post_id, user.user_id, 1)  # replaces their 5
+    summary = db.get_rating(post.post_id)
+    assert (summary.count, summary.total, summary.average, summary.histogram) == (2, 4, 2, (1, 0, 1, 0, 0))
+    assert (before.count, before.histogram) == (2, (0, 0, 1, 0, 1))  # snapshots keep the old summary
+    assert db.get_user_rating(post.post_id, user.user_id) == 1
+    for bad in (0, 6, "5", 2.5):
+        with pytest.raises(ValueError):
+            db.add_rating(post.post_id, user.user_id, bad)
+    db.add_community_rating(community.community_id, premium_user.user_id, 4)
+    assert db.get_community_rating(community.community_id).average == 4
+    assert db.get_user_community_rating(community.community_id, user.user_id) is None
+
 def test_study_room_creation(db, user):
     room_id = str(uuid.uuid4())
     meeting_key = str(uuid.uuid4())[:8]
@@ -119,6 +270,217 @@ def test_message_and_notification(db, user, premium_user):
     notifs = db.get_notifications(premium_user.user_id)
     assert any(n["message"] == f"New message from {user.username}" for n in notifs)
 
+def test_join_community_is_idempotent(db, user, premium_user, community):
+    db.join_community(premium_user.user_id, community.community_id)
+    db.join_community(premium_user.user_id, community.community_id)
+    assert db.get_community(community.community_id).members.count(premium_user.user_id) == 1
+    assert community.community_id in db.get_user(premium_user.user_id).communities
+
+def test_membership_index_both_ways(db, user, premium_user, community):
+    others = [Community(str(uuid.uuid4()), f"Club {i}", premium_user.user_id) for i in range(3)]
+    for other in others:
+        db.add_community(other)
+    db.join_community(premium_user.user_id, community.community_id)
+    db.join_community(premium_user.user_id, community.community_id)
+    assert db.is_member(premium_user.user_id, community.community_id)
+    assert db.member_count(community.community_id) == 2 == len(db.get_community(community.community_id).members)
+    assert [c.name for c in db.get_user_communities(premium_user.user_id)] == ["Club 0", "Club 1", "Club 2",
+                                                                               "Test Community"]
+    assert [c.name for c in db.communities_not_joined(user.user_id)] == ["Club 0", "Club 1", "Club 2"]
+    assert [c.name for c in db.communities_not_joined(user.user_id, limit=1)] == ["Club 0"]
+    assert db.communities_not_joined(premium_user.user_id) == []
+    assert not db.is_member(user.user_id, others[0].community_id) and db.member_count("missing") == 0
+
+def test_join_study_room(db, user, premium_user):
+    room = StudyRoom(str(uuid.uuid4()), "Join Me", user.user_id, datetime.now() + timedelta(days=1), "key12345")
+    db.add_study_room(room)
+    found = db.find_room_by_key("key12345")
+    assert db.join_study_room(found.room_id, premium_user.user_id)
+    assert not db.join_study_room(found.room_id, premium_user.user_id)
+    assert db.find_room_by_key("key12345").participants == [user.user_id, premium_user.user_id]
+    assert room.participants == [user.user_id]  # the stored room was replaced, not changed
+
+def test_room_schedule_windows_and_archive(db, user, premium_user):
+    now = datetime(2025, 3, 1, 12)
+    rooms = [StudyRoom(str(uuid.uuid4()), f"Room {h}", user.user_id, now + timedelta(hours=h), f"key{h}")
+             for h in (5, -10, 1, 30, -1)]
+    for room in rooms:
+        db.add_study_room(room)
+    db.join_study_room(rooms[3].room_id, premium_user.user_id)
+    window = db.upcoming_rooms(now - StudyRoom.DURATION, now + timedelta(days=1))
+    assert [r.name for r in window] == ["Room -1", "Room 1", "Room 5"]
+    assert [r.name for r in db.upcoming_rooms(now, user_id=premium_user.user_id)] == ["Room 30"]
+    assert [r.name for r in db.get_user_rooms(user.user_id)] == ["Room -10", "Room -1", "Room 1", "Room 5", "Room 30"]
+
+    # Rescheduling moves the room in the index instead of listing it twice
+    db.add_study_room(StudyRoom(rooms[2].room_id, "Room 1", user.user_id, now + timedelta(hours=40), "key1"))
+    assert [r.name for r in db.upcoming_rooms(now)] == ["Room 5", "Room 30", "Room 1"]
+
+    version = db.version
+    assert db.archive_finished_rooms(now) == 1 and db.archive_finished_rooms(now) == 0
+    assert db.version == version + 1
+    assert rooms[1].room_id in db.archived_rooms and rooms[1].room_id not in db.study_rooms
+    assert db.find_room_by_key("key-10") is None and db.find_room_by_key("key-1").name == "Room -1"
+    assert db.archive_finished_rooms(now + timedelta(hours=3)) == 1
+    assert [r.name for r in db.get_user_rooms(user.user_id)] == ["Room 5", "Room 30", "Room 1"]
+
+def test_room_sweeper_archives_in_background(db, user):
+    db.add_study_room(StudyRoom(str(uuid.uuid4()), "Old", user.user_id, datetime.now() - timedelta(days=1), "old"))
+    sweeper = RoomSweeper(db, interval=0.01).start()
+    try:
+        deadline = time.time() + 2
+        while db.study_rooms and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sweeper.stop()
+    assert not db.study_rooms and len(db.archived_rooms) == 1
+
+# Concurrency Tests
+def test_rwlock_readers_share_writers_exclude():
+    lock = RWLock()
+    both_reading = threading.Barrier(2, timeout=2)
+    def reader():
+        with lock.read():
+            both_reading.wait()  # only passes if two readers hold the lock at once
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    order = []
+    def writer():
+        with lock.write():
+            order.append("write")
+    with lock.read():
+        t = threading.Thread(target=writer)
+        t.start()
+        time.sleep(0.05)
+        assert order == []  # writer waits for the active reader
+    t.join(2)
+    assert order == ["write"]
+
+def test_rwlock_is_reentrant_for_writer():
+    lock = RWLock()
+    with lock.write():
+        with lock.read():
+            with lock.write():
+                pass
+    with lock.read():
+        with lock.read():
+            pass
+
+def test_concurrent_sessions_stress(db, community):
+    writers, posts_each = 8, 50
+    errors = []
+    stop = threading.Event()
+
+    def session(n):
+        try:
+            author = FreeUser(str(uuid.uuid4()), f"stress{n}", f"stress{n}@example.com")
+            db.add_user(author)
+            db.join_community(author.user_id, community.community_id)
+            for i in range(posts_each):
+                post = Post(str(uuid.uuid4()), f"post {n}-{i}", author.user_id, community.community_id, "StudyTip")
+                db.add_post(post)
+                db.add_like(post.post_id, author.user_id)
+                db.add_like(post.post_id, author.user_id)
+                db.add_comment(post.post_id, author.user_id, "me too")
+                db.add_task(Task(str(uuid.uuid4()), author.user_id, f"task {i}", "Done"))
+        except Exception as e:
+            errors.append(e)
+
+    def render():
+        try:
+            while not stop.is_set():
+                with db.lock.read():
+                    for u in db.users.values():
+                        sum(1 for p in db.posts if p.user_id == u.user_id)
+                snap = db.snapshot()
+                for u in snap.users.values():
+                    sum(1 for p in snap.posts if p.user_id == u.user_id)
+                for p in db.list_posts():
+                    assert len(p.likes) <= 1
+                db.list_users()
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=render) for _ in range(4)]
+    sessions = [threading.Thread(target=session, args=(n,)) for n in range(writers)]
+    for t in readers + sessions:
+        t.start()
+    for t in sessions:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+    assert not errors
+    assert len(db.list_posts()) == writers * posts_each
+    assert len(db.get_tasks()) == writers * posts_each
+    assert len(db.get_community(community.community_id).members) == writers + 1
+    for u in db.list_users():
+        if u.username.startswith("stress"):
+            assert sum(1 for b in db.get_badges(u.user_id) if b.name == "First Post") == 1
+
+def test_snapshot_is_cached_per_version(db, user, community):
+    snap = db.snapshot()
+    assert db.snapshot() is snap
+    db.add_post(Post(str(uuid.uuid4()), "v2", user.user_id, community.community_id, "StudyTip"))
+    newer = db.snapshot()
+    assert newer is not snap
+    assert newer.version > snap.version
+    assert len(snap.posts) == 0 and len(newer.posts) == 1
+
+def test_snapshot_isolated_from_later_writes(db, user, premium_user, community):
+    post = Post(str(uuid.uuid4()), "before", user.user_id, community.community_id, "StudyTip")
+    db.add_post(post)
+    snap = db.snapshot()
+    db.add_like(post.post_id, user.user_id)
+    db.join_community(premium_user.user_id, community.community_id)
+    db.add_user(FreeUser(str(uuid.uuid4()), "latecomer", "late@example.com"))
+    db.add_post(Post(str(uuid.uuid4()), "after", user.user_id, community.community_id, "StudyTip"))
+    db.add_task(Task(str(uuid.uuid4()), user.user_id, "later", "To-Do"))
+    assert [p.content for p in snap.posts] == ["before"]
+    assert "latecomer" not in [u.username for u in snap.users.values()]
+    assert len(snap.tasks) == 0
+    assert snap.posts[0].likes == [] and post.likes == []
+    assert db.snapshot().posts[0].likes == [user.user_id]
+    assert snap.communities[community.community_id].members == [user.user_id]
+    assert community.community_id not in snap.users[premium_user.user_id].communities
+    assert db.snapshot().communities[community.community_id].members == [user.user_id, premium_user.user_id]
+    with pytest.raises(TypeError):
+        snap.users["x"] = user
+
+def test_snapshot_iteration_during_writes(db, user, community):
+    for i in range(200):
+        db.add_post(Post(str(uuid.uuid4()), f"p{i}", user.user_id, community.community_id, "StudyTip"))
+    snap = db.snapshot()
+    def write():
+        for i in range(500):
+            db.add_post(Post(str(uuid.uuid4()), f"w{i}", user.user_id, community.community_id, "StudyTip"))
+            db.add_user(FreeUser(str(uuid.uuid4()), f"w{i}", f"w{i}@example.com"))
+    t = threading.Thread(target=write)
+    t.start()
+    for _ in range(20):
+        assert sum(1 for _ in snap.posts) == 200
+        assert len(list(snap.users.values())) == 1
+    t.join()
+    assert len(db.snapshot().posts) == 700
+
+def test_concurrent_signup_same_username(db):
+    results = []
+    def signup(i):
+        try:
+            db.add_user(FreeUser(str(uuid.uuid4()), "racer", f"racer{i}@example.com"))
+            results.append("ok")
+        except ValueError:
+            results.append("taken")
+    threads = [threading.Thread(target=signup, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count("ok") == 1
+
 # Security Tests
 def test_empty_inputs(db):
     user_id = str(uuid.uuid4())
@@ -180,23 +542,893 @@ def test_notification_spam(db, user):
     assert all(n["message"].startswith("Spam") for n in notifs)
 
 # API Tests
-def test_notify_endpoint():
+def test_notify_endpoint(live_api):
+    response = requests.post(f"{live_api}/notify", 
+                             json={"user_id": "test_user", "message": "Test notification"})
+    assert response.status_code == 200
+    assert response.json() == {"status": "Notification sent"}
+
+def test_notify_invalid_input(live_api):
+    response = requests.post(f"{live_api}/notify", json={})
+    assert response.status_code == 422  # FastAPI validation error
+
+def test_notify_batch_skips_invalid(live_api):
+    response = requests.post(f"{live_api}/notify/batch",
+                             json=[{"user_id": "batch_user", "message": "one"}, {"message": "no user"}])
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 1
+    assert response.json()["rejected"] == 1
+
+# Database Service Tests (app.DatabaseClient against api.py's /db endpoints)
+@pytest.fixture
+def remote_db(live_api):
+    client = DatabaseClient(live_api, ttl=60)
+    yield client
+    client.close()
+
+@pytest.fixture
+def remote_user(remote_db):
+    name = f"remote-{uuid.uuid4().hex[:8]}"
+    user = FreeUser(str(uuid.uuid4()), name, f"{name}@example.com")
+    remote_db.add_user(user)
+    return user
+
+def test_remote_users_and_badges(remote_db, remote_user):
+    fetched = remote_db.get_user(remote_user.user_id)
+    assert fetched.username == remote_user.username and not fetched.is_premium
+    assert remote_db.find_user_by_username(remote_user.username.upper()).user_id == remote_user.user_id
+    assert remote_db.get_user("missing") is None
+    with pytest.raises(ValueError, match="Username already taken"):
+        remote_db.add_user(FreeUser(str(uuid.uuid4()), remote_user.username, "dup@example.com"))
+    with pytest.raises(ValueError, match="Username cannot be empty"):
+        remote_db.add_user(FreeUser(str(uuid.uuid4()), " ", "blank@example.com"))
+    remote_db.award_badge(remote_user.user_id, "Pomodoro Master")
+    assert [b.name for b in remote_db.get_badges(remote_user.user_id)] == ["Welcome", "Pomodoro Master"]
+
+def test_remote_posts_likes_comments(remote_db, remote_user):
+    cid = str(uuid.uuid4())
+    remote_db.add_community(Community(cid, f"Remote {cid[:6]}", remote_user.user_id))
+    assert cid in remote_db.get_user(remote_user.user_id).communities
+    post = Post(str(uuid.uuid4()), "Remote tip", remote_user.user_id, cid, "StudyTip")
+    posts_version = remote_db.data_version("posts")
+    remote_db.add_post(post)
+    remote_db.add_like(post.post_id, remote_user.user_id)
+    remote_db.add_comment(post.post_id, remote_user.user_id, "Nice")
+    remote_db.add_rating(post.post_id, remote_user.user_id, 4)
+    [stored] = remote_db.list_posts(user_id=remote_user.user_id)
+    total, [paged] = remote_db.posts_page(0, 5, user_id=remote_user.user_id)
+    assert total == 1 and paged.post_id == post.post_id
+    assert remote_db.get_users([remote_user.user_id, "missing"])[remote_user.user_id].username == remote_user.username
+    assert remote_db.get_communities([cid])[cid].name == remote_db.find_community_by_name(f"Remote {cid[:6]}").name
+    assert remote_db.get_ratings([post.post_id])[post.post_id].average == 4
+    assert any(row["Username"] == remote_user.username for row in remote_db.leaderboard())
+    assert remote_db.data_version("posts") > posts_version
+    assert stored.likes == [remote_user.user_id]
+    assert stored.comments[0]["content"] == "Nice"
+    assert stored.timestamp == post.timestamp
+    assert remote_db.get_rating(post.post_id).average == 4
+    assert remote_db.get_user_rating(post.post_id, remote_user.user_id) == 4
+    with pytest.raises(ValueError):
+        remote_db.add_rating(post.post_id, remote_user.user_id, 6)
+    for target in ("posts", "communities"):
+        response = requests.put(f"{remote_db.base_url}/{target}/missing/rating",
+                                json={"user_id": remote_user.user_id, "rating": 4})
+        assert response.status_code == 404
+    assert any(b.name == "First Post" for b in remote_db.get_badges(remote_user.user_id))
+    assert remote_db.get_post(post.post_id).likes == [remote_user.user_id]
+    assert remote_db.get_post("missing") is None
+    assert [i[1] for i in remote_db.snapshot().interactions if i[2] == remote_user.user_id] == ["like", "comment"]
+    assert [p.post_id for p in remote_db.trending_posts(cid)] == [post.post_id]
+
+def test_remote_rooms_tasks_messages(remote_db, remote_user):
+    other = FreeUser(str(uuid.uuid4()), f"other-{uuid.uuid4().hex[:8]}", "other@example.com")
+    remote_db.add_user(other)
+    key = uuid.uuid4().hex[:8]
+    room = StudyRoom(str(uuid.uuid4()), "Remote Room", remote_user.user_id, datetime.now() + timedelta(days=1), key)
+    remote_db.add_study_room(room)
+    assert remote_db.find_room_by_key(key).room_id == room.room_id
+    assert remote_db.join_study_room(room.room_id, other.user_id)
+    assert not remote_db.join_study_room(room.room_id, other.user_id)
+    community = Community(str(uuid.uuid4()), f"Remote {key}", remote_user.user_id)
+    remote_db.add_community(community)
+    remote_db.join_community(other.user_id, community.community_id)
+    remote_db.join_community(other.user_id, community.community_id)
+    assert remote_db.is_member(other.user_id, community.community_id)
+    assert remote_db.member_count(community.community_id) == 2
+    assert community.community_id in [c.community_id for c in remote_db.get_user_communities(other.user_id)]
+    assert community.community_id not in [c.community_id for c in remote_db.communities_not_joined(other.user_id)]
+    window = remote_db.upcoming_rooms(datetime.now(), datetime.now() + timedelta(days=2), other.user_id)
+    assert [r.room_id for r in window] == [room.room_id]
+    assert room.room_id in [r.room_id for r in remote_db.get_user_rooms(other.user_id)]
+    task = Task(str(uuid.uuid4()), remote_user.user_id, "Read ch. 1", "To-Do", room.room_id)
+    remote_db.add_task(task)
+    remote_db.add_task(Task(task.task_id, remote_user.user_id, "Read ch. 1", "Done", room.room_id))
+    assert [t.status for t in remote_db.get_tasks(room_id=room.room_id)] == ["Done"]
+    remote_db.delete_task(task.task_id)
+    assert remote_db.get_tasks(room_id=room.room_id) == []
+    remote_db.add_message(Message(str(uuid.uuid4()), remote_user.user_id, other.user_id, "Hi"))
+    assert [m.content for m in remote_db.get_conversation(other.user_id, remote_user.user_id)] == ["Hi"]
+    notifs = remote_db.get_notifications(other.user_id)
+    assert notifs[0]["message"] == f"New message from {remote_user.username}"
+    assert isinstance(notifs[0]["timestamp"], datetime)
+
+def test_remote_snapshot_carries_data_versions(remote_db, remote_user):
+    before = remote_db.snapshot().data_version("users", "tasks")
+    remote_db.add_task(Task(str(uuid.uuid4()), remote_user.user_id, "Read", "To-Do"))
+    after = remote_db.snapshot().data_version("users", "tasks")
+    assert after[0] == before[0] and after[1] == before[1] + 1
+
+def test_remote_timer_is_shared(live_api, remote_db, remote_user):
+    other_tab = DatabaseClient(live_api, ttl=60)
+    try:
+        started = remote_db.toggle_timer(remote_user.user_id)
+        assert started.running and started.mode == "Work"
+        seen = other_tab.get_timer(remote_user.user_id)
+        assert seen.deadline == pytest.approx(started.deadline)
+        assert 1490 < seen.seconds_left() <= 1500
+        assert not other_tab.toggle_timer(remote_user.user_id).running
+    finally:
+        other_tab.close()
+
+def test_remote_snapshot_revalidates_by_version(live_api, remote_db, remote_user):
+    first = remote_db.snapshot()
+    assert remote_db.snapshot() is first  # served from the TTL cache
+    etag = requests.get(f"{live_api}/db/snapshot").headers["ETag"]
+    assert requests.get(f"{live_api}/db/snapshot", headers={"If-None-Match": etag}).status_code == 304
+    remote_db.add_task(Task(str(uuid.uuid4()), remote_user.user_id, "new", "To-Do"))
+    second = remote_db.snapshot()
+    assert second.version > first.version
+    assert remote_user.user_id in second.users
+
+def test_remote_clients_share_state(live_api, remote_db, remote_user):
+    other_process = DatabaseClient(live_api, ttl=0)
     try:
-        response = requests.post("http://localhost:8000/notify", 
-                               json={"user_id": "test_user", "message": "Test notification"})
-        assert response.status_code == 200
-        assert response.json() == {"status": "Notification sent"}
-    except requests.ConnectionError:
-        pytest.skip("FastAPI server not running")
-
-def test_notify_invalid_input():
+        assert other_process.get_user(remote_user.user_id).username == remote_user.username
+    finally:
+        other_process.close()
+
+def test_remote_cache_is_bounded_and_404s_have_defaults(live_api, remote_user):
+    client = DatabaseClient(live_api, ttl=60, maxsize=2)
     try:
-        response = requests.post("http://localhost:8000/notify", json={})
-        assert response.status_code == 422  # FastAPI validation error
-    except requests.ConnectionError:
-        pytest.skip("FastAPI server not running")
+        for i in range(5):
+            assert client.get_user(f"missing-{i}") is None
+        assert client.get_user(remote_user.user_id).username == remote_user.username
+        assert len(client._cache) == 2
+        client.base_url = f"{live_api}/nowhere"  # every path is a 404
+        assert not client.is_member(remote_user.user_id, "c") and client.member_count("c") == 0
+        assert client.get_rating("p") is None and client.get_user_community_rating("c", remote_user.user_id) is None
+        with pytest.raises(requests.HTTPError):
+            client.get_tasks(remote_user.user_id)
+    finally:
+        client.close()
+
+def test_db_is_only_served_by_a_single_worker():
+    assert api.serves_db({}) and api.serves_db({"WEB_CONCURRENCY": "1"})
+    assert not api.serves_db({"WEB_CONCURRENCY": "4"})
+
+# State Backend Tests
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_memory_backend_pubsub_and_notifications():
+    async def scenario():
+        backend = MemoryBackend(queue_size=2)
+        await backend.start()
+        sub = backend.subscribe("chat:bob")
+        other = backend.subscribe("chat:carol")
+        for i in range(3):
+            await backend.publish("chat:bob", {"n": i})
+        assert [await sub.get(), await sub.get()] == [{"n": 1}, {"n": 2}]
+        assert sub.dropped == 1 and other.queue.empty()
+        await backend.publish("chat:carol", {"n": 0})
+        assert backend.subscription_stats() == {"subscriptions": 2, "queued": 1, "max_queue_depth": 1, "dropped": 1}
+        sub.close()
+        await backend.publish("chat:bob", {"n": 3})  # no subscribers left: nothing to deliver
+        now = time.time()
+        await backend.add_notifications([{"user_id": "u", "message": "m", "timestamp": now}])
+        assert await backend.list_notifications() == [
+            {"user_id": "u", "message": "m", "timestamp": datetime.fromtimestamp(now).isoformat()}]
+        await backend.stop()
+    asyncio.run(scenario())
+
+def test_sqlite_backend_shares_state_between_workers(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "state.db")
+        worker_a, worker_b = SQLiteBackend(path), SQLiteBackend(path)
+        await worker_a.start()
+        await worker_b.start()
+        await worker_a._beat()  # learn about worker_b without waiting for the heartbeat
+        inbox = worker_b.subscribe("chat:bob")
+        await worker_a.publish("chat:bob", {"content": "across workers"})
+        assert await asyncio.wait_for(inbox.get(), 2) == {"content": "across workers"}
+        assert worker_a.subscription_stats()["peers"] == 1
+        assert worker_b.subscription_stats()["subscriptions"] == 1
+        await worker_a.add_notifications([{"user_id": "u", "message": "from a", "timestamp": time.time()}])
+        assert [n["message"] for n in await worker_b.list_notifications()] == ["from a"]
+        await worker_b.stop()
+        await worker_a._beat()
+        assert worker_a._peers == []
+        await worker_a.stop()
+    asyncio.run(scenario())
+
+def _notes(user_id, count, start=0, at=None):
+    return [{"user_id": user_id, "message": f"{user_id} {i}", "timestamp": at or time.time()}
+            for i in range(start, start + count)]
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_notification_retention(kind, tmp_path):
+    async def scenario():
+        policy = RetentionPolicy(max_age=3600, max_per_user=3, max_total=5, max_bytes=0)
+        backend = MemoryBackend(retention=policy) if kind == "memory" else \
+            SQLiteBackend(str(tmp_path / "state.db"), retention=policy)
+        await backend.start()
+        try:
+            await backend.add_notifications(_notes("ann", 4))
+            assert [n["message"] for n in await backend.list_notifications("ann")] == ["ann 1", "ann 2", "ann 3"]
+            await backend.add_notifications(_notes("bob", 3))
+            await backend.compact()  # the SQLite backend enforces the global cap here
+            listed = [n["message"] for n in await backend.list_notifications()]
+            assert listed == ["ann 2", "ann 3", "bob 0", "bob 1", "bob 2"]
+            await backend.add_notifications(_notes("old", 1, at=time.time() - 7200))
+            await backend.compact()
+            assert await backend.list_notifications("old") == []
+            stats = await backend.stats()
+            assert stats["entries"] <= 5 and stats["approx_bytes"] > 0
+        finally:
+            await backend.stop()
+    asyncio.run(scenario())
+
+def test_memory_backend_stays_bounded_under_churn():
+    async def scenario():
+        policy = RetentionPolicy(max_per_user=10, max_total=1000, max_bytes=200_000)
+        backend = MemoryBackend(retention=policy)
+        for round_ in range(50):
+            await backend.add_notifications(_notes(f"user{round_ % 300}", 40, start=round_ * 40))
+            await backend.compact()
+        stats = await backend.stats()
+        assert stats["entries"] <= 1000 and stats["approx_bytes"] <= 200_000
+        assert stats["order_slots"] == stats["entries"]  # compaction dropped stale order entries
+        listed = await backend.list_notifications()
+        assert len(listed) == stats["entries"]
+        for i in range(50):
+            assert len(await backend.list_notifications(f"user{i}")) <= 10
+    asyncio.run(scenario())
+
+def test_notification_stats_endpoint(live_api):
+    requests.post(f"{live_api}/notify", json={"user_id": "stats_user", "message": "counted"})
+    stats = requests.get(f"{live_api}/notifications/stats").json()
+    assert stats["entries"] >= 1 and stats["users"] >= 1
+    mine = requests.get(f"{live_api}/notifications", params={"user_id": "stats_user"}).json()
+    assert [n["message"] for n in mine] == ["counted"]
+
+async def _chat(ws_base, sender, receiver):
+    session = aiohttp.ClientSession()
+    return session, await session.ws_connect(f"{ws_base}/chat/{sender}/{receiver}")
+
+def test_chat_routes_between_peers(live_api):
+    async def scenario():
+        base = live_api.replace("http", "ws", 1)
+        alice_s, alice = await _chat(base, "alice", "bob")
+        bob_s, bob = await _chat(base, "bob", "alice")
+        carol_s, carol = await _chat(base, "bob", "carol")
+        try:
+            await alice.send_str("hi bob")
+            got = json.loads((await bob.receive(timeout=2)).data)
+            assert got["sender_id"] == "alice" and got["content"] == "hi bob"
+            assert json.loads((await alice.receive(timeout=2)).data)["content"] == "hi bob"  # echo
+            with pytest.raises(asyncio.TimeoutError):
+                await carol.receive(timeout=0.2)  # bob's other conversation stays quiet
+        finally:
+            for session in (alice_s, bob_s, carol_s):
+                await session.close()
+    asyncio.run(scenario())
+
+def test_chat_across_worker_processes(tmp_path):
+    env = dict(os.environ, STUDYHIVE_STATE_BACKEND="sqlite", STUDYHIVE_STATE_PATH=str(tmp_path / "state.db"))
+    ports, procs = [], []
+    for _ in range(2):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        ports.append(sock.getsockname()[1])
+        sock.close()
+    try:
+        for port in ports:
+            procs.append(subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--port", str(port),
+                                           "--log-level", "warning"], cwd=os.path.dirname(__file__), env=env))
+        for port in ports:
+            for _ in range(100):
+                try:
+                    requests.get(f"http://127.0.0.1:{port}/notifications", timeout=1)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+        time.sleep(1.5)  # one heartbeat so each worker knows the other
+
+        requests.post(f"http://127.0.0.1:{ports[0]}/notify", json={"user_id": "x", "message": "shared"})
+        assert any(n["message"] == "shared" for n in requests.get(f"http://127.0.0.1:{ports[1]}/notifications").json())
+
+        async def scenario():
+            alice_s, alice = await _chat(f"ws://127.0.0.1:{ports[0]}", "alice", "bob")
+            bob_s, bob = await _chat(f"ws://127.0.0.1:{ports[1]}", "bob", "alice")
+            try:
+                await alice.send_str("hello from worker 0")
+                got = json.loads((await bob.receive(timeout=3)).data)
+                assert got["content"] == "hello from worker 0"
+            finally:
+                await alice_s.close()
+                await bob_s.close()
+        asyncio.run(scenario())
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait(10)
+
+# Rate Limiting Tests
+def test_token_bucket_lazy_refill():
+    limiter = api.TokenBucketLimiter(rate=2, burst=3)
+    assert [limiter.take("u", now=0) for _ in range(3)] == [0, 0, 0]
+    assert limiter.take("u", now=0) == pytest.approx(0.5)
+    assert limiter.take("u", now=0.5) == 0  # one token refilled
+    assert limiter.take("other", now=0.5) == 0  # keys are independent
+    assert limiter.take("u", now=100) == 0 and limiter._buckets["u"][0] == 2  # refill caps at burst
+    assert limiter.throttled == 1
+
+def test_token_bucket_evicts_idle_keys():
+    limiter = api.TokenBucketLimiter(rate=1, burst=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.take(key, now=0)
+    assert list(limiter._buckets) == ["b", "c"]
+
+def test_notify_rate_limited_with_retry_after(live_api, monkeypatch):
+    monkeypatch.setattr(api, "notify_user_limiter", api.TokenBucketLimiter(rate=0.5, burst=2))
+    payload = {"user_id": "flooder", "message": "spam"}
+    codes = [requests.post(f"{live_api}/notify", json=payload).status_code for _ in range(2)]
+    assert codes == [200, 200]
+    throttled = requests.post(f"{live_api}/notify", json=payload)
+    assert throttled.status_code == 429
+    assert throttled.headers["Retry-After"] == "2"
+    assert requests.post(f"{live_api}/notify", json={"user_id": "polite", "message": "hi"}).status_code == 200
+    batch = requests.post(f"{live_api}/notify/batch", json=[payload, {"user_id": "polite", "message": "hi"}]).json()
+    assert batch["accepted"] == 1 and batch["rejected"] == 1
+
+def test_chat_throttle_frame(live_api, monkeypatch):
+    monkeypatch.setattr(api, "chat_user_limiter", api.TokenBucketLimiter(rate=0.1, burst=1))
+    async def scenario():
+        session, ws = await _chat(live_api.replace("http", "ws", 1), "chatty", "quiet")
+        try:
+            await ws.send_str("first")
+            assert json.loads((await ws.receive(timeout=2)).data)["content"] == "first"
+            await ws.send_str("second")
+            frame = json.loads((await ws.receive(timeout=2)).data)
+            assert frame["error"] == "rate_limited" and frame["retry_after"] > 0
+        finally:
+            await session.close()
+    asyncio.run(scenario())
+
+def test_load_shedding(live_api, monkeypatch):
+    monkeypatch.setattr(api.limits, "max_inflight", 0)
+    shed = requests.get(f"{live_api}/notifications")
+    assert shed.status_code == 503 and shed.headers["Retry-After"] == "1"
+    assert requests.get(f"{live_api}/db/version").status_code == 200  # app storage is never shed
+    monkeypatch.setattr(api.limits, "max_inflight", 256)
+    monkeypatch.setattr(api.limits, "max_sockets", 0)
+    async def scenario():
+        async with aiohttp.ClientSession() as session:
+            with pytest.raises(aiohttp.WSServerHandshakeError):
+                await session.ws_connect(f"{live_api.replace('http', 'ws', 1)}/chat/a/b")
+    asyncio.run(scenario())
+
+# Metrics Tests
+def _metric(text, name):
+    return float(next(line.split()[-1] for line in text.splitlines() if line.startswith(name + " ")))
+
+def test_metrics_endpoint(live_api):
+    requests.post(f"{live_api}/notify", json={"user_id": "metrics_user", "message": "observed"})
+    requests.get(f"{live_api}/db/users/{uuid.uuid4()}")
+    async def scenario():
+        session, ws = await _chat(live_api.replace("http", "ws", 1), "metrics_a", "metrics_b")
+        try:
+            await ws.send_str("counted")
+            await ws.receive(timeout=2)
+            return requests.get(f"{live_api}/metrics").text
+        finally:
+            await session.close()
+    text = asyncio.run(scenario())
+    assert "# TYPE studyhive_http_request_duration_seconds histogram" in text
+    assert 'studyhive_http_request_duration_seconds_count{method="POST",route="/notify",status="200"}' in text
+    # Routes are labelled by template, not by the concrete path
+    assert 'route="/db/users/{user_id}",status="404"' in text
+    assert 'le="+Inf"' in text
+    assert _metric(text, 'studyhive_notifications_accepted_total{endpoint="notify"}') >= 1
+    assert _metric(text, "studyhive_chat_messages_routed_total") >= 1
+    assert _metric(text, "studyhive_websocket_connections") >= 1
+    assert _metric(text, "studyhive_notifications_stored") >= 1
+    assert "studyhive_send_queue_depth_max" in text
+    deadline = time.monotonic() + 2
+    while api.active_sockets and time.monotonic() < deadline:  # the server notices the close asynchronously
+        time.sleep(0.05)
+    assert api.active_sockets == 0
+
+def test_histogram_buckets_are_cumulative():
+    hist = api.Histogram("h", "test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        hist.observe(("GET",), value)
+    lines = hist.render(("method",))
+    assert 'h_bucket{method="GET",le="0.1"} 1' in lines
+    assert 'h_bucket{method="GET",le="1.0"} 3' in lines
+    assert 'h_bucket{method="GET",le="+Inf"} 4' in lines
+    assert 'h_count{method="GET"} 4' in lines
+
+# Notification Outbox Tests
+def test_outbox_delivers_in_batches(live_api):
+    outbox = NotificationOutbox(live_api, flush_interval=0.05).start()
+    try:
+        for i in range(20):
+            assert outbox.notify("outbox_user", f"Outbox {i}")
+        assert outbox.flush(timeout=5)
+        stats = outbox.stats()
+        assert stats["sent"] == 20
+        assert stats["batches"] < 20
+        stored = [n for n in requests.get(f"{live_api}/notifications").json() if n["user_id"] == "outbox_user"]
+        assert len(stored) == 20
+    finally:
+        outbox.close()
+    assert outbox.notify("outbox_user", "After close") and outbox.depth() == 1  # queued, not sent to a closed loop
+    outbox.start()
+    try:
+        assert outbox.flush(timeout=5) and outbox.stats()["sent"] == 21
+    finally:
+        outbox.close()
+
+def test_outbox_retries_then_gives_up():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()  # nothing listens here, so every attempt fails
+    outbox = NotificationOutbox(f"http://127.0.0.1:{port}", max_retries=2, backoff_base=0.01).start()
+    try:
+        outbox.notify("user", "lost")
+        assert outbox.flush(timeout=5)
+        stats = outbox.stats()
+        assert stats["retries"] == 2
+        assert stats["failed"] == 1
+    finally:
+        outbox.close()
+
+def test_outbox_overflow_is_bounded():
+    outbox = NotificationOutbox("http://127.0.0.1:9", max_queue=2)  # not started: nothing drains
+    assert outbox.notify("u", "a")
+    assert outbox.notify("u", "b")
+    assert not outbox.notify("u", "c")
+    assert outbox.stats()["overflow"] == 1
+    assert outbox.depth() == 2
+
+# Instrumentation Tests
+def test_timings_percentiles_and_summary():
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 99) == 99
+    registry = Timings(window=50)
+    for ms in range(1, 101):
+        registry.record("page:Home", ms / 1000)
+    with registry.timed("section:fast"):
+        pass
+    rows = registry.summary()
+    assert [r["name"] for r in rows] == ["page:Home", "section:fast"]
+    home = rows[0]
+    assert home["count"] == 100  # all calls are counted, percentiles use the last 50
+    assert home["p50_ms"] == pytest.approx(75)
+    assert home["max_ms"] == pytest.approx(100)
+    registry.reset()
+    assert registry.summary() == []
+
+def test_instrumented_database_times_calls(user):
+    registry = Timings()
+    db = InstrumentedDatabase(Database(), registry)
+    db.add_user(user)
+    assert db.get_user(user.user_id) is user
+    db.get_user(user.user_id)
+    counts = {r["name"]: r["count"] for r in registry.summary()}
+    assert counts == {"db.add_user": 1, "db.get_user": 2}
+    assert db.version == 1  # plain attributes pass through untimed
+
+def test_rerun_profiler_modes(tmp_path, monkeypatch):
+    def render():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        return "done"
+    assert RerunProfiler("cprofile", str(tmp_path)).run(render) == "done"
+    prof = list(tmp_path.glob("*.prof"))
+    assert len(prof) == 1
+    assert any(name == "render" for _, _, name in pstats.Stats(str(prof[0])).stats)
+    RerunProfiler("sample", str(tmp_path), interval=0.001).run(render)
+    folded = list(tmp_path.glob("*.folded"))
+    assert len(folded) == 1 and "render (" in folded[0].read_text()
+    monkeypatch.delenv("STUDYHIVE_PROFILE", raising=False)
+    assert RerunProfiler.from_env() is None
+    with pytest.raises(ValueError):
+        RerunProfiler("trace")
+
+def test_versioned_cache_is_bounded_lru():
+    cache = VersionedCache(maxsize=2)
+    builds = []
+    def build(value):
+        return lambda: builds.append(value) or value
+    assert cache.get("chart", (1,), build("a")) == "a"
+    assert cache.get("chart", (1,), build("unused")) == "a"
+    assert cache.get("chart", (2,), build("b")) == "b"
+    cache.get("chart", (1,), build("unused"))  # refreshes (1,) so (2,) is evicted next
+    assert cache.get("other", (1,), build(None)) is None
+    assert len(cache) == 2 and (cache.hits, cache.misses) == (2, 3)
+    assert cache.get("chart", (2,), build("b2")) == "b2"
+    assert builds == ["a", "b", None, "b2"]
+
+def test_snapshot_data_version_tracks_collections(db, user, community):
+    before = db.snapshot()
+    post = Post(str(uuid.uuid4()), "Tip", user.user_id, community.community_id, "StudyTip")
+    db.add_post(post)
+    after = db.snapshot()
+    assert after.data_version("posts") != before.data_version("posts")
+    db.leaderboard()
+    built = db._rows["leaderboard"]
+    db.add_like(post.post_id, user.user_id)
+    db.add_comment(post.post_id, user.user_id, "Thanks")
+    assert db.snapshot().data_version("posts") == after.data_version("posts")
+    assert db.snapshot().data_version("likes", "comments") == (1, 1)
+    db.leaderboard()
+    assert db._rows["leaderboard"] is built  # likes and comments do not change post counts
+    assert after.data_version("communities", "tasks") == before.data_version("communities", "tasks")
+    db.add_task(Task(str(uuid.uuid4()), user.user_id, "Read", "Done"))
+    assert db.snapshot().data_version("tasks") == (after.data_version("tasks")[0] + 1,)
+    assert db.snapshot().data_version("never_written") == (0,)
+
+# Blob Store Tests
+def _image_bytes(fmt="PNG", size=(300, 200), color=(200, 30, 30)):
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, fmt)
+    return out.getvalue()
+
+def test_blob_store_dedupes_and_thumbnails(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path))
+    data = _image_bytes()
+    blob_id = store.put(data)
+    with monkeypatch.context() as m:
+        m.setattr(Image, "open", lambda *args: pytest.fail("decoded an upload that is already stored"))
+        assert store.put(data) == blob_id and len(blob_id) == 64
+    assert store.read(blob_id) == data
+    for size in BlobStore.SIZES:
+        with Image.open(io.BytesIO(store.read(blob_id, size))) as thumb:
+            assert thumb.size == (size, size) and thumb.format == "JPEG"
+    assert store.put(_image_bytes(color=(0, 0, 255))) != blob_id
+    assert store.path("../../etc/passwd") is None and store.path(blob_id, 999) is None
+    with pytest.raises(ValueError):
+        store.put(b"not an image")
+    with pytest.raises(ValueError):
+        BlobStore(str(tmp_path), max_bytes=10).put(data)
+
+def test_api_serves_blobs_with_cache_headers(live_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "blob_store", BlobStore(str(tmp_path)))
+    upload = requests.post(f"{live_api}/blobs", data=_image_bytes("JPEG"))
+    blob_id = upload.json()["blob_id"]
+    resp = requests.get(f"{live_api}/blobs/{blob_id}", params={"size": 128})
+    assert resp.status_code == 200 and resp.headers["content-type"] == "image/jpeg"
+    assert "immutable" in resp.headers["cache-control"]
+    cached = requests.get(f"{live_api}/blobs/{blob_id}", params={"size": 128},
+                          headers={"If-None-Match": resp.headers["etag"]})
+    assert cached.status_code == 304 and not cached.content
+    assert requests.get(f"{live_api}/blobs/{'0' * 64}").status_code == 404
+    assert requests.post(f"{live_api}/blobs", data=b"junk").status_code == 422
+
+def test_api_refuses_oversized_blobs_while_streaming(live_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "blob_store", BlobStore(str(tmp_path), max_bytes=1000))
+    assert requests.post(f"{live_api}/blobs", data=b"x" * 1001).status_code == 413
+    chunks = (b"x" * 500 for _ in range(100))  # a generator is sent chunked, without a Content-Length
+    assert requests.post(f"{live_api}/blobs", data=chunks).status_code == 413
+    assert requests.post(f"{live_api}/blobs", data=iter([_image_bytes("PNG", size=(8, 8))])).status_code == 200
+
+# Study Material Library Tests
+def _pdf_bytes(pages):
+    # Minimal PDF with one line of Helvetica text per page
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>",
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       f"/Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for n, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+def test_material_library_dedupes_across_communities(tmp_path):
+    library = MaterialLibrary(str(tmp_path))
+    data = "Photosynthesis notes é\n".encode() * 500
+    listing, is_new = library.add(io.BytesIO(data), "bio.txt", "text/plain", "c1", "u1")
+    assert is_new and listing.community_id == "c1"
+    again, is_new = library.add(io.BytesIO(data), "copy.txt", "text/plain", "c1", "u2")
+    assert not is_new and again.name == "bio.txt" and len(library.list("c1")) == 1
+    _, is_new = library.add(io.BytesIO(data), "shared.txt", "text/plain", "c2", "u2")
+    assert not is_new and [l.name for l in library.list("c2")] == ["shared.txt"]
+    stored = [f for f in os.listdir(tmp_path / listing.material_id[:2]) if not f.endswith(".txt")]
+    assert stored == [listing.material_id] and not [f for f in os.listdir(tmp_path) if f.startswith("tmp")]
+
+    material = library.get(listing.material_id)
+    assert material.size == len(data) and material.text_bytes == len(data) and material.pages > 1
+    text = "".join(library.page_text(listing.material_id, page) for page in range(material.pages))
+    assert text == data.decode()
+    assert library.read_text(listing.material_id, 0, 14) == "Photosynthesis"
+
+    reopened = MaterialLibrary(str(tmp_path))
+    assert set(reopened.listings) == {"c1", "c2"}
+    assert reopened.get(listing.material_id).page_offsets == material.page_offsets
+
+def test_material_library_extracts_pdf_pages(tmp_path):
+    library = MaterialLibrary(str(tmp_path))
+    listing, _ = library.add(io.BytesIO(_pdf_bytes(["Cell biology", "Mitochondria"])), "cells.pdf",
+                             "application/pdf", "c1", "u1")
+    assert library.get(listing.material_id).pages == 2
+    assert "Mitochondria" in library.page_text(listing.material_id, 1)
+    broken, _ = library.add(io.BytesIO(b"%PDF-1.4 truncated"), "broken.pdf", "application/pdf", "c1", "u1")
+    assert library.get(broken.material_id).pages == 0 and library.read_text(broken.material_id) == ""
+
+def test_material_index_page_hits_without_reextracting(tmp_path, monkeypatch):
+    library = MaterialLibrary(str(tmp_path))
+    notes, _ = library.add(io.BytesIO(_pdf_bytes(["Cell biology intro", "Mitochondria produce <energy>"])),
+                           "cells.pdf", "application/pdf", "c1", "u1")
+    library.add(io.BytesIO(b"Mitochondria again"), "other.txt", "text/plain", "c2", "u1")
+    index = MaterialIndex(library)
+    assert index.sync() == 2 and index.sync() == 0
+
+    hits = index.search("mitochondria", "c1")
+    assert [(h["material_id"], h["page"]) for h in hits] == [(notes.material_id, 1)]
+    assert '">Mitochondria</b>' in hits[0]["snippet"] and "&lt;energy" in hits[0]["snippet"]
+    assert len(index.search("mitochondria")) == 2 and index.search("mitochondria", "c3") == []
+
+    # Reopened from disk, the index knows what it holds and never runs the extractor again
+    monkeypatch.setattr(materials, "EXTRACTORS", {})
+    monkeypatch.setattr(materials, "pdf_pages", None)
+    reopened = MaterialIndex(MaterialLibrary(str(tmp_path)))
+    assert reopened.indexed == index.indexed and len(reopened.indexed) == 2
+    assert reopened.sync() == 0 and reopened.search("energy", "c1")[0]["page"] == 1
+    index.close()
+    reopened.close()
+
+# Benchmark Suite Tests
+def test_bench_generate_is_seeded():
+    sizes = bench.scaled_sizes(0.001)
+    first, second = bench.generate(sizes, seed=7), bench.generate(sizes, seed=7)
+    assert len(first.users) == sizes["users"] and len(first.posts) == sizes["posts"]
+    assert [p.post_id for p in first.posts] == [p.post_id for p in second.posts]
+    assert len(first.get_tasks()) == sizes["tasks"]
+    assert sum(r["Posts"] for r in bench.leaderboard_rows(first.snapshot())) == sizes["posts"]
+
+def test_bench_suite_and_regression_check(seeded_db):
+    sizes = bench.scaled_sizes(0.001)
+    results = {"meta": {"sizes": sizes}, "results": bench.run_suite(seeded_db, repeat=5)}
+    assert {"add_user", "add_post", "add_like", "get_tasks", "get_notifications", "leaderboard",
+            "chat_history", "feed"} <= set(results["results"])
+    assert bench.compare(results, results) == []
+    faster = json.loads(json.dumps(results))
+    faster["results"]["feed"]["p50_ms"] = results["results"]["feed"]["p50_ms"] / 10 - 1
+    assert [r["name"] for r in bench.compare(results, faster, min_ms=0)] == ["feed"]
+    with pytest.raises(ValueError):
+        bench.compare(results, {"meta": {"sizes": bench.scaled_sizes(0.01)}, "results": {}})
+
+# Columnar Export Tests
+def test_columnar_round_trip(seeded_db, dataset_dir, tmp_path):
+    tables = columnar._tables(seeded_db)
+    assert tables["post_likes"].num_rows == sum(len(p.likes) for p in seeded_db.posts) > 0
+    assert tables["post_comments"].num_rows == sum(len(p.comments) for p in seeded_db.posts) > 0
+    assert seeded_db.archived_rooms and seeded_db.timers and seeded_db.posts_ratings
+    for fmt in columnar.FORMATS:
+        columnar.export_database(seeded_db, str(tmp_path / fmt), fmt)
+        reloaded = columnar._tables(columnar.import_database(str(tmp_path / fmt)))
+        assert all(reloaded[name].equals(table) for name, table in tables.items())
+
+    # Indexes are rebuilt from the loaded data, not replayed
+    post = seeded_db.posts[-1]
+    assert seeded_db.get_post(post.post_id) is post
+    community = next(iter(seeded_db.communities.values()))
+    assert seeded_db.member_count(community.community_id) == len(community.members)
+    seeded_db.add_post(Post(str(uuid.uuid4()), "Again", post.user_id, post.community_id, "StudyTip"))
+    assert [b.name for b in seeded_db.get_badges(post.user_id)].count("First Post") == 1
+    room = next(iter(seeded_db.study_rooms.values()))
+    assert room in seeded_db.upcoming_rooms(room.scheduled_time, room.scheduled_time + timedelta(seconds=1))
+    with pytest.raises(ValueError):
+        seeded_db.load(bogus={})
+
+def test_columnar_tables_are_of_one_version(db, community, monkeypatch):
+    newcomer = FreeUser(str(uuid.uuid4()), "newcomer", "new@example.com")
+    db.add_user(newcomer)
+    writer = threading.Thread(target=db.join_community, args=(newcomer.user_id, community.community_id))
+    columns = columnar._columns
+
+    def join_midway(rows, fields):
+        if fields == ("user_id", "community_id") and writer.ident is None:  # between the membership tables
+            writer.start()
+            writer.join()  # the export holds no lock, so the join lands between the two tables
+            assert db.is_member(newcomer.user_id, community.community_id)
+        return columns(rows, fields)
+
+    monkeypatch.setattr(columnar, "_columns", join_midway)
+    tables = columnar._tables(db)
+    joined = set(zip(tables["user_communities"]["user_id"].to_pylist(),
+                     tables["user_communities"]["community_id"].to_pylist()))
+    members = set(zip(tables["community_members"]["user_id"].to_pylist(),
+                      tables["community_members"]["community_id"].to_pylist()))
+    assert joined == members and (newcomer.user_id, community.community_id) not in members
+    assert db.is_member(newcomer.user_id, community.community_id)
+
+# Load Test Harness Tests
+def test_analytics_folds_only_appended_rows(db, user, premium_user, community):
+    day = datetime(2025, 3, 1, 9)
+    first = Post(str(uuid.uuid4()), "Old tip", user.user_id, community.community_id, "StudyTip", day)
+    first.likes = [premium_user.user_id]  # loaded without a time, like bench data
+    first.comments = [{"user_id": premium_user.user_id, "content": "Thanks", "timestamp": day + timedelta(hours=1)}]
+    db.load(posts=[first], messages=[Message("m1", user.user_id, premium_user.user_id, "Hi", timestamp=day),
+                                     Message("m2", premium_user.user_id, user.user_id, "Hey",
+                                             timestamp=day + timedelta(minutes=10))])
+    db.add_task(Task(str(uuid.uuid4()), user.user_id, "Read", "Done"))
+    db.add_task(Task(str(uuid.uuid4()), user.user_id, "Write", "To-Do"))
+    analytics = EngagementAnalytics()
+    assert analytics.update(db.snapshot()) and not analytics.update(db.snapshot())
+    row = analytics.daily().loc[pd.Timestamp("2025-03-01")]
+    assert (row["active_users"], row["posts"], row["comments"], row["messages"]) == (2, 1, 1, 2)
+    assert row["median_response_min"] == 10 and analytics.undated_likes == 1
+    assert analytics.task_funnel().tolist() == [2, 1, 1]
+
+    # Later writes land in today's bucket; the March day is left as it was
+    post = Post(str(uuid.uuid4()), "New tip", premium_user.user_id, community.community_id, "Exam")
+    db.add_post(post)
+    db.add_like(post.post_id, user.user_id)
+    db.add_comment(post.post_id, user.user_id, "Nice")
+    db.add_message(Message("m3", user.user_id, premium_user.user_id, "Late reply"))
+    buckets = dict(analytics.days)
+    assert analytics.update(db.snapshot())
+    assert analytics.days[pd.Timestamp("2025-03-01")] is buckets[pd.Timestamp("2025-03-01")]
+    today = analytics.daily().loc[pd.Timestamp(datetime.now().date())]
+    assert (today["posts"], today["likes"], today["comments"], today["messages"], today["replies"]) == (1, 1, 1, 1, 0)
+    assert analytics.tag_distribution().to_dict() == {"Exam": 1, "StudyTip": 1}
+    assert analytics.posts_per_community()["posts"].sum() == 2
+
+    # Folding in steps matches one pass over the same data, apart from the like that now has a time
+    fresh = EngagementAnalytics()
+    fresh.update(db.snapshot())
+    pd.testing.assert_frame_equal(fresh.daily(), analytics.daily())
+    assert fresh.undated_likes == 1
+
+    db.load(posts=[], messages=[])
+    assert analytics.update(db.snapshot()) and analytics.daily().empty
+
+def test_analytics_windows_with_message_only_days(db, user, premium_user, community):
+    today = pd.Timestamp.now().floor("D")
+    db.add_post(Post(str(uuid.uuid4()), "Old tip", user.user_id, community.community_id, "StudyTip",
+                     (today - pd.Timedelta(days=3)).to_pydatetime()))
+    db.add_message(Message(str(uuid.uuid4()), user.user_id, premium_user.user_id, "Hi"))
+    analytics = EngagementAnalytics()
+    analytics.update(db.snapshot())
+    assert analytics.tag_distribution().to_dict() == {"StudyTip": 1}
+    assert analytics.posts_per_community()["posts"].tolist() == [1]
+    # A window holding only the message day has no posts at all
+    assert analytics.tag_distribution(today).empty and analytics.posts_per_community(today).empty
+    assert set(analytics_figures(analytics, db.snapshot(), today)) == {"dau", "communities", "tags", "funnel",
+                                                                      "responses"}
+
+def test_loadtest_closed_and_open_workloads(live_api, monkeypatch, tmp_path):
+    for name in ("notify_user_limiter", "notify_ip_limiter", "chat_user_limiter", "chat_ip_limiter"):
+        monkeypatch.setattr(api, name, api.TokenBucketLimiter(rate=1e6, burst=1e6))
+    out = tmp_path / "load.json"
+    report = loadtest.main(["--url", live_api, "--duration", "0.5", "--concurrency", "5", "--users", "20",
+                            "--sockets", "4", "--out", str(out)])
+    assert json.loads(out.read_text()) == report
+    assert set(report["ops"]) == {"notify", "notifications", "chat"}
+    for op in report["ops"].values():
+        assert op["ok"] > 0 and op["error_rate"] == 0
+        assert op["p50_ms"] <= op["p95_ms"] <= op["p99_ms"] <= op["max_ms"]
+    assert report["meta"]["sockets"] == 4 and report["connect"]["count"] == 4
+    report = loadtest.main(["--url", live_api, "--rate", "200", "--duration", "0.5", "--mix", "notify=1"])
+    assert report["meta"]["workload"] == "open" and set(report["ops"]) == {"notify"}
+    assert report["ops"]["notify"]["errors"] == 0
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("notify=1,upload=2")
+
+# Feed Rendering Tests
+def test_feed_reads_only_the_page(db, user, premium_user, community):
+    now = datetime.now()
+    posts = [Post(str(uuid.uuid4()), f"Tip {i}", (user, premium_user)[i % 2].user_id, community.community_id,
+                  "StudyTip", now - timedelta(minutes=i)) for i in range(5)]
+    for post in reversed(posts):
+        db.add_post(post)
+    assert db.posts_page(1, 2) == (5, posts[1:3])
+    assert db.posts_page(4) == (5, posts[4:])
+    assert db.posts_page(0, 10, user_id=premium_user.user_id) == (2, [posts[1], posts[3]])
+    assert list(db.get_users([user.user_id, "missing"])) == [user.user_id]
+    assert db.get_communities([community.community_id]) == {community.community_id: community}
+    assert db.find_community_by_name(community.name) is community and db.find_community_by_name("nope") is None
+    db.add_rating(posts[0].post_id, user.user_id, 4)
+    assert list(db.get_ratings([p.post_id for p in posts])) == [posts[0].post_id]
+    version = db.data_version("users", "posts")
+    assert [row["Username"] for row in db.leaderboard(1)] == [user.username]
+    db.add_post(Post(str(uuid.uuid4()), "Late", premium_user.user_id, community.community_id, "StudyTip"))
+    assert db.data_version("users", "posts") != version
+    assert db.leaderboard()[0]["Posts"] == 3
+
+def test_post_card_is_escaped_and_cached(db, user, community):
+    post = Post(str(uuid.uuid4()), "<script>alert(1)</script>", user.user_id, community.community_id, "StudyTip")
+    db.add_post(post)
+    card = lambda: post_card(db.get_post(post.post_id), db.get_users([user.user_id]), db.get_communities([community.community_id]),
+                             db.get_ratings([post.post_id]))
+    html = card()
+    assert "<script>" not in html and "&lt;script&gt;" in html
+    assert user.username in html and community.name in html and "Likes: 0" in html
+    hits = post_card_html.cache_info().hits
+    assert card() == html
+    assert post_card_html.cache_info().hits == hits + 1
+    db.add_like(post.post_id, user.user_id)
+    assert "Likes: 1" in card()
+
+def test_index_post_adds_only_the_new_post(db, user, community, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("app.get_database", lambda: db)
+    first = Post(str(uuid.uuid4()), "Calculus tips", user.user_id, community.community_id, "StudyTip")
+    db.add_post(first)
+    index_post(first)  # no index yet, so it is built from every post
+    second = Post(str(uuid.uuid4()), "Chemistry notes", user.user_id, community.community_id, "StudyTip")
+    db.add_post(second)
+    monkeypatch.setattr(db, "list_posts", lambda *args: pytest.fail("reindexed every post"))
+    index_post(second)
+    index_post(second)
+    with open_dir("index").searcher() as searcher:
+        assert searcher.doc_count() == 2
+        query = QueryParser("content", searcher.schema).parse("chemistry")
+        assert [hit["post_id"] for hit in searcher.search(query)] == [second.post_id]
 
 # Edge Case Tests
+def test_get_post_by_id(db, user, community):
+    post = Post(str(uuid.uuid4()), "Indexed", user.user_id, community.community_id, "StudyTip")
+    db.add_post(post)
+    assert db.get_post(post.post_id) is post
+    assert db.get_post("missing") is None
+    duplicate = Post(post.post_id, "Duplicate", user.user_id, community.community_id, "StudyTip")
+    db.add_post(duplicate)
+    db.add_like(post.post_id, user.user_id)
+    assert db.get_post(post.post_id).content == "Indexed"  # first post with the id wins
+    assert db.get_post(post.post_id).likes == [user.user_id] and db.posts[1].likes == []
+
+def test_pomodoro_timer_runs_on_timestamps(db, user):
+    timer = db.get_timer(user.user_id, now=0)
+    assert not timer.running and timer.seconds_left(0) == 1500 and timer.mode == "Work"
+    db.toggle_timer(user.user_id, now=0)
+    assert db.get_timer(user.user_id, now=100).seconds_left(100) == 1400
+    paused = db.toggle_timer(user.user_id, now=100)
+    assert not paused.running and paused.seconds_left(5000) == 1400  # paused time does not count
+    db.toggle_timer(user.user_id, now=200)
+    version = db.version
+    assert db.get_timer(user.user_id, now=1000).running
+    assert db.version == version  # reading a running timer is not a write
+    finished = db.get_timer(user.user_id, now=1600)
+    assert (finished.mode, finished.running, finished.sessions_completed) == ("Break", False, 1)
+    assert finished.seconds_left(1600) == 300
+
+def test_pomodoro_master_badge_after_fourth_session(db, user):
+    now = 0
+    for _ in range(8):
+        for phase in (1500, 300):  # work, then break
+            db.toggle_timer(user.user_id, now=now)
+            now += phase
+            db.get_timer(user.user_id, now=now)
+    assert db.get_timer(user.user_id, now=now).sessions_completed == 8
+    assert [b.name for b in db.get_badges(user.user_id)].count("Pomodoro Master") == 1
+
 def test_duplicate_post(db, user, community):
     post_id = str(uuid.uuid4())
     post1 = Post(post_id, "Duplicate", user.user_id, community.community_id, "StudyTip")
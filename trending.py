@@ -0,0 +1,100 @@
+import bisect
+import heapq
+import math
+from datetime import datetime, timedelta
+
+# Decayed score sum(weight * exp(-rate * (now - t))), stored as log(sum(weight * exp(rate * t))):
+# it ranks posts the same at any `now` and only grows, so each feed keeps just its TOP_K best
+HALF_LIFE = timedelta(hours=24)
+TOP_K = 100
+POST_WEIGHT = 1.0  # being posted, so new posts start out ahead of stale ones
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+RATING_WEIGHT = 1.5  # per user who rated; changing a rating is not new engagement
+
+# Event times are taken as seconds since EPOCH. Subtracting a naive datetime is several
+# times cheaper than datetime.timestamp(), which goes through the local time zone.
+EPOCH = datetime(2000, 1, 1)
+
+def _seconds(when):
+    return (when - EPOCH).total_seconds()
+
+def _logaddexp(a, b):
+    hi, lo = (a, b) if a >= b else (b, a)
+    return hi + math.log1p(math.exp(lo - hi))
+
+# The `k` highest-scoring posts of one feed, lowest first
+class TopK:
+    def __init__(self, k):
+        self.k = k
+        self._entries = []  # (log score, post_id), sorted
+        self._scores = {}  # post_id -> log score, for posts in _entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def offer(self, post_id, score):
+        old = self._scores.get(post_id)
+        if old is not None:
+            del self._entries[bisect.bisect_left(self._entries, (old, post_id))]
+        elif len(self._entries) >= self.k:
+            if score <= self._entries[0][0]:
+                return
+            del self._scores[self._entries.pop(0)[1]]
+        bisect.insort(self._entries, (score, post_id))
+        self._scores[post_id] = score
+
+    # (post_id, log score), best first
+    def best(self, limit=None):
+        entries = self._entries[::-1] if limit is None else self._entries[:-limit - 1:-1]
+        return [(post_id, score) for score, post_id in entries]
+
+# Per-post scores plus the top-K of each community and of all posts (community None)
+class TrendingIndex:
+    def __init__(self, half_life=HALF_LIFE, k=TOP_K):
+        self.rate = math.log(2) / half_life.total_seconds()
+        self.k = k
+        self.scores = {}  # post_id -> log score
+        self._feeds = {None: TopK(k)}  # community_id, None for the global feed -> TopK
+
+    def add(self, post_id, community_id, when, weight):
+        event = math.log(weight) + self.rate * _seconds(when)
+        old = self.scores.get(post_id)
+        score = self.scores[post_id] = event if old is None else _logaddexp(old, event)
+        self._feeds[None].offer(post_id, score)
+        feed = self._feeds.get(community_id)
+        if feed is None:
+            feed = self._feeds[community_id] = TopK(self.k)
+        feed.offer(post_id, score)
+
+    def add_post(self, post):
+        self.add(post.post_id, post.community_id, post.timestamp, POST_WEIGHT)
+
+    # Scores every post from scratch; likes and raters keep no time, so they count as of the post
+    def rebuild(self, posts, ratings):
+        rate = self.rate
+        comment_weight = math.log(COMMENT_WEIGHT)
+        self.scores = {}
+        by_community = {}
+        for post in posts:
+            rated = ratings.get(post.post_id)
+            weight = POST_WEIGHT + LIKE_WEIGHT * len(post.likes) + RATING_WEIGHT * (rated.count if rated else 0)
+            score = math.log(weight) + rate * _seconds(post.timestamp)
+            for comment in post.comments:
+                score = _logaddexp(score, comment_weight + rate * _seconds(comment["timestamp"]))
+            self.scores[post.post_id] = score
+            by_community.setdefault(post.community_id, []).append(post.post_id)
+        self._feeds = {}
+        for community_id, post_ids in [(None, self.scores), *by_community.items()]:
+            feed = self._feeds[community_id] = TopK(self.k)
+            for post_id in heapq.nlargest(self.k, post_ids, key=self.scores.__getitem__):
+                feed.offer(post_id, self.scores[post_id])
+
+    # (post_id, log score) best first, from the community's feed or the global one
+    def top(self, community_id=None, limit=None):
+        feed = self._feeds.get(community_id)
+        return feed.best(limit) if feed else []
+
+    # A stored log score as the decayed score it stands for at `now`
+    def decayed(self, score, now):
+        return math.exp(score - self.rate * _seconds(now))